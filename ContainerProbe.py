@@ -0,0 +1,460 @@
+import array
+import os
+import struct
+import sys
+from FFmpegUtil import FFmpegUtil
+
+
+class ContainerProbe:
+    """
+    不启动 ffprobe, 直接读取 MP4 (moov / trak) 和 Matroska (EBML 头 / Info / Tracks) 的文件头,
+    得到与 FFmpegUtil.ffmpeg_video_info 相同格式的视频信息 (时长 大小 编码 分辨率 帧率 码率)。
+    只处理常见的情况, 其他情况 (分片 MP4, 没有时长, 没有音频, 不认识的编码 ...) read 返回 None,
+    video_info 退回 ffprobe, 由 ffprobe 给出结果 或者 报错。
+    与 ffprobe 的差别:
+        MP4 的 时长 / 帧率 / 码率 与 ffprobe 一样由 mvhd mdhd stts stsz 计算, 不考虑 edit list
+        Matroska 的 帧率来自 DefaultDuration, 视频码率为 文件大小 / 时长 (与 ffprobe 没有流码率时相同)
+    """
+    max_header_size = 64 * 1024 * 1024  # moov / Tracks 超过这个大小 不读, 交给 ffprobe
+
+    mp4_video_codecs = {b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc', b'av01': 'av1',
+                        b'vp09': 'vp9'}
+    mp4_audio_codecs = {b'ac-3': 'ac3', b'ec-3': 'eac3', b'Opus': 'opus', b'fLaC': 'flac', b'.mp3': 'mp3',
+                        b'alac': 'alac'}
+    mp4_object_types = {0x40: 'aac', 0x66: 'aac', 0x67: 'aac', 0x68: 'aac', 0x69: 'mp3', 0x6B: 'mp3'}
+    mkv_video_codecs = {'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc', 'V_AV1': 'av1', 'V_VP9': 'vp9',
+                        'V_VP8': 'vp8'}
+    mkv_audio_codecs = {'A_AAC': 'aac', 'A_AC3': 'ac3', 'A_EAC3': 'eac3', 'A_OPUS': 'opus', 'A_FLAC': 'flac',
+                        'A_VORBIS': 'vorbis', 'A_MPEG/L3': 'mp3', 'A_DTS': 'dts', 'A_TRUEHD': 'truehd'}
+    # H.264 中 avcC 带有 chroma_format / bit_depth 扩展的 profile
+    avc_high_profiles = (100, 110, 122, 144, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+    @staticmethod
+    def video_info(file_path, timeout=None):
+        # 读不了文件头时 使用 ffprobe, timeout 为 ffprobe 的超时秒数
+        info = ContainerProbe.read(file_path)
+        if info is None:
+            info = FFmpegUtil.ffmpeg_video_info(file_path, timeout=timeout)
+        return info
+
+    @staticmethod
+    def read(file_path):
+        """
+        :return: 与 ffmpeg_video_info 相同的 dict, 不能处理的文件 返回 None
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                head = f.read(12)
+                f.seek(0)
+                if head[:4] == b'\x1a\x45\xdf\xa3':
+                    return ContainerProbe._read_mkv(f, file_path)
+                if head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+                    return ContainerProbe._read_mp4(f, file_path)
+        except (OSError, ValueError, IndexError, KeyError, struct.error, ZeroDivisionError):
+            pass    # 文件头损坏 或者 格式不常见, 交给 ffprobe
+        return None
+
+    @staticmethod
+    def pix_fmt(chroma_format, bit_depth):
+        # chroma_format: 0 单色 / 1 4:2:0 / 2 4:2:2 / 3 4:4:4, 命名与 ffmpeg 相同
+        base = {0: 'gray', 1: 'yuv420p', 2: 'yuv422p', 3: 'yuv444p'}[chroma_format]
+        if bit_depth == 8:
+            return base
+        if bit_depth in (10, 12):
+            return f"{base}{bit_depth}le"
+        raise ValueError(f"unsupported bit depth: {bit_depth}")
+
+    @staticmethod
+    def codec_pix_fmt(codec, config):
+        """
+        从编码的配置 (avcC / hvcC / av1C / vpcC 的内容) 得到像素格式
+        """
+        if codec == 'h264':
+            # avcC: version, profile, compatibility, level, length_size, SPS 列表, PPS 列表, (high profile 的扩展)
+            profile, pos = config[1], 5
+            for count_mask in (0x1f, 0xff):     # SPS 个数只用低 5 位
+                count = config[pos] & count_mask
+                pos += 1
+                for _ in range(count):
+                    pos += 2 + struct.unpack_from('>H', config, pos)[0]
+            if profile in ContainerProbe.avc_high_profiles and len(config) >= pos + 3:
+                return ContainerProbe.pix_fmt(config[pos] & 0x03, (config[pos + 1] & 0x07) + 8)
+            return 'yuv420p'
+        if codec == 'hevc':
+            return ContainerProbe.pix_fmt(config[16] & 0x03, (config[17] & 0x07) + 8)
+        if codec == 'av1':
+            flags = config[2]
+            bit_depth = (12 if flags & 0x20 else 10) if flags & 0x40 else 8
+            if flags & 0x10:
+                return ContainerProbe.pix_fmt(0, bit_depth)
+            subsampling = (flags >> 2) & 0x03
+            return ContainerProbe.pix_fmt({3: 1, 2: 2, 0: 3}[subsampling], bit_depth)
+        if codec == 'vp9':
+            # vpcC: version + flags(4), profile, level, bitDepth(4) chromaSubsampling(3) fullRange(1)
+            bit_depth, chroma = config[6] >> 4, (config[6] >> 1) & 0x07
+            return ContainerProbe.pix_fmt({0: 1, 1: 1, 2: 2, 3: 3}[chroma], bit_depth)
+        raise ValueError(f"unsupported codec: {codec}")
+
+    @staticmethod
+    def build_info(file_path, duration, video, audio, encoder, format_bit_rate):
+        # 与 ffmpeg_video_info 相同的字段和类型 (ffprobe 的 json 中 时长 大小 码率 采样率 为字符串)
+        audio_bitrate = int(audio.get('bit_rate', 0))
+        return {
+            "file_path": file_path,
+            "duration": f"{duration:.6f}",
+            "size": str(os.path.getsize(file_path)),
+            "encoder": encoder,
+            "video_codec": video['codec_name'],
+            "video_width": video['width'],
+            "video_height": video['height'],
+            "video_pix_fmt": video['pix_fmt'],
+            "video_bit_rate": video.get('bit_rate', format_bit_rate - audio_bitrate),
+            "video_fps": video['fps'],
+            "audio_codec": audio['codec_name'],
+            "audio_sample_rate": audio['sample_rate'],
+            "audio_bit_rate": audio_bitrate,
+        }
+
+    # ---------------- MP4 ----------------
+
+    @staticmethod
+    def _boxes(data, start=0, end=None):
+        # 遍历 data[start:end] 中的 box, 得到 (类型, 内容开始, 内容结束)
+        end = len(data) if end is None else end
+        pos = start
+        while pos + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', data, pos)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', data, pos + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header or pos + size > end:
+                raise ValueError("broken mp4 box")
+            yield box_type, pos + header, pos + size
+            pos += size
+
+    @staticmethod
+    def _child(data, start, end, *path):
+        # 按路径找到第一个子 box, 找不到时返回 None
+        for box_type, body, box_end in ContainerProbe._boxes(data, start, end):
+            if box_type == path[0]:
+                if len(path) == 1:
+                    return body, box_end
+                return ContainerProbe._child(data, body, box_end, *path[1:])
+        return None
+
+    @staticmethod
+    def _find_moov(f):
+        file_size = os.fstat(f.fileno()).st_size
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            size, box_type = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header:
+                return None
+            if box_type == b'moov':
+                if size > ContainerProbe.max_header_size:
+                    return None
+                f.seek(pos + header)
+                return f.read(size - header)    # 只返回 moov 的内容
+            pos += size     # 跳过 mdat 等, moov 可能在文件末尾
+        return None
+
+    @staticmethod
+    def _read_mp4(f, file_path):
+        moov = ContainerProbe._find_moov(f)
+        if moov is None:
+            return None
+        mvhd = ContainerProbe._child(moov, 0, len(moov), b'mvhd')
+        if mvhd is None:
+            return None
+        if moov[mvhd[0]] == 1:
+            timescale, duration = struct.unpack_from('>IQ', moov, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', moov, mvhd[0] + 12)
+        if timescale == 0 or duration == 0:     # 分片 MP4 的时长在 moof 中
+            return None
+        video = audio = None
+        for box_type, body, box_end in ContainerProbe._boxes(moov):
+            if box_type != b'trak':
+                continue
+            track = ContainerProbe._mp4_track(moov, body, box_end)
+            if track is None:
+                continue
+            if track['codec_type'] == 'video' and video is None:
+                video = track
+            elif track['codec_type'] == 'audio' and audio is None:
+                audio = track
+        if video is None or audio is None:
+            return None
+        encoder = None
+        ilst = ContainerProbe._child(moov, 0, len(moov), b'udta', b'meta')
+        if ilst is not None:    # meta 是 full box, 子 box 从第 4 个字节开始
+            item = ContainerProbe._child(moov, ilst[0] + 4, ilst[1], b'ilst', b'\xa9too', b'data')
+            if item is not None:
+                encoder = moov[item[0] + 8:item[1]].decode('utf8', errors='replace')
+        return ContainerProbe.build_info(file_path, duration / timescale, video, audio, encoder, 0)
+
+    @staticmethod
+    def _mp4_track(data, start, end):
+        mdia = ContainerProbe._child(data, start, end, b'mdia')
+        hdlr = ContainerProbe._child(data, *mdia, b'hdlr')
+        handler = data[hdlr[0] + 8:hdlr[0] + 12]
+        if handler not in (b'vide', b'soun'):
+            return None
+        mdhd = ContainerProbe._child(data, *mdia, b'mdhd')
+        if data[mdhd[0]] == 1:
+            timescale, duration = struct.unpack_from('>IQ', data, mdhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', data, mdhd[0] + 12)
+        stbl = ContainerProbe._child(data, *mdia, b'minf', b'stbl')
+        stsd = ContainerProbe._child(data, *stbl, b'stsd')
+        entry_type, entry, entry_end = next(ContainerProbe._boxes(data, stsd[0] + 8, stsd[1]))
+        stts = ContainerProbe._child(data, *stbl, b'stts')
+        frames = delta_sum = 0
+        for i in range(struct.unpack_from('>I', data, stts[0] + 4)[0]):
+            count, delta = struct.unpack_from('>II', data, stts[0] + 8 + i * 8)
+            frames += count
+            delta_sum += count * delta
+        stsz = ContainerProbe._child(data, *stbl, b'stsz')
+        sample_size, sample_count = struct.unpack_from('>II', data, stsz[0] + 4)
+        if sample_size:
+            stream_bytes = sample_size * sample_count
+        else:
+            # 长视频有几十万个 sample, 用 array 一次转换 比 struct 快得多
+            sizes = array.array('I', data[stsz[0] + 12:stsz[0] + 12 + sample_count * 4])
+            if sys.byteorder == 'little':
+                sizes.byteswap()
+            stream_bytes = sum(sizes)
+        if timescale == 0 or duration == 0:
+            return None
+        # ffprobe 的流码率 = 流的字节数 / 流的时长, json 中为字符串
+        track = {'bit_rate': str(int(stream_bytes * 8 * timescale / duration))}
+        if handler == b'vide':
+            codec = ContainerProbe.mp4_video_codecs.get(entry_type)
+            if codec is None or delta_sum == 0:
+                return None
+            config_type = {'h264': b'avcC', 'hevc': b'hvcC', 'av1': b'av1C', 'vp9': b'vpcC'}[codec]
+            config = ContainerProbe._child(data, entry + 78, entry_end, config_type)
+            track.update(codec_type='video', codec_name=codec,
+                         width=struct.unpack_from('>H', data, entry + 24)[0],
+                         height=struct.unpack_from('>H', data, entry + 26)[0],
+                         pix_fmt=ContainerProbe.codec_pix_fmt(codec, data[config[0]:config[1]]),
+                         fps=frames * timescale // delta_sum)
+        else:
+            version = struct.unpack_from('>H', data, entry + 8)[0]
+            if version > 1:     # QuickTime v2 的采样率是 double, 不常见
+                return None
+            children = entry + (28 if version == 0 else 44)
+            codec = ContainerProbe.mp4_audio_codecs.get(entry_type)
+            if entry_type == b'mp4a':
+                esds = ContainerProbe._child(data, children, entry_end, b'esds')
+                codec = ContainerProbe.mp4_object_types.get(ContainerProbe._esds_object_type(data, *esds))
+            if codec is None:
+                return None
+            track.update(codec_type='audio', codec_name=codec,
+                         sample_rate=str(struct.unpack_from('>I', data, entry + 24)[0] >> 16))
+        return track
+
+    @staticmethod
+    def _esds_object_type(data, start, end):
+        # esds: full box, ES_Descriptor(0x03) 中的 DecoderConfigDescriptor(0x04) 的 objectTypeIndication
+        pos = start + 4
+
+        def descriptor(pos):
+            tag = data[pos]
+            pos += 1
+            for _ in range(4):  # 长度 每个字节 7 位
+                byte = data[pos]
+                pos += 1
+                if not byte & 0x80:
+                    break
+            return tag, pos
+
+        tag, pos = descriptor(pos)
+        if tag != 0x03:
+            return None
+        flags = data[pos + 2]
+        pos += 3
+        if flags & 0x80:
+            pos += 2
+        if flags & 0x40:
+            pos += 1 + data[pos]
+        if flags & 0x20:
+            pos += 2
+        tag, pos = descriptor(pos)
+        return data[pos] if tag == 0x04 and pos < end else None
+
+    # ---------------- Matroska ----------------
+
+    @staticmethod
+    def _vint(data, pos, keep_marker=False):
+        # EBML 变长整数, 返回 (值, 下一个位置); 大小全为 1 表示未知大小, 返回 None
+        first = data[pos]
+        length = 1
+        while length <= 8 and not first & (0x80 >> (length - 1)):
+            length += 1
+        if length > 8:
+            raise ValueError("broken ebml vint")
+        value = first if keep_marker else first & (0xff >> length)
+        for byte in data[pos + 1:pos + length]:
+            value = (value << 8) | byte
+        if not keep_marker and value == (1 << (7 * length)) - 1:
+            value = None
+        return value, pos + length
+
+    @staticmethod
+    def _elements(data, start=0, end=None):
+        # 遍历 data[start:end] 中的 EBML 元素, 得到 (ID, 内容开始, 内容结束)
+        end = len(data) if end is None else end
+        pos = start
+        while pos < end:
+            element_id, pos = ContainerProbe._vint(data, pos, keep_marker=True)
+            size, pos = ContainerProbe._vint(data, pos)
+            if size is None or pos + size > end:
+                raise ValueError("broken ebml element")
+            yield element_id, pos, pos + size
+            pos += size
+
+    @staticmethod
+    def _uint(data, start, end):
+        return int.from_bytes(data[start:end], 'big')
+
+    @staticmethod
+    def _float(data, start, end):
+        return struct.unpack('>f' if end - start == 4 else '>d', data[start:end])[0]
+
+    @staticmethod
+    def _read_element_header(f):
+        # 从文件中读取一个元素头, 返回 (ID, 大小), 文件结束时返回 (None, None)
+        head = f.read(12)
+        if len(head) < 2:
+            return None, None
+        element_id, pos = ContainerProbe._vint(head, 0, keep_marker=True)
+        size, pos = ContainerProbe._vint(head, pos)
+        f.seek(pos - len(head), os.SEEK_CUR)
+        return element_id, size
+
+    @staticmethod
+    def _read_mkv(f, file_path):
+        element_id, size = ContainerProbe._read_element_header(f)
+        header = f.read(size)
+        doc_type = None
+        for child_id, start, end in ContainerProbe._elements(header):
+            if child_id == 0x4282:
+                doc_type = header[start:end].rstrip(b'\x00').decode('ascii')
+        if doc_type not in ('matroska', 'webm'):
+            return None
+        element_id, segment_size = ContainerProbe._read_element_header(f)
+        if element_id != 0x18538067:
+            return None
+        # 按顺序读 Segment 的子元素, 只读取 Info / Tracks / Tags 的内容, 遇到第一个 Cluster 停止
+        parts = {}
+        while True:
+            element_id, size = ContainerProbe._read_element_header(f)
+            if element_id is None or element_id == 0x1F43B675 or size is None:
+                break
+            if element_id in (0x1549A966, 0x1654AE6B, 0x1254C367):
+                if size > ContainerProbe.max_header_size:
+                    return None
+                parts.setdefault(element_id, f.read(size))
+            else:
+                f.seek(size, os.SEEK_CUR)
+        info, tracks = parts.get(0x1549A966), parts.get(0x1654AE6B)
+        if info is None or tracks is None:
+            return None
+        timecode_scale, duration = 1000000, None
+        for child_id, start, end in ContainerProbe._elements(info):
+            if child_id == 0x2AD7B1:
+                timecode_scale = ContainerProbe._uint(info, start, end)
+            elif child_id == 0x4489:
+                duration = ContainerProbe._float(info, start, end)
+        if not duration:
+            return None
+        duration = duration * timecode_scale / 1e9
+        video = audio = None
+        for child_id, start, end in ContainerProbe._elements(tracks):
+            if child_id != 0xAE:
+                continue
+            track = ContainerProbe._mkv_track(tracks, start, end)
+            if track is None:
+                continue
+            if track['codec_type'] == 'video' and video is None:
+                video = track
+            elif track['codec_type'] == 'audio' and audio is None:
+                audio = track
+        if video is None or audio is None:
+            return None
+        encoder = None
+        if 0x1254C367 in parts:
+            encoder = ContainerProbe._mkv_encoder_tag(parts[0x1254C367])
+        format_bit_rate = int(os.path.getsize(file_path) * 8 / duration)
+        return ContainerProbe.build_info(file_path, duration, video, audio, encoder, format_bit_rate)
+
+    @staticmethod
+    def _mkv_track(data, start, end):
+        fields = {}
+        for child_id, body, body_end in ContainerProbe._elements(data, start, end):
+            fields[child_id] = (body, body_end)
+        track_type = ContainerProbe._uint(data, *fields[0x83]) if 0x83 in fields else None
+        codec_id = data[slice(*fields[0x86])].rstrip(b'\x00').decode('ascii') if 0x86 in fields else ''
+        if track_type == 1:
+            codec = ContainerProbe.mkv_video_codecs.get(codec_id)
+            if codec is None or 0x23E383 not in fields or 0xE0 not in fields:
+                return None
+            video = {}
+            for child_id, body, body_end in ContainerProbe._elements(data, *fields[0xE0]):
+                video[child_id] = (body, body_end)
+            if codec in ('h264', 'hevc', 'av1'):
+                pix_fmt = ContainerProbe.codec_pix_fmt(codec, data[slice(*fields[0x63A2])])
+            else:   # VP8 / VP9 没有 CodecPrivate, 只看 Colour 中的位深
+                bit_depth = 8
+                if 0x55B0 in video:
+                    for child_id, body, body_end in ContainerProbe._elements(data, *video[0x55B0]):
+                        if child_id == 0x55B2:
+                            bit_depth = ContainerProbe._uint(data, body, body_end) or 8
+                pix_fmt = ContainerProbe.pix_fmt(1, bit_depth)
+            # 与 ffmpeg 的 matroska 解析相同: 帧率 = 1 秒 / DefaultDuration
+            return {'codec_type': 'video', 'codec_name': codec,
+                    'width': ContainerProbe._uint(data, *video[0xB0]),
+                    'height': ContainerProbe._uint(data, *video[0xBA]),
+                    'pix_fmt': pix_fmt,
+                    'fps': int(1e9 // ContainerProbe._uint(data, *fields[0x23E383]))}
+        if track_type == 2:
+            codec = ContainerProbe.mkv_audio_codecs.get(codec_id.split('/')[0] if codec_id.startswith('A_AAC')
+                                                        else codec_id)
+            if codec is None:
+                return None
+            sample_rate = 8000.0    # Matroska 的默认值
+            if 0xE1 in fields:
+                for child_id, body, body_end in ContainerProbe._elements(data, *fields[0xE1]):
+                    if child_id == 0xB5:
+                        sample_rate = ContainerProbe._float(data, body, body_end)
+            return {'codec_type': 'audio', 'codec_name': codec, 'sample_rate': str(int(sample_rate))}
+        return None
+
+    @staticmethod
+    def _mkv_encoder_tag(data):
+        # 整个文件的 (Targets 中没有 TagTrackUID) ENCODER 标签
+        for tag_id, start, end in ContainerProbe._elements(data):
+            if tag_id != 0x7373:
+                continue
+            global_tag, encoder = True, None
+            for child_id, body, body_end in ContainerProbe._elements(data, start, end):
+                if child_id == 0x63C0:
+                    global_tag = all(x[0] != 0x63C5 for x in ContainerProbe._elements(data, body, body_end))
+                elif child_id == 0x67C8:
+                    simple = {x[0]: data[x[1]:x[2]] for x in ContainerProbe._elements(data, body, body_end)}
+                    if simple.get(0x45A3, b'').upper() == b'ENCODER' and 0x4487 in simple:
+                        encoder = simple[0x4487].decode('utf8', errors='replace')
+            if global_tag and encoder is not None:
+                return encoder
+        return None
@@ -1,8 +1,10 @@
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileSystemEvent, LoggingEventHandler
 from configparser import ConfigParser
-import logging, os, re, time
+import logging, os, re, time, json
+import socket
 import sqlite3
+import threading
+import queue
+from concurrent.futures import Future
 from FFmpegUtil import FFmpegUtil
 import functools
 
@@ -33,10 +35,13 @@ def retry_on_database_locked(retries=3, delay=1):
 
 
 class MyDB:
-    def __init__(self, db_path, print_to_area):
+    def __init__(self, db_path, print_to_area, journal_mode='WAL'):
         self.db_path = db_path
         self.print_area = print_to_area
+        # WAL 需要同一台机器上的共享内存, 多台机器通过网络文件系统 (SMB / NFS) 共用一个库时 必须使用 DELETE
+        self.journal_mode = journal_mode
         self.conn_list = []     # 保存初始化过的链接
+        self.writer = None      # DBWriter, start_writer 之后 写操作通过 submit 交给写线程
 
     def get_conn(self):
         conn = sqlite3.connect(self.db_path)
@@ -56,6 +61,14 @@ class MyDB:
         self.print_area(f"start init sqlite db: {self.db_path}", color="green")
         conn = self.get_conn()
         cursor = conn.cursor()
+        # WAL 模式: 读不会阻塞写, 写也不会阻塞 streamlit 页面的读 (设置会保存在库文件中)
+        # 从 WAL 改回 DELETE 时 不能有其他进程正在使用这个库
+        try:
+            mode = cursor.execute(f'PRAGMA journal_mode={self.journal_mode}').fetchone()[0]
+        except sqlite3.OperationalError as e:
+            mode = str(e)
+        if mode.lower() != self.journal_mode.lower():
+            self.print_area(f"无法把数据库的 journal_mode 设置为 {self.journal_mode}: {mode}", color="red")
         # 需要保存啥？
         # 1. Run_Task_Record 运行过的 任务列表 + 运行结果
         # 2. Video_File_State 文件名称 + video 信息， 用于补充 run task 的输入文件的信息·
@@ -109,11 +122,159 @@ class MyDB:
             )
         ''')
 
+        # 分段转码时 每一段的运行记录, 一个 Run_Task_Record 对应多个分段
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Run_Segment_Record" (
+                id INTEGER PRIMARY KEY autoincrement,
+                run_record_id INTEGER,        -- 外键 Run_Task_Record 的id
+                segment_index INTEGER,        -- 第几段
+                segment_start REAL,           -- 分段在原视频中的开始时间(秒)
+                segment_end REAL,             -- 分段在原视频中的结束时间(秒)
+                cmd TEXT,
+                start_running_time INTEGER,
+                end_running_time INTEGER,
+                output_has_error BOOLEAN
+            )
+        ''')
+
+        # probe + hash 结果缓存, 文件的 (路径, 大小, 修改时间) 都没变时 直接复用, 不再 ffprobe
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Probe_Cache" (
+                file_path TEXT PRIMARY KEY,       -- 文件全路径
+                file_size INTEGER,                -- 文件大小 (os.stat)
+                mtime_ns INTEGER,                 -- 文件修改时间 纳秒 (os.stat)
+                v_info TEXT,                      -- ffmpeg_video_info 的结果 json
+                file_sample_sha256 TEXT,          -- cal_sample_sha256 的结果
+                create_time INTEGER,
+                last_hit_time INTEGER             -- 最后一次命中的时间 用于淘汰
+            )
+        ''')
+
+        # 旧版本的库中 没有这些列, 补上
+        self.add_column_if_missing(cursor, "Video_File_State", "file_fingerprint", "TEXT")  # 快速指纹 包含文件大小
+        self.add_column_if_missing(cursor, "Video_File_State", "file_full_sha256", "TEXT")  # 全文件sha256 后台计算
+        self.add_column_if_missing(cursor, "Probe_Cache", "file_fingerprint", "TEXT")
+        # 任务状态日志: 每个输入文件一行, 记录当前状态, 用于崩溃后恢复
+        # 启动时还是 running 的任务 说明上一次运行被中断了
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Task_Journal" (
+                file_path TEXT PRIMARY KEY,     -- 输入文件 全路径
+                state TEXT,                     -- queued / running / succeeded / failed / skipped
+                dstfile_path TEXT,              -- 输出文件, running 时记录 用于删除未完成的输出
+                segment_dir TEXT,               -- 分段转码的中间文件目录
+                run_record_id INTEGER,          -- 外键 Run_Task_Record 的id
+                owner TEXT,                     -- 主机名:进程id
+                attempt_count INTEGER,          -- 开始运行的次数
+                update_time INTEGER
+            )
+        ''')
+        # 抽样预检的结果, 同一个文件 用同一种编码方式和质量 只抽样一次
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Preflight_Result" (
+                file_fingerprint TEXT,          -- 输入文件的快速指纹
+                profile TEXT,                   -- 编码方式名称
+                quality TEXT,                   -- 质量参数
+                sample_seconds REAL,            -- 一共抽样编码了多少秒
+                predicted_size INTEGER,         -- 按抽样结果 推算的输出文件大小
+                ratio REAL,                     -- predicted_size / 输入文件大小
+                create_time INTEGER,
+                PRIMARY KEY (file_fingerprint, profile, quality)
+            )
+        ''')
+        # 分布式模式的任务表: 协调节点加入任务, 各个 worker 节点用租约领取, 见 JobLease.JobStore
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Job_Lease" (
+                file_path TEXT PRIMARY KEY,     -- 输入文件 全路径 (所有节点上 相同)
+                file_size INTEGER,
+                mtime_ns INTEGER,
+                state TEXT,                     -- pending / leased / done / failed
+                owner TEXT,                     -- 持有租约的 worker, 主机名:进程id
+                lease_expire REAL,              -- 租约到期时间, 到期后 其他 worker 可以领取
+                heartbeat_time REAL,            -- 最后一次续约时间
+                progress_seconds REAL,          -- 已经转码的秒数
+                duration REAL,                  -- 视频总时长
+                attempt_count INTEGER,          -- 领取次数
+                enqueue_time REAL,
+                update_time REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Job_Control" (
+                name TEXT PRIMARY KEY,          -- enqueue_done: 协调节点是否已经加入了所有任务
+                value TEXT
+            )
+        ''')
+        # 每个 ffmpeg 进程的资源使用 和 转码速度, 见 TaskTelemetry; 分段转码时 每一段一条记录
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "Run_Task_Telemetry" (
+                id INTEGER PRIMARY KEY autoincrement,
+                run_record_id INTEGER,          -- 外键 Run_Task_Record 的id
+                segment_record_id INTEGER,      -- 外键 Run_Segment_Record 的id, 不是分段时为空
+                task_kind TEXT,                 -- file / segment / concat
+                wall_seconds REAL,              -- 运行时长
+                cpu_seconds REAL,               -- 用户态+内核态 CPU 秒数
+                cpu_percent REAL,               -- 平均 CPU 使用率, 多线程时 超过 100
+                peak_rss INTEGER,               -- 内存峰值 (字节)
+                read_bytes INTEGER,             -- 从存储读取的字节数
+                write_bytes INTEGER,            -- 写入存储的字节数
+                encoded_seconds REAL,           -- 转码了多少秒视频
+                avg_speed REAL,                 -- encoded_seconds / wall_seconds
+                min_speed REAL,                 -- 采样到的最低 speed
+                avg_fps REAL,
+                bitrate_kbps REAL,              -- 输出的平均码率
+                sample_count INTEGER,
+                series TEXT,                    -- 降采样后的时间序列 json: {"columns": [...], "rows": [[...], ...]}
+                create_time INTEGER
+            )
+        ''')
+        self.create_indexes(cursor)
+
         # 提交事务
         conn.commit()
         logging.info(f'db {self.db_path} init done..')
         conn.close()
 
+    def start_writer(self, batch_size=200):
+        self.writer = DBWriter(self.db_path, self.print_area, batch_size).start()
+        return self.writer
+
+    def submit(self, func, *args):
+        """
+        把写操作交给写线程执行, 返回 Future, 结果为 func 的返回值 (例如插入记录的 id)。
+        func 的第一个参数是写线程的连接, 例如 db.submit(db.record_start_run, vfile_id, cmd, path)。
+        args 中可以直接传入之前 submit 返回的 Future, 写线程执行时会替换为它的结果,
+        所以依赖前一个写操作 id 的写操作 不需要等待。
+        """
+        return self.writer.submit(func, *args)
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    @staticmethod
+    def add_column_if_missing(cursor, table, column, column_type):
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN {column} {column_type}')
+
+    @staticmethod
+    def create_indexes(cursor):
+        # 去重查询 和 各表之间 join 用到的列
+        for index_name, table, column in [
+            ("idx_video_file_state_sample_sha256", "Video_File_State", "file_sample_sha256"),
+            ("idx_video_file_state_fingerprint", "Video_File_State", "file_fingerprint"),
+            ("idx_video_file_state_file_path", "Video_File_State", "file_path"),
+            ("idx_run_task_record_video_file_id", "Run_Task_Record", "video_file_id"),
+            ("idx_run_task_record_output_video_file_id", "Run_Task_Record", "output_video_file_id"),
+            ("idx_run_segment_record_run_record_id", "Run_Segment_Record", "run_record_id"),
+            ("idx_bypass_file_log_last_video_file_id", "ByPass_File_Log", "last_video_file_id"),
+            ("idx_task_journal_state", "Task_Journal", "state"),
+            ("idx_job_lease_state", "Job_Lease", "state"),
+            ("idx_run_task_telemetry_run_record_id", "Run_Task_Telemetry", "run_record_id"),
+        ]:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON "{table}" ({column})')
+
     @staticmethod
     def insert_ByPass_File_Log(conn, task, vfile_id, pass_reason):
         cursor = conn.cursor()
@@ -133,6 +294,100 @@ class MyDB:
               task['file_path'], task['sha256'], int(time.time()), vfile_id, pass_reason))
         conn.commit()
 
+    @staticmethod
+    def insert_ByPass_File_Log_many(conn, rows):
+        """
+        批量记录略过的文件, 一次 executemany
+        :param rows: [(file_path, file_size, sha256, vfile_id, pass_reason), ...]
+        """
+        now = int(time.time())
+        cursor = conn.cursor()
+        cursor.executemany('''
+            insert into "ByPass_File_Log" (
+                file_name,
+                file_size,
+                file_path,
+                file_sample_sha256,
+                create_task_time,
+                last_video_file_id,
+                pass_reason
+            ) values (
+                ?,?,?,?,?,?,?
+            )
+        ''', [(os.path.basename(file_path), file_size, file_path, sha256, now, vfile_id, pass_reason)
+              for file_path, file_size, sha256, vfile_id, pass_reason in rows])
+        conn.commit()
+
+    @staticmethod
+    def find_done_files(conn, stat_rows):
+        """
+        一次查询找出 已经转码成功 且 文件没有变化 的文件:
+        (路径, 大小, 修改时间) 与 Probe_Cache 一致 -> 得到缓存的指纹 -> 与成功运行过的 Video_File_State 比较,
+        指纹的比较规则与 check_success_sha256 相同。不需要 ffprobe 也不需要读文件内容。
+        :param stat_rows: [(file_path, file_size, mtime_ns), ...]
+        :return: {file_path: (sha256, video_file_id, file_name, run_record_id)}
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS "Prefilter_Candidate" (
+                file_path TEXT PRIMARY KEY,
+                file_size INTEGER,
+                mtime_ns INTEGER
+            )
+        ''')
+        # 临时表的写入 会在 conn 上开启事务, 查询完必须 rollback:
+        # conn 是主循环一直使用的连接, 不结束事务 之后只能读到这个时刻的快照, 并且 WAL 无法 checkpoint
+        try:
+            cursor.execute('delete from temp."Prefilter_Candidate"')
+            cursor.executemany('''
+                insert or replace into temp."Prefilter_Candidate" (file_path, file_size, mtime_ns) values (?,?,?)
+            ''', stat_rows)
+            # 两种匹配分开写再 union, 每一部分都能用上索引
+            cursor.execute('''
+                select file_path, file_sample_sha256, video_file_id, file_name, min(run_record_id) from (
+                    select cc.file_path, pc.file_sample_sha256, vv.id as video_file_id, vv.file_name, rr.id as run_record_id
+                    from temp."Prefilter_Candidate" cc
+                    join "Probe_Cache" pc on pc.file_path=cc.file_path
+                        and pc.file_size=cc.file_size and pc.mtime_ns=cc.mtime_ns
+                    join "Video_File_State" vv on vv.file_fingerprint=pc.file_fingerprint
+                    join "Run_Task_Record" rr on rr.video_file_id=vv.id
+                    where rr.output_has_error=False
+                    union all
+                    select cc.file_path, pc.file_sample_sha256, vv.id, vv.file_name, rr.id
+                    from temp."Prefilter_Candidate" cc
+                    join "Probe_Cache" pc on pc.file_path=cc.file_path
+                        and pc.file_size=cc.file_size and pc.mtime_ns=cc.mtime_ns
+                    join "Video_File_State" vv on vv.file_sample_sha256=pc.file_sample_sha256
+                    join "Run_Task_Record" rr on rr.video_file_id=vv.id
+                    where rr.output_has_error=False
+                        and (vv.file_fingerprint is null or pc.file_fingerprint is null)
+                ) group by file_path
+            ''')
+            done = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        finally:
+            conn.rollback()
+        return done
+
+    @staticmethod
+    def find_succeeded_outputs(conn, output_paths, chunk_size=500):
+        """
+        成功的运行记录 (output_video_file_id) 指向的输出文件: 只有这些 才能因为输出文件已存在而略过,
+        失败 / 中断的运行留下的输出文件 不算
+        :return: {输出文件路径: 记录的文件大小}
+        """
+        output_paths = list(output_paths)
+        cursor = conn.cursor()
+        found = {}
+        for i in range(0, len(output_paths), chunk_size):
+            chunk = output_paths[i:i + chunk_size]
+            cursor.execute(f'''
+                select oo.file_path, cast(oo.file_size as integer) from "Video_File_State" oo
+                join "Run_Task_Record" rr on rr.output_video_file_id=oo.id
+                where rr.output_has_error=False and oo.file_path in ({','.join('?' * len(chunk))})
+            ''', chunk)
+            found.update(cursor.fetchall())
+        return found
+
     def check_same_sha256(self, conn, sha256_str):
         cursor = conn.cursor()
         cursor.execute('''
@@ -144,15 +399,25 @@ class MyDB:
         rows = cursor.fetchall()
         return rows
 
-    def check_success_sha256(self, conn, sha256_str):
+    def check_success_sha256(self, conn, sha256_str, fingerprint=None):
         # 返回执行成功的 sha256 相同  的记录
+        # 传入 fingerprint 时 按快速指纹比较, 旧版本没有指纹的记录 仍然按 sample sha256 比较
         cursor = conn.cursor()
-        cursor.execute('''
-            select vv.id, vv.file_name,rr.id from "Video_File_State" vv
-            left join "Run_Task_Record" rr on vv.id=rr.video_file_id
-            where  vv.file_sample_sha256=?
-                and rr.output_has_error=False
-        ''', (sha256_str,))
+        if fingerprint is None:
+            cursor.execute('''
+                select vv.id, vv.file_name,rr.id from "Video_File_State" vv
+                left join "Run_Task_Record" rr on vv.id=rr.video_file_id
+                where  vv.file_sample_sha256=?
+                    and rr.output_has_error=False
+            ''', (sha256_str,))
+        else:
+            cursor.execute('''
+                select vv.id, vv.file_name,rr.id from "Video_File_State" vv
+                left join "Run_Task_Record" rr on vv.id=rr.video_file_id
+                where  (vv.file_fingerprint=?
+                        or (vv.file_fingerprint is null and vv.file_sample_sha256=?))
+                    and rr.output_has_error=False
+            ''', (fingerprint, sha256_str))
 
         rows = cursor.fetchall()
         if len(rows) > 0:
@@ -179,6 +444,7 @@ class MyDB:
                 file_size,                -- '文件大小',
                 file_path,                   -- '文件全路径',
                 file_sample_sha256,          -- '文件sha256简单版本！',
+                file_fingerprint,
                 video_duration,
                 video_encoder,
                 video_codec,
@@ -191,10 +457,10 @@ class MyDB:
                 audio_sample_rate,
                 audio_bit_rate    
             ) values (
-                ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
+                ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
             )
         ''', (int(time.time()), os.path.basename(state['file_path']), state['size'], state['file_path'],
-              sha256_str, state['duration'], state['encoder'], state['video_codec'],
+              sha256_str, info_and_sha256.get('fingerprint'), state['duration'], state['encoder'], state['video_codec'],
               state['video_width'], state['video_height'], state['video_pix_fmt'], state['video_bit_rate'],
               state['video_fps'], state['audio_codec'], state['audio_sample_rate'],state['audio_bit_rate'] )
         )
@@ -202,6 +468,15 @@ class MyDB:
         video_file_id = cursor.lastrowid
         return video_file_id
 
+    @retry_on_database_locked()
+    def update_full_sha256(self, conn, video_file_id, full_sha256):
+        # 后台计算完 全文件sha256 后 补充到文件记录中
+        cursor = conn.cursor()
+        cursor.execute('''
+            update "Video_File_State" set file_full_sha256=? where id=?
+        ''', (full_sha256, video_file_id))
+        conn.commit()
+
     def record_start_run(self, conn,video_file_id, cmd, running_output_path):
         """
         记录 视频文件 开始运行cmd
@@ -235,6 +510,428 @@ class MyDB:
         ''', (has_error, int(time.time()), out_vfile_id, run_record_id ))
         conn.commit()
 
+    def journal_task(self, conn, file_path, state, dstfile_path=None, segment_dir=None, run_record_id=None):
+        # 更新一个任务的状态, 每次进入 running 时 attempt_count 加一
+        self.journal_tasks(conn, [(file_path, state, dstfile_path, segment_dir, run_record_id)])
+
+    @staticmethod
+    def journal_tasks(conn, rows):
+        """
+        批量更新任务状态
+        :param rows: [(file_path, state, dstfile_path, segment_dir, run_record_id), ...]
+        """
+        now = int(time.time())
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        cursor = conn.cursor()
+        cursor.executemany('''
+            insert into "Task_Journal" (
+                file_path, state, dstfile_path, segment_dir, run_record_id, owner, attempt_count, update_time
+            ) values (?,?,?,?,?,?,?,?)
+            on conflict(file_path) do update set
+                state=excluded.state,
+                dstfile_path=excluded.dstfile_path,
+                segment_dir=excluded.segment_dir,
+                run_record_id=excluded.run_record_id,
+                owner=excluded.owner,
+                attempt_count=attempt_count + excluded.attempt_count,
+                update_time=excluded.update_time
+        ''', [(file_path, state, dstfile_path, segment_dir, run_record_id, owner,
+               1 if state == TaskState.RUNNING else 0, now)
+              for file_path, state, dstfile_path, segment_dir, run_record_id in rows])
+        conn.commit()
+
+    @staticmethod
+    def find_interrupted_tasks(conn):
+        # 上一次运行中断时 还在运行 / 还在校验输出文件 的任务
+        cursor = conn.cursor()
+        cursor.execute('''
+            select file_path, dstfile_path, segment_dir, run_record_id, owner, state from "Task_Journal"
+            where state in (?, ?)
+        ''', (TaskState.RUNNING, TaskState.VERIFYING))
+        return cursor.fetchall()
+
+    @staticmethod
+    def find_run_input(conn, run_record_id):
+        # 运行记录的输入文件: (sample sha256, 快速指纹, video_file_id, 文件名), 没有时返回 None
+        cursor = conn.cursor()
+        cursor.execute('''
+            select vv.file_sample_sha256, vv.file_fingerprint, vv.id, vv.file_name from "Run_Task_Record" rr
+            join "Video_File_State" vv on vv.id=rr.video_file_id
+            where rr.id=?
+        ''', (run_record_id,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def close_interrupted_runs(conn, file_paths, run_record_ids):
+        # 中断的运行记录 标记为出错, 任务重新进入 queued
+        now = int(time.time())
+        cursor = conn.cursor()
+        cursor.executemany('''
+            update "Run_Task_Record" set output_has_error=True, end_running_time=?
+            where id=? and end_running_time is null
+        ''', [(now, x) for x in run_record_ids])
+        cursor.executemany('''
+            update "Run_Segment_Record" set output_has_error=True, end_running_time=?
+            where run_record_id=? and end_running_time is null
+        ''', [(now, x) for x in run_record_ids])
+        cursor.executemany('''
+            update "Task_Journal" set state=?, update_time=? where file_path=?
+        ''', [(TaskState.QUEUED, now, x) for x in file_paths])
+        conn.commit()
+
+    def record_start_segment(self, conn, run_record_id, task):
+        """
+        记录 一个分段 开始运行
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            insert into "Run_Segment_Record" (
+                run_record_id,
+                segment_index,
+                segment_start,
+                segment_end,
+                cmd,
+                start_running_time,
+                end_running_time,
+                output_has_error
+            ) values (?,?,?,?,?,?,?,?)
+        ''', (run_record_id, task['segment_index'], task['segment_start'], task['segment_end'],
+              " ".join(task['command']), int(time.time()), None, None))
+        conn.commit()
+        return cursor.lastrowid
+
+    def record_end_segment(self, conn, segment_record_id, has_error):
+        cursor = conn.cursor()
+        cursor.execute('''
+            update "Run_Segment_Record"
+            set
+                output_has_error = ?,
+                end_running_time = ?
+            where id=?
+        ''', (has_error, int(time.time()), segment_record_id))
+        conn.commit()
+
+    @staticmethod
+    def record_task_telemetry(conn, run_record_id, segment_record_id, task_kind, summary, series):
+        """
+        记录 一个 ffmpeg 进程的运行数据
+        :param summary: TelemetryRecorder.summary 的结果
+        :param series: TelemetryRecorder.series_json 的结果
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            insert into "Run_Task_Telemetry" (
+                run_record_id, segment_record_id, task_kind, wall_seconds, cpu_seconds, cpu_percent, peak_rss,
+                read_bytes, write_bytes, encoded_seconds, avg_speed, min_speed, avg_fps, bitrate_kbps,
+                sample_count, series, create_time
+            ) values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ''', (run_record_id, segment_record_id, task_kind, summary['wall_seconds'], summary['cpu_seconds'],
+              summary['cpu_percent'], summary['peak_rss'], summary['read_bytes'], summary['write_bytes'],
+              summary['encoded_seconds'], summary['avg_speed'], summary['min_speed'], summary['avg_fps'],
+              summary['bitrate_kbps'], summary['sample_count'], series, int(time.time())))
+        conn.commit()
+        return cursor.lastrowid
+
+
+class TaskState:
+    # Task_Journal 中的任务状态
+    QUEUED = 'queued'           # 已经加入任务队列, 还没有开始
+    RUNNING = 'running'         # 正在转码, 启动时还是这个状态 说明上一次运行被中断
+    VERIFYING = 'verifying'     # ffmpeg 已经正常退出, 正在校验输出文件; 启动时还是这个状态 输出文件可能是完整的
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'         # 已经处理过 或 不需要处理
+
+
+class SuccessIndex:
+    """
+    已经转码成功的输入文件, 启动时用一次查询从库中读出, 之后每次转码成功时 add。
+    lookup 与 MyDB.check_success_sha256 的规则相同: 按快速指纹比较, 旧版本没有指纹的记录 按 sample sha256 比较。
+    值为 (video_file_id, file_name, run_record_id), id 可以是 DBWriter 返回的 Future。
+    """
+
+    def __init__(self):
+        self.by_fingerprint = {}
+        self.by_legacy_sha256 = {}  # 没有指纹的旧记录
+        self.by_sha256 = {}         # 所有记录, 调用者没有指纹时使用
+        self.lock = threading.Lock()    # 写失败的 Future 在写线程中回调 discard
+
+    def load(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            select vv.file_sample_sha256, vv.file_fingerprint, vv.id, vv.file_name, rr.id from "Video_File_State" vv
+            join "Run_Task_Record" rr on vv.id=rr.video_file_id
+            where rr.output_has_error=False
+            order by rr.id
+        ''')
+        for sha256_str, fingerprint, vfile_id, file_name, record_id in cursor.fetchall():
+            self.add(sha256_str, fingerprint, vfile_id, file_name, record_id)
+        return self
+
+    def add(self, sha256_str, fingerprint, vfile_id, file_name, record_id):
+        value = (vfile_id, file_name, record_id)
+        with self.lock:
+            # 与原来的查询一样 返回最早的一条记录
+            self.by_sha256.setdefault(sha256_str, value)
+            if fingerprint is None:
+                self.by_legacy_sha256.setdefault(sha256_str, value)
+            else:
+                self.by_fingerprint.setdefault(fingerprint, value)
+        for x in value:
+            if isinstance(x, Future):
+                # 写入失败时 库中没有这条成功记录, 从索引中去掉
+                x.add_done_callback(lambda future: self.discard(value) if future.exception() is not None else None)
+
+    def discard(self, value):
+        with self.lock:
+            for index in (self.by_sha256, self.by_legacy_sha256, self.by_fingerprint):
+                for key in [k for k, v in index.items() if v is value]:
+                    del index[key]
+
+    def lookup(self, sha256_str, fingerprint=None):
+        if fingerprint is None:
+            value = self.by_sha256.get(sha256_str)
+        else:
+            value = self.by_fingerprint.get(fingerprint) or self.by_legacy_sha256.get(sha256_str)
+        if value is None:
+            return [None, None, None]
+        try:
+            return [x.result() if isinstance(x, Future) else x for x in value]
+        except Exception:   # 写入失败的记录 (done-callback 可能还没有执行), 当作没有找到
+            self.discard(value)
+            return [None, None, None]
+
+    def __len__(self):
+        return len(self.by_sha256)
+
+
+class _BatchConnection:
+    # 写线程中 传给 MyDB 各个写方法的连接: commit 不做任何事, 由写线程在一批操作完成后统一 commit
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, *args):
+        return self.conn.executemany(*args)
+
+    def commit(self):
+        pass
+
+
+class DBWriter:
+    """
+    单线程写数据库。
+    所有写操作放入队列, 由唯一的写线程按顺序执行; 队列中积攒的操作 (最多 batch_size 个) 在同一个事务中执行,
+    只 commit 一次。主循环提交写操作后不需要等待 fsync。
+    每个写操作返回一个 Future, 在所在的事务 commit 之后才设置结果, 拿到结果时 其他连接一定能读到这次写入。
+    """
+
+    def __init__(self, db_path, print_to_area, batch_size=200):
+        self.db_path = db_path
+        self.print_area = print_to_area
+        self.batch_size = batch_size
+        self.op_queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="DBWriter", daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, func, *args):
+        future = Future()
+        self.op_queue.put((func, args, future))
+        return future
+
+    def flush(self, timeout=None):
+        # 等待之前提交的写操作 全部 commit
+        return self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=None):
+        # 执行完队列中剩下的写操作 然后结束写线程
+        self.op_queue.put(None)
+        self.thread.join(timeout)
+
+    @staticmethod
+    def _resolve(arg):
+        # 同一个写线程之前的操作返回的 Future: 使用已经执行出的结果 (可能还没有 commit)
+        # 之前的操作失败时 依赖它的操作也失败, 不能用 None 代替 (会写入指向不存在记录的行)
+        if isinstance(arg, Future):
+            if hasattr(arg, 'db_error'):
+                raise arg.db_error
+            if hasattr(arg, 'db_value'):
+                return arg.db_value
+            return arg.result()
+        return arg
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if conn.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal':
+            conn.execute('PRAGMA synchronous=NORMAL')   # WAL 模式下 NORMAL 不会损坏数据库, 只在 checkpoint 时 fsync
+        batch_conn = _BatchConnection(conn)
+        closing = False
+        while not closing:
+            batch = [self.op_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.op_queue.get(block=False))
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [op for op in batch if op is not None]
+            results = []
+            for func, args, future in batch:
+                try:
+                    value = func(batch_conn, *[self._resolve(a) for a in args])
+                    future.db_value = value
+                    results.append((future, value, None))
+                except Exception as e:
+                    future.db_error = e
+                    self.print_area(f"数据库写入失败: {getattr(func, '__name__', func)}, {e}", color='red')
+                    results.append((future, None, e))
+            try:
+                self._commit(conn)
+            except Exception as e:
+                conn.rollback()
+                self.print_area(f"数据库批量写入失败: {e}", color='red')
+                results = [(future, None, error or e) for future, value, error in results]
+                for future, value, error in results:
+                    future.db_error = error     # 这一批的结果已经回滚, 之后依赖它们的操作也失败
+            for future, value, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(value)
+        conn.close()
+
+    @retry_on_database_locked()
+    def _commit(self, conn):
+        conn.commit()
+
+
+class ProbeCache:
+    """
+    ffprobe + sample sha256 结果的持久化缓存, 保存在 Probe_Cache 表中。
+    key 为 (file_path, file_size, mtime_ns), 其中任何一项改变都视为文件已变化, 缓存失效并重新 probe。
+    启动时一次性把表读入内存, 查询只访问内存; 新结果和命中时间 攒起来由 flush 批量写回。
+    淘汰策略: 超过 max_age_days 天没有命中的记录删除, 总数超过 max_entries 时 删除最久没有命中的。
+    """
+    hit_time_resolution = 24 * 3600  # 命中时间 一天内只回写一次, 避免每次运行都改写整张表
+
+    def __init__(self, db_path, max_entries=100000, max_age_days=90):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.entries = {}       # file_path -> [file_size, mtime_ns, v_info_json, sha256, last_hit_time, fingerprint]
+        self.dirty_rows = {}    # file_path -> 需要写回的行
+        self.hit_paths = set()  # 命中过 需要更新 last_hit_time 的路径
+        self.hit_count = 0
+        self.miss_count = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                select file_path, file_size, mtime_ns, v_info, file_sample_sha256, last_hit_time, file_fingerprint
+                from "Probe_Cache"
+            ''')
+            with self.lock:
+                for row in cursor.fetchall():
+                    self.entries[row[0]] = list(row[1:])
+        finally:
+            conn.close()
+        return self
+
+    def get(self, file_path, stat_result):
+        """
+        :return: (v_info, sha256, fingerprint), 缓存不存在 或 文件已变化 时返回 None
+                 旧版本的缓存没有 fingerprint, 此时 fingerprint 为 None
+        """
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry is None or entry[0] != stat_result.st_size or entry[1] != stat_result.st_mtime_ns:
+                self.miss_count += 1
+                return None
+            self.hit_count += 1
+            if int(time.time()) - (entry[4] or 0) > self.hit_time_resolution:
+                self.hit_paths.add(file_path)
+            v_info_json, sha256, fingerprint = entry[2], entry[3], entry[5]
+        return json.loads(v_info_json), sha256, fingerprint
+
+    def put(self, file_path, stat_result, v_info, sha256, fingerprint):
+        now = int(time.time())
+        row = [stat_result.st_size, stat_result.st_mtime_ns, json.dumps(v_info, ensure_ascii=False), sha256, now,
+               fingerprint]
+        with self.lock:
+            self.entries[file_path] = row
+            self.dirty_rows[file_path] = row
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.dirty_rows)
+
+    @retry_on_database_locked()
+    def flush(self):
+        # 把新写入的缓存 和 命中时间 批量写回数据库, 然后执行淘汰
+        with self.lock:
+            dirty_rows = self.dirty_rows
+            hit_paths = self.hit_paths - dirty_rows.keys()
+            self.dirty_rows = {}
+            self.hit_paths = set()
+        now = int(time.time())
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                insert or replace into "Probe_Cache" (
+                    file_path, file_size, mtime_ns, v_info, file_sample_sha256, create_time, last_hit_time,
+                    file_fingerprint
+                ) values (?,?,?,?,?,?,?,?)
+            ''', [(path, *row[:4], now, row[4], row[5]) for path, row in dirty_rows.items()])
+            cursor.executemany('''
+                update "Probe_Cache" set last_hit_time=? where file_path=?
+            ''', [(now, path) for path in hit_paths])
+            self.evict(cursor, now)
+            conn.commit()
+        except Exception:
+            # 写回失败 下次 flush 时重试
+            with self.lock:
+                for path, row in dirty_rows.items():
+                    self.dirty_rows.setdefault(path, row)
+                self.hit_paths |= hit_paths
+            raise
+        finally:
+            conn.close()
+
+    def evict(self, cursor, now):
+        cursor.execute('''
+            delete from "Probe_Cache" where last_hit_time < ?
+        ''', (now - self.max_age_days * 24 * 3600,))
+        cursor.execute('''
+            delete from "Probe_Cache" where file_path in (
+                select file_path from "Probe_Cache" order by last_hit_time desc limit -1 offset ?
+            )
+        ''', (self.max_entries,))
+
+    def invalidate(self, file_path):
+        # 手动让某个文件的缓存失效, 同时从内存和库中删除
+        with self.lock:
+            self.entries.pop(file_path, None)
+            self.dirty_rows.pop(file_path, None)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('delete from "Probe_Cache" where file_path=?', (file_path,))
+            conn.commit()
+        finally:
+            conn.close()
 
 
 def my_print(*args, color='black'):
@@ -0,0 +1,257 @@
+import os
+import shlex
+
+
+class EncoderProfile:
+    """
+    一种编码方式: 编码器 + 参数 + 输出文件名
+    args / input_args / filter / output_tag 中的 {quality} 替换为实际使用的质量参数
+    """
+
+    def __init__(self, name, encoder, args=(), input_args=(), video_filter=None, audio_args=('-c:a', 'copy'),
+                 quality=None, output_tag='{name}_q{quality}', output_ext='.mp4'):
+        self.name = name
+        self.encoder = encoder
+        self.args = list(args)
+        self.input_args = list(input_args)     # 放在 -i 之前, 例如硬件设备
+        self.video_filter = video_filter
+        self.audio_args = list(audio_args)
+        self.quality = quality                  # 这个编码方式的默认质量, None 时使用 [Output] global_quality
+        self.output_tag = output_tag
+        self.output_ext = output_ext
+
+    @staticmethod
+    def _fill(values, quality):
+        return [str(v).replace('{quality}', str(quality)) for v in values]
+
+    def command(self, file_path, dstfile_path, quality, input_args=(), output_args=()):
+        # input_args 放在 -i 之前 (例如 -ss), output_args 放在输出文件之前 (例如 -t)
+        vf = ['-vf', self.video_filter.replace('{quality}', str(quality))] if self.video_filter else []
+        return [
+            'ffmpeg',
+            '-hide_banner',
+            '-nostats', '-progress', 'pipe:1',  # 进度以 key=value 的形式输出到 stdout, stderr 只剩诊断信息
+            *self._fill(self.input_args, quality),
+            *input_args,
+            '-i', file_path,
+            *vf,
+            '-c:v', self.encoder, *self._fill(self.args, quality),
+            *self.audio_args,
+            *output_args,
+            dstfile_path, '-y'
+        ]
+
+    def output_path(self, file_path, output_dir, quality):
+        # 与旧版本 filepath_to_av1 的规则相同: 去掉扩展名, 加上 (标记) 和新的扩展名
+        filename = os.path.basename(file_path).split('.')[:-1]
+        tag = self.output_tag.replace('{name}', self.name).replace('{quality}', str(quality))
+        filename.extend([f'({tag})', self.output_ext])
+        return os.path.join(output_dir, ''.join(filename))
+
+
+class _KeepMissing(dict):
+    # reason 中 不认识的占位符 原样保留
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+class ProfileRule:
+    """
+    选择编码方式的规则, 按配置中的顺序匹配, 第一条满足所有条件的规则生效
+    条件 (没有配置的条件不检查):
+        min_width / max_width / min_height / max_height / min_fps / max_fps
+        min_bpp / max_bpp:          每个像素的码率 video_bit_rate / (宽 × 高), 与旧版本 bit_per_pixel 相同
+        min_bitrate / max_bitrate:  视频码率 bit/s
+        codecs / not_codecs:        源视频编码, 逗号分隔, 例如 h264,mpeg4
+    动作:
+        skip = true:    不转码, 记录 reason (可以使用 {bpp} {width} {height} {fps} {codec} {bitrate} {file_path})
+        profile / quality: 使用的编码方式 和 质量参数, 没有配置时 使用默认的编码方式 / 编码方式自己的质量
+    区间都是 min <= x < max
+    """
+    ranges = ('width', 'height', 'fps', 'bpp', 'bitrate')
+
+    def __init__(self, name, conditions=None, profile=None, quality=None, skip=False, reason=None):
+        self.name = name
+        self.conditions = conditions or {}
+        self.profile = profile
+        self.quality = quality
+        self.skip = skip
+        self.reason = reason or f"匹配规则 {name}, 不转码"
+
+    @staticmethod
+    def video_facts(v_info):
+        width = int(v_info.get('video_width') or 0)
+        height = int(v_info.get('video_height') or 0)
+        bitrate = int(v_info.get('video_bit_rate') or 0)
+        return {
+            'width': width,
+            'height': height,
+            'fps': float(v_info.get('video_fps') or 0),
+            'bitrate': bitrate,
+            # 每个像素占用了多少比特流
+            'bpp': bitrate / (width * height) if width * height > 0 else 0.0,
+            'codec': str(v_info.get('video_codec') or '').lower(),
+        }
+
+    def format_reason(self, file_path, facts):
+        # reason 是用户配置的文本, 占位符写错时 (例如 {} {0} {name.x}) 使用原文, 不能让调度循环出错
+        try:
+            return self.reason.format_map(_KeepMissing(facts, file_path=file_path))
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return self.reason
+
+    def match(self, facts):
+        for key in self.ranges:
+            low = self.conditions.get(f'min_{key}')
+            high = self.conditions.get(f'max_{key}')
+            if low is not None and facts[key] < low:
+                return False
+            if high is not None and facts[key] >= high:
+                return False
+        codecs = self.conditions.get('codecs')
+        if codecs and facts['codec'] not in codecs:
+            return False
+        not_codecs = self.conditions.get('not_codecs')
+        if not_codecs and facts['codec'] in not_codecs:
+            return False
+        return True
+
+
+class ProfileEngine:
+    """
+    根据 ffprobe 得到的视频信息 为每个文件选择编码方式和质量, 或者决定不转码。
+    配置 (config.ini 中的 section, 没有配置时使用内置的编码方式和规则, 结果与旧版本相同):
+        [Profiles]
+        default = qsv_hevc
+        [Profile:名称]
+        encoder = libx265
+        args = -preset medium -crf {quality}
+        input_args / filter / audio_args / quality / output_tag / output_ext
+        [Rule:名称]
+        max_bpp = 1
+        skip = true
+    """
+
+    @staticmethod
+    def builtin_profiles():
+        return {
+            # 旧版本的命令和输出文件名 (文件名中的 qsvav1 只是历史原因, 实际编码为 hevc)
+            'qsv_hevc': EncoderProfile('qsv_hevc', 'hevc_qsv',
+                                       ['-preset', 'fast', '-global_quality', '{quality}', '-look_ahead', '1'],
+                                       output_tag='qsvav1_gq{quality}'),
+            'qsv_av1': EncoderProfile('qsv_av1', 'av1_qsv', ['-preset', 'fast', '-global_quality', '{quality}'],
+                                      output_tag='av1qsv_gq{quality}'),
+            'vaapi_hevc': EncoderProfile('vaapi_hevc', 'hevc_vaapi', ['-qp', '{quality}'],
+                                         input_args=['-vaapi_device', '/dev/dri/renderD128'],
+                                         video_filter='format=nv12,hwupload',
+                                         output_tag='vaapihevc_qp{quality}'),
+            'x265': EncoderProfile('x265', 'libx265', ['-preset', 'medium', '-crf', '{quality}'],
+                                   output_tag='x265_crf{quality}'),
+            'svtav1': EncoderProfile('svtav1', 'libsvtav1', ['-preset', '8', '-crf', '{quality}'],
+                                     output_tag='svtav1_crf{quality}'),
+        }
+
+    @staticmethod
+    def builtin_rules():
+        # 旧版本唯一的略过规则: 原文件已经很糊了
+        return [ProfileRule('low_bpp', {'max_bpp': 1.0}, skip=True,
+                            reason="原文件已经很糊了 bit_per_pixel为:{bpp} 文件:{file_path}, path:{file_path}")]
+
+    def __init__(self, global_quality, profiles=None, rules=None, default_profile='qsv_hevc'):
+        self.global_quality = global_quality
+        self.profiles = self.builtin_profiles()
+        self.profiles.update(profiles or {})
+        self.rules = self.builtin_rules() if rules is None else rules
+        if default_profile not in self.profiles:
+            raise ValueError(f"unknown encoder profile: {default_profile}, must be one of {list(self.profiles)}")
+        for rule in self.rules:
+            if rule.profile is not None and rule.profile not in self.profiles:
+                raise ValueError(f"rule {rule.name} uses unknown encoder profile: {rule.profile}")
+        self.default_profile = default_profile
+
+    @staticmethod
+    def parse_quality(value):
+        """
+        配置中的质量参数 转换成与 [Output] global_quality 相同的类型: "22" "22.0" -> 22, "22.5" -> 22.5,
+        同一个质量 不会因为类型不同 在预检缓存 和 输出文件名中 变成两个值; 空值为 None, 不是数字时 保留原文
+        """
+        if value is None or str(value).strip() == '':
+            return None
+        value = str(value).strip()
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() else number
+
+    @staticmethod
+    def from_config(config, global_quality):
+        profiles = {}
+        rules = []
+        for section in config.sections():
+            if section.startswith('Profile:'):
+                name = section[len('Profile:'):].strip()
+                sec = config[section]
+                profiles[name] = EncoderProfile(
+                    name, sec.get('encoder'),
+                    args=shlex.split(sec.get('args', '')),
+                    input_args=shlex.split(sec.get('input_args', '')),
+                    video_filter=sec.get('filter') or None,
+                    audio_args=shlex.split(sec.get('audio_args', '-c:a copy')),
+                    quality=ProfileEngine.parse_quality(sec.get('quality')),
+                    output_tag=sec.get('output_tag', '{name}_q{quality}'),
+                    output_ext=sec.get('output_ext', '.mp4'),
+                )
+            elif section.startswith('Rule:'):
+                sec = config[section]
+                conditions = {}
+                for key in ProfileRule.ranges:
+                    for bound in ('min', 'max'):
+                        if sec.get(f'{bound}_{key}'):
+                            conditions[f'{bound}_{key}'] = sec.getfloat(f'{bound}_{key}')
+                for key in ('codecs', 'not_codecs'):
+                    if sec.get(key):
+                        conditions[key] = {x.strip().lower() for x in sec.get(key).split(',') if x.strip()}
+                rules.append(ProfileRule(
+                    section[len('Rule:'):].strip(), conditions,
+                    profile=sec.get('profile') or None,
+                    quality=ProfileEngine.parse_quality(sec.get('quality')),
+                    skip=sec.getboolean('skip', fallback=False),
+                    reason=sec.get('reason') or None,
+                ))
+        has_rules = any(s.startswith('Rule:') for s in config.sections())
+        return ProfileEngine(global_quality, profiles, rules if has_rules else None,
+                             config.get('Profiles', 'default', fallback='qsv_hevc'))
+
+    def select(self, v_info, file_path=''):
+        """
+        :return: (编码方式, 质量, None) 或者 (None, None, 略过原因)
+        """
+        facts = ProfileRule.video_facts(v_info)
+        for rule in self.rules:
+            if not rule.match(facts):
+                continue
+            if rule.skip:
+                return None, None, rule.format_reason(file_path, facts)
+            profile = self.profiles[rule.profile or self.default_profile]
+            return profile, self.quality_of(profile, rule), None
+        profile = self.profiles[self.default_profile]
+        return profile, self.quality_of(profile), None
+
+    def quality_of(self, profile, rule=None):
+        if rule is not None and rule.quality is not None:
+            return rule.quality
+        if profile.quality is not None:
+            return profile.quality
+        return self.global_quality
+
+    def output_paths(self, file_path, output_dir):
+        # 所有规则可能产生的输出文件, 用于 probe 之前 检查输出文件是否已经存在
+        paths = []
+        pairs = [(self.profiles[self.default_profile], None)]
+        pairs += [(self.profiles[r.profile or self.default_profile], r) for r in self.rules if not r.skip]
+        for profile, rule in pairs:
+            path = profile.output_path(file_path, output_dir, self.quality_of(profile, rule))
+            if path not in paths:
+                paths.append(path)
+        return paths
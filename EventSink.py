@@ -0,0 +1,70 @@
+import json
+import socket
+import sys
+import threading
+import time
+
+
+class JsonLineSink:
+    """
+    无终端(headless) 模式下 代替终端界面的输出: 每个事件写成一行 JSON
+        {"time": 1700000000.123, "event": "progress", "slot": 0, ...}
+    事件类型: log / run_start / estimate / task_start / progress / task_end / task_skipped / concurrency /
+        disk_insufficient / disk_wait / recovered / recovered_verified / run_end
+    progress 事件 每个 slot 至少间隔 progress_interval 秒才输出一次
+    输出出错(例如 unix socket 的接收端已经退出) 后不再输出, 不影响转码
+    """
+
+    def __init__(self, stream, progress_interval=1.0, close_stream=False):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.close_stream = close_stream
+        self.lock = threading.Lock()
+        self.last_progress_time = {}    # slot -> 上一次输出 progress 的时间
+        self.broken = False
+
+    @staticmethod
+    def open(target, progress_interval=1.0):
+        """
+        :param target: "-" 输出到 stdout; "unix:/path/to.sock" 连接 unix socket; 其他 作为文件路径 追加写入
+        """
+        if target in ("", "-"):
+            return JsonLineSink(sys.stdout, progress_interval)
+        if target.startswith("unix:"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(target[len("unix:"):])
+            stream = sock.makefile('w', encoding='utf-8', newline='\n')
+            sock.close()    # makefile 持有 socket 的引用, 关闭 stream 时才真正关闭
+            return JsonLineSink(stream, progress_interval, close_stream=True)
+        return JsonLineSink(open(target, 'a', encoding='utf-8'), progress_interval, close_stream=True)
+
+    def emit(self, event, **fields):
+        if self.broken:
+            return
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str)
+        with self.lock:
+            try:
+                self.stream.write(line + "\n")
+                self.stream.flush()
+            except (OSError, ValueError):
+                self.broken = True
+
+    def progress(self, slot, **fields):
+        now = time.time()
+        if now - self.last_progress_time.get(slot, 0) < self.progress_interval:
+            return
+        self.last_progress_time[slot] = now
+        self.emit("progress", slot=slot, **fields)
+
+    def log(self, message, color='black'):
+        self.emit("log", level="error" if color == 'red' else "info", message=message)
+
+    def close(self):
+        with self.lock:
+            try:
+                self.stream.flush()
+                if self.close_stream:
+                    self.stream.close()
+            except (OSError, ValueError):
+                pass
+            self.broken = True
@@ -1,14 +1,16 @@
 import subprocess
 import os
 import json
-import queue
 import traceback
 import pandas
 import re
-import hashlib
 import time
+from FileHasher import FileHasher
+from EncoderProfile import ProfileEngine
 
 class FFmpegUtil:
+    video_extensions = ['mp4', 'avi', 'mkv', 'mov', 'wmv', 'flv', 'webm', 'mpg', 'ts']
+
     def __init__(self):
         pass
 
@@ -17,38 +19,12 @@ class FFmpegUtil:
         # 快速的计算一个大文件的sha256 值。
         # 注意！不是正确的 全文件的sha256
         # 根据文件的首尾和中间的若干块计算一个近似的SHA256值。
-        # 当文件块数小于 3*每次取样个数 时候，会重复计算！
-
-        sha256 = hashlib.sha256()
-        file_size = os.path.getsize(file_path)
-        block_size = 64 * 8 # hash每次处理的块大小是512字节 但看网上有把65535字节放入update中的
-        samples_count = 300 # 在每个取样点 读取count个block
-        block_num = file_size // block_size     # 文件包含了block_num个block
-        # 三个取样点 开始的block的下标
-        start_block = 0
-        end_block = block_num -samples_count
-        middle_block = block_num // 2
-        with open(file_path, 'rb') as file:
-            file.seek(start_block*block_size, 0)
-            for _ in range(samples_count):
-                block = file.read(block_size)
-                sha256.update(block)
-            file.seek(middle_block*block_size, 0)
-            for _ in range(samples_count):
-                block = file.read(block_size)
-                sha256.update(block)
-            file.seek(end_block*block_size, 0)
-            for _ in range(samples_count):
-                block = file.read(block_size)
-                sha256.update(block)
-
-        return sha256.hexdigest()
-
-
-
+        # 实现见 FileHasher.sample_sha256, 这里保留是为了兼容
+        return FileHasher.sample_sha256(file_path)
 
     @staticmethod
-    def ffmpeg_video_info(input_file_path, debug=False):
+    def ffmpeg_video_info(input_file_path, debug=False, timeout=None):
+        # timeout: ffprobe 的超时秒数, 超时后杀掉进程 抛出 subprocess.TimeoutExpired
         command = [
             'ffprobe',
             '-v', 'quiet',
@@ -58,7 +34,12 @@ class FFmpegUtil:
         ]
         process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
                                    encoding='utf8')
-        [stdout, stderr] = process.communicate()
+        try:
+            [stdout, stderr] = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
 
         jsonobj = json.loads(stdout)
         if debug:
@@ -97,12 +78,10 @@ class FFmpegUtil:
         }
 
     @staticmethod
-    def ffmpeg_video_info_dir(dir_path):
-        suffix_list = ['mp4', 'mkv', 'wmv']
+    def ffmpeg_video_info_dir(dir_path, recursive=False):
         info_list = []
-        for ff in os.listdir(dir_path):
-            if ff.lower().split('.')[-1] in suffix_list:
-                info_list.append(FFmpegUtil.ffmpeg_video_info(os.path.join(dir_path, ff)))
+        for file_path in FFmpegUtil.load_video_from_dir(dir_path, recursive):
+            info_list.append(FFmpegUtil.ffmpeg_video_info(file_path))
         df = pandas.DataFrame(info_list)
         df.to_excel("ffmpeg_info.xlsx", index=False)
 
@@ -129,41 +108,99 @@ class FFmpegUtil:
             return 0
 
     @staticmethod
-    def ffmpeg_video_to_av1_task_queue_init(file_path_list, output_dir, global_quality, running_output_dir,print_to_area):
-        # file_path_list = [x['file_path'] for x in file_path_sha256_list]
-        # file_sha256_list = [x['sha256'] for x in file_path_sha256_list]
-
-        # 初始化ffmpeg任务队列
-        task_queue = queue.Queue()  # 任务队列
-        for i, file_path in enumerate(file_path_list):
-            print_to_area(f"loading:{file_path}")
-            try:
-                v_info = FFmpegUtil.ffmpeg_video_info(file_path)  # 视频文件信息 列表
-            except Exception as e: # ffprobe 解析出错
-                print_to_area(f"😱load error :{e}", color='red')
-                continue
-
-            dstfile_path = FFmpegUtil.filepath_to_av1(file_path, output_dir, global_quality) # 转码后 输出视频文件的路径 列表
-            cmd = [
-                'ffmpeg',
-                '-hide_banner',
-                '-i', file_path_list[i],
-                '-c:v', 'hevc_qsv', '-preset', 'fast', '-global_quality', str(global_quality),
-                '-look_ahead', '1', '-c:a', 'copy',
-                dstfile_path, '-y'
-            ]
-            task_queue.put({
-                'file_path': file_path,
-                'duration': v_info['duration'], # 视频文件时长 列表
-                'dstfile_path':  dstfile_path,
-                'command': cmd,
-                'v_info': v_info,
-                'sha256': FFmpegUtil.cal_sample_sha256(file_path),
-                'running_output_path': os.path.join(running_output_dir, f"{os.path.basename(file_path)}_{time.time()}.txt"),
-            })
-            print_to_area(f"👌 加入任务队列:{file_path}")
-
-        return task_queue
+    def av1_command(file_path, dstfile_path, global_quality, input_args=(), output_args=()):
+        # input_args 放在 -i 之前 (例如 -ss), output_args 放在输出文件之前 (例如 -t)
+        return [
+            'ffmpeg',
+            '-hide_banner',
+            '-nostats', '-progress', 'pipe:1',  # 进度以 key=value 的形式输出到 stdout, stderr 只剩诊断信息
+            *input_args,
+            '-i', file_path,
+            '-c:v', 'hevc_qsv', '-preset', 'fast', '-global_quality', str(global_quality),
+            '-look_ahead', '1', '-c:a', 'copy',
+            *output_args,
+            dstfile_path, '-y'
+        ]
+
+    @staticmethod
+    def find_keyframe_after(file_path, time_sec, search_seconds=30):
+        """
+        找到 time_sec 之后(含)的第一个视频关键帧的时间点, 找不到时返回 None
+        只读取 [time_sec, time_sec + search_seconds] 附近的 packet, 不需要解码
+        """
+        command = [
+            'ffprobe',
+            '-v', 'quiet',
+            '-select_streams', 'v:0',
+            '-read_intervals', f'{time_sec:.3f}%+{search_seconds}',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            '-i', file_path
+        ]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                                   encoding='utf8')
+        [stdout, stderr] = process.communicate()
+        keyframes = []
+        for line in stdout.splitlines():
+            [pts_time, _, flags] = line.partition(',')
+            if 'K' in flags:
+                try:
+                    keyframes.append(float(pts_time))
+                except ValueError:
+                    continue    # pts_time 为 N/A
+        keyframes = sorted(x for x in keyframes if x >= time_sec)
+        return keyframes[0] if keyframes else None
+
+    @staticmethod
+    def build_av1_task(file_path, output_dir, global_quality, running_output_dir, v_info=None, sha256=None,
+                       fingerprint=None, profiles=None, probe=None):
+        """
+        probe 一个视频文件 并生成对应的 ffmpeg 转码任务
+        ffprobe 解析出错时 直接抛出异常, 由调用者决定如何处理
+        :param v_info: 已知的视频信息(来自缓存), 传入时不再 ffprobe
+        :param sha256: 已知的 sample sha256(来自缓存), 传入时不再计算
+        :param fingerprint: 已知的快速指纹(来自缓存), 传入时不再计算
+        :param profiles: ProfileEngine, 根据视频信息选择编码方式和质量; 为空时使用内置规则 (与旧版本相同)
+        :param probe: probe(file_path) -> 视频信息, 例如 ProbeService.probe; 为空时 直接运行 ffprobe
+        """
+        if v_info is None:
+            v_info = (probe or FFmpegUtil.ffmpeg_video_info)(file_path)  # 视频文件信息
+        if sha256 is None:
+            sha256 = FFmpegUtil.cal_sample_sha256(file_path)
+        if fingerprint is None:
+            fingerprint = FileHasher.fast_fingerprint(file_path)
+        if profiles is None:
+            profiles = ProfileEngine(global_quality)
+        profile, quality, skip_reason = profiles.select(v_info, file_path)
+        if profile is None:     # 不转码的文件 仍然生成默认的命令, 略过时 只用于记录
+            profile = profiles.profiles[profiles.default_profile]
+            quality = profiles.quality_of(profile)
+        dstfile_path = profile.output_path(file_path, output_dir, quality) # 转码后 输出视频文件的路径
+        cmd = profile.command(file_path, dstfile_path, quality)
+        return {
+            'file_path': file_path,
+            'duration': v_info['duration'], # 视频文件时长
+            'dstfile_path':  dstfile_path,
+            'command': cmd,
+            'global_quality': quality,
+            'profile': profile,
+            'skip_reason': skip_reason,     # 规则决定不转码时的原因, 由 check_bypass 记录
+            'v_info': v_info,
+            'sha256': sha256,
+            'fingerprint': fingerprint,
+            'running_output_path': os.path.join(running_output_dir, f"{os.path.basename(file_path)}_{time.time()}.txt"),
+        }
+
+    @staticmethod
+    def ffmpeg_video_to_av1_task_queue_init(file_path_list, output_dir, global_quality, running_output_dir,
+                                            print_to_area, max_workers=4, probe_cache=None, profiles=None):
+        # 初始化ffmpeg任务队列, 等待所有文件 probe 完成后才返回
+        # 需要边 probe 边转码时 直接使用 TaskProducer
+        from TaskProducer import TaskProducer
+        producer = TaskProducer(file_path_list, output_dir, global_quality, running_output_dir,
+                                print_to_area, max_workers=max_workers, probe_cache=probe_cache, profiles=profiles)
+        producer.start().wait()
+        return producer.task_queue
 
     @staticmethod
     def match_ffmpeg_running_output(last_line):
@@ -186,17 +223,60 @@ class FFmpegUtil:
         return result_list
 
     @staticmethod
-    def load_video_from_dir(dir_path):
-        video_extensions = ['mp4', 'avi', 'mkv', 'mov', 'wmv', 'flv', 'webm', 'mpg', 'ts']
-        video_files = []
-        for file_path in os.listdir(dir_path):
-            base_n = os.path.basename(file_path)
-            if base_n.split(".")[-1].lower() in video_extensions:
-                video_files.append(file_path)
+    def progress_seconds(progress):
+        # 从 -progress 的一组输出中 取出已经编码的时长(秒)
+        # out_time_ms 实际上也是微秒, 这是 ffmpeg 的历史遗留问题
+        value = progress.get('out_time_us', progress.get('out_time_ms', ''))
+        if value.lstrip('-').isdigit():
+            return max(0, int(value)) // 1000000
+        return 0
+
+    @staticmethod
+    def iter_stream_lines(stream, chunk_size=65536):
+        """
+        按 \\n 或 \\r 切分二进制流, 返回不含换行符的 bytes 行。
+        每次读取当前可用的全部数据, 切分时只扫描一遍缓冲区, 开销与数据量成线性关系。
+        """
+        read = getattr(stream, 'read1', stream.read)
+        buffer = b""
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            lines = (buffer + chunk).replace(b"\r\n", b"\n").replace(b"\r", b"\n").split(b"\n")
+            buffer = lines.pop()    # 最后一段没有换行符 留到下一次
+            for line in lines:
+                if line:
+                    yield line
+        if buffer:
+            yield buffer
 
-        video_files = [os.path.join(dir_path, x) for x in video_files]
-        return video_files
+    @staticmethod
+    def load_video_from_dir(dir_path, recursive=False):
+        # 需要 include/exclude 规则 或 边遍历边处理时 直接使用 FileDiscovery
+        from FileDiscovery import FileDiscovery
+        return [entry.path for entry in FileDiscovery(recursive=recursive).walk(dir_path)]
 
 
+class FFmpegProgressParser:
+    """
+    增量解析 ffmpeg -progress 的输出。
+    ffmpeg 每隔一段时间输出一组 key=value 行, 以 progress=continue / progress=end 结尾,
+    每收到一组完整的输出 feed 返回一个 dict, 其他时候返回 None。
+    """
 
+    def __init__(self):
+        self.current = {}
 
+    def feed(self, line):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        key, sep, value = line.partition('=')
+        if not sep:
+            return None
+        key = key.strip()
+        self.current[key] = value.strip()
+        if key == 'progress':
+            result, self.current = self.current, {}
+            return result
+        return None
@@ -0,0 +1,109 @@
+import fnmatch
+import os
+from FFmpegUtil import FFmpegUtil
+
+
+class FileDiscovery:
+    """
+    查找需要转码的视频文件: 用 os.scandir 递归遍历目录, 边遍历边 yield, 下游不用等整个目录树遍历完。
+    yield 的是 os.DirEntry, 可以直接当作路径使用 (os.fspath), entry.stat() 的结果由 DirEntry 缓存,
+    后续的预过滤 和 probe 缓存 都使用这个结果, 不再重复 stat。
+    规则:
+        extensions: 扩展名 (不区分大小写), 默认 FFmpegUtil.video_extensions
+        include:    文件名 或 相对路径 匹配任意一个 glob 才保留, 为空时全部保留
+        exclude:    文件名 或 相对路径 匹配任意一个 glob 就排除; 匹配的目录 整个跳过, 不进入遍历
+        min_size:   小于这个字节数的文件 排除
+        exclude_dirs: 不遍历的目录 (例如 放在输入目录中的 输出目录)
+        sort_names: 同一目录中 按文件名排序; 需要先读完整个目录 才能 yield 第一个文件, 默认按 scandir 的顺序 边读边 yield
+    """
+
+    def __init__(self, include=(), exclude=(), min_size=0, extensions=None, recursive=True,
+                 follow_symlinks=False, exclude_dirs=(), sort_names=False):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.exclude_dirs = {self.normalize(d) for d in exclude_dirs}
+        self.min_size = min_size
+        self.extensions = {x.lower().lstrip('.') for x in (extensions or FFmpegUtil.video_extensions)}
+        self.recursive = recursive
+        self.follow_symlinks = follow_symlinks
+        self.sort_names = sort_names
+        self.error_count = 0    # 无法访问的目录 / 文件个数
+
+    @staticmethod
+    def normalize(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def is_excluded_dir(self, dir_path):
+        return self.normalize(dir_path) in self.exclude_dirs
+
+    @staticmethod
+    def split_patterns(text):
+        # 配置文件中 逗号 或 换行分隔的 glob 列表
+        return [x.strip() for x in text.replace('\n', ',').split(',') if x.strip()]
+
+    @staticmethod
+    def match_any(patterns, name, rel_path):
+        rel_path = rel_path.replace(os.sep, '/')
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in patterns)
+
+    def match_name(self, file_path, root=None):
+        # 只按路径判断 (扩展名 include exclude), 不检查大小
+        name = os.path.basename(file_path)
+        if '.' not in name or name.rsplit('.', 1)[-1].lower() not in self.extensions:
+            return False
+        if self.exclude_dirs:
+            parent = self.normalize(os.path.dirname(file_path))
+            if any(parent == d or parent.startswith(d + os.sep) for d in self.exclude_dirs):
+                return False
+        rel_path = os.path.relpath(file_path, root) if root else name
+        if self.include and not self.match_any(self.include, name, rel_path):
+            return False
+        if not self.exclude:
+            return True
+        # 所在的目录被排除时 文件也排除 (遍历时会跳过这些目录, 这里用于 watchdog 事件中的路径)
+        parts = rel_path.replace(os.sep, '/').split('/')
+        for i in range(len(parts) - 1):
+            if self.match_any(self.exclude, parts[i], '/'.join(parts[:i + 1])):
+                return False
+        return not self.match_any(self.exclude, name, rel_path)
+
+    def match_entry(self, entry, root):
+        if not self.match_name(entry.path, root):
+            return False
+        if self.min_size > 0:
+            try:
+                if entry.stat(follow_symlinks=self.follow_symlinks).st_size < self.min_size:
+                    return False
+            except OSError:
+                self.error_count += 1
+                return False
+        return True
+
+    def walk(self, dir_path):
+        """
+        :return: os.DirEntry 的生成器, 深度优先, 同一目录中 按 scandir 的顺序 (sort_names 时按文件名)
+        """
+        stack = [dir_path]
+        while stack:
+            current = stack.pop()
+            sub_dirs = []
+            try:
+                with os.scandir(current) as it:
+                    for entry in (sorted(it, key=lambda e: e.name) if self.sort_names else it):
+                        try:
+                            if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                                if self.recursive and not self.is_excluded_dir(entry.path) and not (
+                                        self.exclude and self.match_any(
+                                            self.exclude, entry.name, os.path.relpath(entry.path, dir_path))):
+                                    sub_dirs.append(entry.path)
+                                continue
+                            if not entry.is_file(follow_symlinks=self.follow_symlinks):
+                                continue
+                        except OSError:
+                            self.error_count += 1
+                            continue
+                        if self.match_entry(entry, dir_path):
+                            yield entry
+            except OSError:     # 无法打开的目录, 或者 遍历过程中 目录被删除
+                self.error_count += 1
+            stack.extend(reversed(sub_dirs))
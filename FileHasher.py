@@ -0,0 +1,99 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FileHasher:
+    # 文件哈希
+    # 1. sample_sha256: 兼容旧版本 cal_sample_sha256 的取样哈希, 库中已有的记录都是用它计算的
+    # 2. fast_fingerprint: 快速指纹, 包含文件大小 + 首/中/尾 三段对齐的大块数据, 小文件直接哈希全部内容
+    # 3. full_sha256: 真正的全文件 sha256, 流式读取, 可以放在后台线程池中计算
+
+    sample_block_size = 64 * 8      # 旧版本的块大小 512 字节
+    samples_count = 300             # 旧版本在每个取样点 读取的块数
+    fingerprint_sample_size = 1024 * 1024   # 快速指纹 每个取样点读取 1MiB
+    align_size = 64 * 1024                  # 取样点按 64KiB 对齐
+    full_hash_chunk_size = 4 * 1024 * 1024
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def sample_sha256(file_path):
+        """
+        与旧版本 cal_sample_sha256 的结果相同: 在首/中/尾三个取样点 各取 300 个 512 字节的块。
+        旧版本每个块单独 read 一次, 这里每个取样点只 read 一次, 读取的字节完全一样。
+        文件不足 300 个块时 旧版本会 seek 到负数位置出错, 这里改为哈希整个文件。
+        """
+        sha256 = hashlib.sha256()
+        file_size = os.path.getsize(file_path)
+        sample_bytes = FileHasher.sample_block_size * FileHasher.samples_count
+        block_num = file_size // FileHasher.sample_block_size
+        with open(file_path, 'rb') as file:
+            if block_num < FileHasher.samples_count:
+                sha256.update(file.read())
+                return sha256.hexdigest()
+            for start_block in (0, block_num // 2, block_num - FileHasher.samples_count):
+                file.seek(start_block * FileHasher.sample_block_size, 0)
+                sha256.update(file.read(sample_bytes))
+        return sha256.hexdigest()
+
+    @staticmethod
+    def fast_fingerprint(file_path):
+        """
+        快速指纹: sha256(文件大小 + 首/中/尾 各 1MiB)
+        取样点按 64KiB 对齐, 三段互不重叠; 文件不超过 3MiB 时 直接哈希全部内容
+        """
+        sha256 = hashlib.sha256()
+        file_size = os.path.getsize(file_path)
+        sha256.update(f"size:{file_size};".encode())
+        sample_size = FileHasher.fingerprint_sample_size
+        with open(file_path, 'rb') as file:
+            if file_size <= sample_size * 3:
+                sha256.update(file.read())
+                return sha256.hexdigest()
+            middle = (file_size // 2) // FileHasher.align_size * FileHasher.align_size
+            end = (file_size - sample_size) // FileHasher.align_size * FileHasher.align_size
+            middle = min(max(middle, sample_size), end - sample_size)
+            for offset in (0, middle, end):
+                file.seek(offset, 0)
+                sha256.update(file.read(sample_size))
+            # 对齐后 尾部取样 可能没有覆盖到文件最后不足 64KiB 的字节, 单独补上
+            sha256.update(file.read())
+        return sha256.hexdigest()
+
+    @staticmethod
+    def full_sha256(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            while True:
+                chunk = file.read(FileHasher.full_hash_chunk_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+class FullHashService:
+    """
+    在后台线程池中计算全文件 sha256, 计算完成后调用 on_done(file_path, digest, context)
+    出错时 digest 为 None
+    """
+
+    def __init__(self, on_done, max_workers=1):
+        self.on_done = on_done
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="full_hash")
+
+    def submit(self, file_path, context=None):
+        return self.pool.submit(self._hash_one, file_path, context)
+
+    def _hash_one(self, file_path, context):
+        try:
+            digest = FileHasher.full_sha256(file_path)
+        except OSError:
+            digest = None
+        self.on_done(file_path, digest, context)
+        return digest
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from FileDiscovery import FileDiscovery
+
+try:
+    # 可选依赖, 没有安装时 定时扫描目录
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _WatchHandler(FileSystemEventHandler):
+    # watchdog 的事件 只把路径交给 FolderWatcher, 是否写完 由 FolderWatcher 判断
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.dest_path)
+
+
+class FolderWatcher:
+    """
+    监控目录中新放入的视频文件。
+    新文件先作为候选, 每隔 poll_interval 秒检查一次 (大小, 修改时间),
+    连续 stable_seconds 秒没有变化 (文件已经复制/下载完成) 才调用 on_files(文件列表)。
+    安装了 watchdog 时 由文件系统事件发现新文件, 不需要重复扫描目录; 没有安装时 每次检查前扫描一次目录。
+    文件是否需要处理 (扩展名 include exclude 最小大小 是否递归) 与 discovery 的规则相同。
+    同一个路径只会交出一次。
+    """
+
+    def __init__(self, dir_path, stable_seconds=10, poll_interval=2, use_watchdog=True, discovery=None):
+        self.dir_path = dir_path
+        self.discovery = discovery if discovery is not None else FileDiscovery(recursive=False)
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog and Observer is not None
+        self.on_files = None
+        self.known = set()          # 已经交出的 (或启动时已经存在的) 文件
+        self.candidates = {}        # 路径 -> (大小, 修改时间, 开始保持不变的时间)
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    def start(self, on_files, known_files=()):
+        self.on_files = on_files
+        self.known.update(os.path.abspath(os.fspath(p)) for p in known_files)
+        if self.use_watchdog:
+            self._observer = Observer()
+            self._observer.schedule(_WatchHandler(self), self.dir_path, recursive=self.discovery.recursive)
+            self._observer.start()
+            self.scan()     # 启动 observer 之前 已经放入 但还没写完的文件
+        self._thread = threading.Thread(target=self._run, name="FolderWatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def touch(self, file_path):
+        # 发现新文件 或 文件有变化
+        if not self.discovery.match_name(file_path, self.dir_path):
+            return
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            if file_path not in self.known and file_path not in self.candidates:
+                self.candidates[file_path] = (None, None, time.time())
+
+    def scan(self):
+        for entry in self.discovery.walk(self.dir_path):
+            self.touch(entry.path)
+
+    def check_stable(self, now):
+        # 返回已经稳定的文件, 并从候选中移除
+        with self.lock:
+            candidates = list(self.candidates.items())
+        ready = []
+        for file_path, (size, mtime_ns, since) in candidates:
+            try:
+                st = os.stat(file_path)
+            except OSError:     # 文件已经被删除 或 移走
+                with self.lock:
+                    self.candidates.pop(file_path, None)
+                continue
+            with self.lock:
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    self.candidates[file_path] = (st.st_size, st.st_mtime_ns, now)
+                elif st.st_size > 0 and now - since >= self.stable_seconds:
+                    self.candidates.pop(file_path, None)
+                    self.known.add(file_path)
+                    if st.st_size >= self.discovery.min_size:
+                        ready.append(file_path)
+        return sorted(ready)
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                if not self.use_watchdog:
+                    self.scan()
+                ready = self.check_stable(time.time())
+            except OSError:
+                continue    # 目录暂时无法访问 (例如网络盘断开), 下次再试
+            if ready:
+                self.on_files(ready)
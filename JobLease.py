@@ -0,0 +1,442 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from DatabaseHelper import TaskState, retry_on_database_locked
+
+
+class JobState:
+    # Job_Lease 中任务的状态
+    PENDING = 'pending'     # 等待领取
+    LEASED = 'leased'       # 已经被某个 worker 领取, 租约到期前 其他 worker 不会领取
+    DONE = 'done'           # 转码成功 或 略过
+    FAILED = 'failed'       # 失败次数达到 max_attempts
+
+
+class JobStore:
+    """
+    多台机器共用一个数据库时的任务表 Job_Lease: 每个输入文件一行, worker 用租约的方式领取。
+    领取时在 BEGIN IMMEDIATE 事务中 选出 pending 或 租约已经过期 的行 改为 leased, 同一时刻只有一个 worker 能领到;
+    worker 每隔一段时间续约 并写入进度, 崩溃 / 断网的 worker 不再续约, 租约到期后 任务由其他 worker 领取。
+    每次调用 使用单独的连接, 可以在任意线程中调用。输入 / 输出目录 需要在所有机器上 是同一个路径(共享存储)。
+    """
+    batch_size = 500
+
+    def __init__(self, db_path, lease_seconds=60, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def connect(self):
+        # 自动提交模式, 事务由 BEGIN IMMEDIATE 显式开始
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @retry_on_database_locked()
+    def enqueue(self, items):
+        """
+        加入任务, 文件可以是路径 或 os.DirEntry。已经存在的任务 大小 或 修改时间变了时 重新变为 pending
+        :return: 新加入(或重新加入) 的任务个数
+        """
+        rows = []
+        for item in items:
+            try:
+                st = item.stat() if isinstance(item, os.DirEntry) else os.stat(item)
+            except OSError:
+                continue
+            rows.append((os.path.abspath(os.fspath(item)), st.st_size, st.st_mtime_ns))
+        now = time.time()
+        conn = self.connect()
+        try:
+            before = conn.total_changes
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                insert into "Job_Lease" (file_path, file_size, mtime_ns, state, attempt_count, enqueue_time, update_time)
+                values (?,?,?,?,0,?,?)
+                on conflict(file_path) do update set
+                    file_size=excluded.file_size, mtime_ns=excluded.mtime_ns, state=excluded.state,
+                    owner=null, lease_expire=null, progress_seconds=null, attempt_count=0,
+                    enqueue_time=excluded.enqueue_time, update_time=excluded.update_time
+                where file_size != excluded.file_size or mtime_ns != excluded.mtime_ns
+            ''', [(*row, JobState.PENDING, now, now) for row in rows])
+            conn.execute('COMMIT')
+            return conn.total_changes - before
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    @retry_on_database_locked()
+    def lease(self, owner, count):
+        """
+        领取最多 count 个任务: pending 的 和 租约已经过期的
+        :return: 输入文件路径列表
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            paths = [row[0] for row in conn.execute('''
+                select file_path from "Job_Lease"
+                where state=? or (state=? and lease_expire < ?)
+                order by enqueue_time, rowid
+                limit ?
+            ''', (JobState.PENDING, JobState.LEASED, now, count))]
+            conn.executemany('''
+                update "Job_Lease" set state=?, owner=?, lease_expire=?, heartbeat_time=?, progress_seconds=null,
+                    duration=null, attempt_count=attempt_count + 1, update_time=?
+                where file_path=?
+            ''', [(JobState.LEASED, owner, now + self.lease_seconds, now, now, p) for p in paths])
+            conn.execute('COMMIT')
+            return paths
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    @retry_on_database_locked()
+    def renew(self, owner, paths, progress):
+        """
+        续约, 同时写入进度
+        :param progress: 路径 -> (已经转码的秒数, 总时长)
+        :return: 仍然由 owner 持有的路径 (不在其中的 租约已经过期 并被其他 worker 领取了)
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                update "Job_Lease" set lease_expire=?, heartbeat_time=?,
+                    progress_seconds=coalesce(?, progress_seconds), duration=coalesce(?, duration)
+                where file_path=? and owner=? and state=?
+            ''', [(now + self.lease_seconds, now, *progress.get(p, (None, None)), p, owner, JobState.LEASED)
+                  for p in paths])
+            held = set()
+            for i in range(0, len(paths), self.batch_size):
+                part = paths[i:i + self.batch_size]
+                held.update(row[0] for row in conn.execute(f'''
+                    select file_path from "Job_Lease" where owner=? and state=?
+                    and file_path in ({','.join('?' * len(part))})
+                ''', (owner, JobState.LEASED, *part)))
+            conn.execute('COMMIT')
+            return held
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    @retry_on_database_locked()
+    def finish(self, owner, results):
+        """
+        :param results: [(路径, Task_Journal 的状态)], 成功 / 略过 为 done, 失败 次数没到 max_attempts 时 重新 pending,
+                        queued (任务被取消) 重新 pending
+        """
+        now = time.time()
+        rows = []
+        for file_path, state in results:
+            if state in (TaskState.SUCCEEDED, TaskState.SKIPPED):
+                rows.append((JobState.DONE, JobState.DONE, now, file_path, owner))
+            elif state == TaskState.FAILED:
+                rows.append((JobState.FAILED, JobState.PENDING, now, file_path, owner))
+            else:
+                rows.append((JobState.PENDING, JobState.PENDING, now, file_path, owner))
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(f'''
+                update "Job_Lease" set
+                    state=case when ?='{JobState.FAILED}' and attempt_count < {int(self.max_attempts)} then ? else ? end,
+                    owner=null, lease_expire=null, update_time=?
+                where file_path=? and owner=? and state='{JobState.LEASED}'
+            ''', [(row[0], row[1], row[0], *row[2:]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def release(self, owner, paths):
+        # worker 退出时 还没有完成的任务 放回 pending, 不用等租约过期
+        self.finish(owner, [(p, TaskState.QUEUED) for p in paths])
+
+    @retry_on_database_locked()
+    def reclaim_expired(self):
+        """
+        租约已经过期的任务 放回 pending (worker 领取时也会领取过期的任务, 这里只是让状态一目了然)
+        :return: [(路径, 原来的 owner)]
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                select file_path, owner from "Job_Lease" where state=? and lease_expire < ?
+            ''', (JobState.LEASED, now)).fetchall()
+            conn.executemany('''
+                update "Job_Lease" set state=?, owner=null, lease_expire=null, update_time=?
+                where file_path=? and state=? and lease_expire < ?
+            ''', [(JobState.PENDING, now, row[0], JobState.LEASED, now) for row in rows])
+            conn.execute('COMMIT')
+            return rows
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def retried_paths(self, owner, paths):
+        """
+        owner 持有的任务中 不是第一次被领取的 (之前领取的 worker 崩溃 / 断网, 租约过期后 重新领取)
+        :return: 路径集合
+        """
+        paths = list(paths)
+        conn = self.connect()
+        try:
+            retried = set()
+            for i in range(0, len(paths), self.batch_size):
+                chunk = paths[i:i + self.batch_size]
+                retried.update(row[0] for row in conn.execute(f'''
+                    select file_path from "Job_Lease"
+                    where owner=? and state=? and attempt_count > 1 and file_path in ({','.join('?' * len(chunk))})
+                ''', (owner, JobState.LEASED, *chunk)))
+            return retried
+        finally:
+            conn.close()
+
+    def lease_owner(self, file_path):
+        # 持有这个任务租约的 worker, 没有被领取时返回 None
+        conn = self.connect()
+        try:
+            row = conn.execute('select owner from "Job_Lease" where file_path=? and state=?',
+                               (file_path, JobState.LEASED)).fetchone()
+            return row[0] if row is not None else None
+        finally:
+            conn.close()
+
+    def status(self):
+        """
+        :return: ({状态: 个数}, [(路径, owner, 已转码秒数, 总时长, 最后心跳时间)])
+        """
+        conn = self.connect()
+        try:
+            counts = dict(conn.execute('select state, count(*) from "Job_Lease" group by state').fetchall())
+            leased = conn.execute('''
+                select file_path, owner, progress_seconds, duration, heartbeat_time from "Job_Lease"
+                where state=? order by owner, file_path
+            ''', (JobState.LEASED,)).fetchall()
+            return counts, leased
+        finally:
+            conn.close()
+
+    def set_control(self, name, value):
+        conn = self.connect()
+        try:
+            conn.execute('insert or replace into "Job_Control" (name, value) values (?,?)', (name, str(value)))
+        finally:
+            conn.close()
+
+    def get_control(self, name, default=None):
+        conn = self.connect()
+        try:
+            row = conn.execute('select value from "Job_Control" where name=?', (name,)).fetchone()
+            return row[0] if row is not None else default
+        finally:
+            conn.close()
+
+    def is_drained(self):
+        # 协调节点已经加入了所有任务, 并且 没有等待领取 / 正在运行的任务
+        if self.get_control('enqueue_done') != '1':
+            return False
+        counts, _ = self.status()
+        return counts.get(JobState.PENDING, 0) == 0 and counts.get(JobState.LEASED, 0) == 0
+
+
+class LeaseClient:
+    """
+    worker 节点: 在后台线程中 按空闲的 slot 个数领取任务 交给 FFmpegManager, 定时续约 并上报进度,
+    任务结束后 (finish) 把结果写回 Job_Lease。运行记录 由 FFmpegManager 照常写入 Run_Task_Record。
+    续约时发现租约已经被其他 worker 领取 (例如 网络中断太久) 调用 on_lost, 由 manager 停止这些任务。
+    """
+
+    def __init__(self, store, owner=None, heartbeat_interval=15, poll_interval=2, prefetch=1, exit_when_done=False):
+        self.store = store
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_interval = min(heartbeat_interval, store.lease_seconds / 3)
+        self.poll_interval = poll_interval
+        self.prefetch = prefetch            # 比空闲 slot 多领取几个, probe 的时候 不让 slot 空着
+        self.exit_when_done = exit_when_done
+        self.held = set()                   # 持有租约的路径
+        self.finished = {}                  # 已经结束 还没写回的 路径 -> 状态
+        self.progress = {}                  # 路径 -> (已经转码的秒数, 总时长)
+        self.lock = threading.Lock()
+        self.print_to_area = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, on_files, slots, print_to_area, on_lost=None, on_drained=None):
+        """
+        :param on_files: 领取到任务时调用 on_files(路径列表)
+        :param slots: 返回当前允许同时运行的任务个数
+        :param on_drained: exit_when_done 时 所有任务都已经完成后调用
+        """
+        self.print_to_area = print_to_area
+        self._thread = threading.Thread(target=self._run, args=(on_files, slots, on_lost, on_drained),
+                                        name="LeaseClient", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self, file_path, state):
+        # 任务的最终状态 (Task_Journal 的状态), 可以在任意线程中调用
+        with self.lock:
+            if file_path in self.held:
+                self.finished[file_path] = state
+
+    def report_progress(self, file_path, seconds, duration):
+        with self.lock:
+            self.progress[file_path] = (seconds, duration)
+
+    def _flush_finished(self):
+        with self.lock:
+            finished = self.finished
+            self.finished = {}
+        if not finished:
+            return
+        try:
+            self.store.finish(self.owner, list(finished.items()))
+        except Exception:
+            with self.lock:
+                for path, state in finished.items():
+                    self.finished.setdefault(path, state)
+            raise
+        with self.lock:
+            self.held -= finished.keys()
+            for path in finished:
+                self.progress.pop(path, None)
+
+    def _heartbeat(self, on_lost):
+        with self.lock:
+            paths = sorted(self.held - self.finished.keys())
+            progress = dict(self.progress)
+        if not paths:
+            return
+        lost = set(paths) - self.store.renew(self.owner, paths, progress)
+        if lost:
+            with self.lock:
+                self.held -= lost
+            self.print_to_area(f"⚠️ 租约已经过期 并被其他节点领取: {len(lost)} 个任务", color='red')
+            if on_lost is not None:
+                on_lost(sorted(lost))
+
+    def _run(self, on_files, slots, on_lost, on_drained):
+        last_heartbeat = time.time()
+        while True:
+            try:
+                self._flush_finished()
+                if time.time() - last_heartbeat >= self.heartbeat_interval:
+                    last_heartbeat = time.time()
+                    self._heartbeat(on_lost)
+                if self._stop_event.is_set():
+                    return
+                with self.lock:
+                    want = slots() + self.prefetch - len(self.held)
+                if want > 0:
+                    paths = self.store.lease(self.owner, want)
+                    if paths:
+                        with self.lock:
+                            self.held.update(paths)
+                        on_files(paths)
+                    elif self.exit_when_done and not self.held and self.store.is_drained():
+                        self.print_to_area("🏁 所有任务都已经完成", color='green')
+                        if on_drained is not None:
+                            on_drained()
+                        return
+            except sqlite3.Error as e:
+                # 共享的数据库暂时无法访问, 下次再试; 租约在到期前 仍然有效
+                self.print_to_area(f"😱 任务表访问出错:{e}", color='red')
+            self._stop_event.wait(self.poll_interval)
+
+    def stop(self, release=True):
+        # 写回已经结束的任务, 还没完成的任务 放回 pending
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self._flush_finished()
+            with self.lock:
+                held = sorted(self.held)
+                self.held = set()
+            if release and held:
+                self.store.release(self.owner, held)
+        except sqlite3.Error as e:
+            self.print_to_area(f"😱 任务表访问出错:{e}", color='red')
+
+
+class JobCoordinator:
+    """
+    协调节点: 遍历输入目录 把文件加入 Job_Lease, 之后定时
+    把租约已经过期的任务放回 pending (对应的 worker 已经崩溃 或 断网), 并输出各个节点的进度。
+    不转码; 转码由 LeaseClient 所在的 worker 节点进行。没有 watcher 时 所有任务结束后退出。
+    """
+
+    def __init__(self, store, print_to_area, status_interval=10, emit=None):
+        self.store = store
+        self.print_to_area = print_to_area
+        self.status_interval = status_interval
+        self.emit = emit if emit is not None else (lambda event, **fields: None)
+
+    def enqueue(self, items):
+        count = self.store.enqueue(items)
+        if count:
+            self.print_to_area(f"📥 加入 {count} 个任务", color='green')
+        return count
+
+    def run(self, file_iter, watcher=None):
+        self.store.set_control('enqueue_done', 0)
+        batch = []
+        for item in file_iter:
+            batch.append(item)
+            if len(batch) >= self.store.batch_size:
+                self.enqueue(batch)
+                batch = []
+        self.enqueue(batch)
+        if watcher is not None:
+            watcher.start(self.enqueue)
+            self.print_to_area(f"👁️ 开始监控目录:{watcher.dir_path}", color='green')
+        else:
+            self.store.set_control('enqueue_done', 1)
+        try:
+            while True:
+                for file_path, owner in self.store.reclaim_expired():
+                    self.print_to_area(f"♻️ 租约过期, 重新分配:{file_path} (原节点 {owner})", color='red')
+                    self.emit("lease_expired", file=file_path, owner=owner)
+                counts, leased = self.store.status()
+                self.report(counts, leased)
+                if watcher is None and self.store.is_drained():
+                    self.print_to_area("🏁 所有任务都已经完成", color='green')
+                    return counts
+                time.sleep(self.status_interval)
+        except KeyboardInterrupt:
+            self.print_to_area("用户键盘退出")
+        finally:
+            if watcher is not None:
+                watcher.stop()
+
+    def report(self, counts, leased):
+        self.print_to_area(
+            f"📊 等待:{counts.get(JobState.PENDING, 0)} 运行:{counts.get(JobState.LEASED, 0)} "
+            f"完成:{counts.get(JobState.DONE, 0)} 失败:{counts.get(JobState.FAILED, 0)}")
+        for file_path, owner, seconds, duration, _heartbeat_time in leased:
+            percent = f"{100 * seconds / duration:.0f}%" if seconds and duration else "-"
+            self.print_to_area(f"    {owner}: {os.path.basename(file_path)} {percent}")
+        self.emit("jobs_status", counts=counts,
+                  leased=[{"file": x[0], "owner": x[1], "seconds": x[2], "duration": x[3]} for x in leased])
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from FFmpegUtil import FFmpegUtil
+from FileHasher import FileHasher
+from ContainerProbe import ContainerProbe
+
+
+class ProbeService:
+    """
+    在有大小限制的线程池中运行 ffprobe, 每个请求返回一个 Future
+    - 同时运行的 ffprobe 不超过 max_workers 个 (输入文件的 probe 和 输出文件的校验 共用), 每个 ffprobe 超过 timeout 秒被杀掉,
+      Future 得到 subprocess.TimeoutExpired
+    - submit_many 一次提交一批文件; 同一个文件 已经在排队 / 正在 probe 时 不再启动新的 ffprobe, 返回同一个 Future
+    - verify 在线程池中 probe 转码输出的文件 并计算 sample sha256 和快速指纹, 主循环不再等待大文件的 probe
+    ffprobe 每个进程只能打开一个输入文件, 所以一批文件仍然是每个文件一个进程, 只是一次排入线程池
+    fast_headers 时 先用 ContainerProbe 直接读取 MP4 / Matroska 的文件头, 读不了的文件 才运行 ffprobe
+    """
+
+    def __init__(self, max_workers=4, timeout=60, fast_headers=False):
+        self.timeout = timeout
+        self.fast_headers = fast_headers
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ffprobe")
+        self.lock = threading.Lock()
+        self.in_flight = {}     # (类型, 文件路径) -> Future
+
+    def _submit(self, kind, fn, file_path):
+        key = (kind, file_path)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            future = self.pool.submit(fn, file_path)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda _future: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self.lock:
+            self.in_flight.pop(key, None)
+
+    def submit(self, file_path):
+        # Future 的结果为 FFmpegUtil.ffmpeg_video_info 的结果
+        return self._submit('probe', self._probe_one, file_path)
+
+    def submit_many(self, file_path_list):
+        # 与 file_path_list 顺序相同的 Future 列表
+        return [self.submit(file_path) for file_path in file_path_list]
+
+    def probe(self, file_path):
+        # 同步 probe, 供已经在后台线程中的调用者使用 (例如 TaskProducer), 出错时抛出异常
+        return self.submit(file_path).result()
+
+    def verify(self, file_path):
+        """
+        校验转码输出的文件
+        Future 的结果为 insert_video_file_state 需要的 {"v_info", "sha256", "fingerprint"}, ffprobe 失败时抛出异常
+        """
+        return self._submit('verify', self._verify_one, file_path)
+
+    def _probe_one(self, file_path):
+        if self.fast_headers:
+            return ContainerProbe.video_info(file_path, timeout=self.timeout)
+        return FFmpegUtil.ffmpeg_video_info(file_path, timeout=self.timeout)
+
+    def _verify_one(self, file_path):
+        return {
+            "v_info": self._probe_one(file_path),
+            "sha256": FFmpegUtil.cal_sample_sha256(file_path),
+            "fingerprint": FileHasher.fast_fingerprint(file_path),
+        }
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,123 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+
+
+class ProcessControl:
+    # ffmpeg 子进程的启动 和 停止
+    # 不使用 shell=True: 直接启动 ffmpeg, 并放到单独的进程组中,
+    # 这样 Ctrl+C 不会直接传给 ffmpeg, 停止时也能把整个进程组一起结束, 不会留下孤儿进程
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def popen(command, **kwargs):
+        kwargs.setdefault('stdin', subprocess.PIPE)  # 通过 stdin 发送 q 让 ffmpeg 正常结束
+        if os.name == 'nt':
+            kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True  # 新的 session 同时也是新的进程组, pgid == pid
+        return subprocess.Popen(command, shell=False, **kwargs)
+
+    @staticmethod
+    def request_quit(process):
+        # 向 ffmpeg 的 stdin 写入 q, ffmpeg 会写完文件尾后退出
+        if process.poll() is not None or process.stdin is None:
+            return
+        try:
+            process.stdin.write(b'q')
+            process.stdin.flush()
+            process.stdin.close()
+        except (OSError, ValueError):
+            pass    # 进程已经退出 管道已经关闭
+
+    @staticmethod
+    def terminate_group(process):
+        if process.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(process.pid, signal.SIGTERM)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def kill_group(process):
+        if process.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                process.kill()  # 没有 shell 进程, 直接结束 ffmpeg 本身
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def wait_all(process_list, timeout):
+        # 等待所有进程退出, 总共最多等待 timeout 秒, 返回还没有退出的进程
+        deadline = time.time() + timeout
+        alive = list(process_list)
+        while alive:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                alive[0].wait(timeout=remaining)
+            except subprocess.TimeoutExpired:
+                break
+            alive = [p for p in alive if p.poll() is None]
+        return [p for p in alive if p.poll() is None]
+
+    @staticmethod
+    def stop_all(process_list, graceful_timeout=5, terminate_timeout=3):
+        """
+        停止一组 ffmpeg 进程:
+        1. 先发送 q 让 ffmpeg 正常结束
+        2. graceful_timeout 秒后还没退出的 向进程组发送 SIGTERM / CTRL_BREAK
+        3. 再过 terminate_timeout 秒还没退出的 强制 kill 整个进程组
+        所有进程同时进行每一步, 总的等待时间不随进程个数增加
+        """
+        process_list = [p for p in process_list if p is not None]
+        for p in process_list:
+            ProcessControl.request_quit(p)
+        alive = ProcessControl.wait_all(process_list, graceful_timeout)
+        for p in alive:
+            ProcessControl.terminate_group(p)
+        alive = ProcessControl.wait_all(alive, terminate_timeout)
+        for p in alive:
+            ProcessControl.kill_group(p)
+        ProcessControl.wait_all(alive, terminate_timeout)
+
+    @staticmethod
+    def stop_all_async(process_list, graceful_timeout=5, terminate_timeout=3):
+        """
+        与 stop_all 相同, 但不等待: 马上发送 q, 之后的 SIGTERM / kill 在后台线程中进行
+        进程退出后 由读取输出的线程发出 EXIT 事件, 调用方 (主循环) 不会被阻塞
+        :return: 执行后续步骤的线程
+        """
+        process_list = [p for p in process_list if p is not None]
+        for p in process_list:
+            ProcessControl.request_quit(p)
+        thread = threading.Thread(target=ProcessControl.stop_all, args=(process_list, graceful_timeout, terminate_timeout),
+                                  name="stop-ffmpeg", daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def stop(process, graceful_timeout=5, terminate_timeout=3):
+        ProcessControl.stop_all([process], graceful_timeout, terminate_timeout)
+
+    @staticmethod
+    def remove_partial_output(file_path):
+        # 删除没有转码完成的输出文件, 返回是否删除了文件
+        try:
+            os.remove(file_path)
+            return True
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,110 @@
+import re
+import shutil
+import statistics
+from TaskScheduler import estimate_task_cost
+
+
+class RunEstimator:
+    """
+    根据历史运行记录 估算任务的转码时间 和 输出文件大小。
+    历史记录 = 转码成功的 Run_Task_Record + 输入 / 输出的 Video_File_State (分段转码的记录 墙上时间不是单个 ffmpeg 的, 不使用)
+    按 (编码器, 源视频编码, 分辨率档位) 分组, 每组取中位数:
+        速度:   每秒墙上时间 完成多少 "1080p 视频秒" (estimate_task_cost 的单位), 与 nominal_speed 含义相同
+        压缩比: 输出文件大小 / 输入文件大小
+    样本不足 min_samples 的组 依次退回 (编码器, 分辨率) -> (编码器) -> 全部记录 -> 配置的默认值
+    """
+    history_limit = 5000    # 只使用最近的这么多条记录
+
+    def __init__(self, default_speed=1.0, default_ratio=0.5, min_samples=3):
+        self.default_speed = default_speed
+        self.default_ratio = default_ratio
+        self.min_samples = max(1, min_samples)
+        self.samples = {}   # 分组 -> [(速度, 压缩比), ...]
+        self.sample_count = 0
+
+    @staticmethod
+    def resolution_class(v_info):
+        # 按短边分档, 竖屏视频与横屏视频 同一档
+        short_side = min(int(v_info.get('video_width') or 0), int(v_info.get('video_height') or 0))
+        for limit, name in ((2000, '2160p'), (1300, '1440p'), (1000, '1080p'), (700, '720p')):
+            if short_side >= limit:
+                return name
+        return 'sd'
+
+    @staticmethod
+    def task_encoder(task):
+        profile = task.get('profile')
+        return profile.encoder if profile is not None else 'hevc_qsv'
+
+    @staticmethod
+    def bucket_keys(encoder, v_info):
+        # 从细到粗的分组, 用于样本不足时退回
+        codec = str(v_info.get('video_codec') or '').lower()
+        resolution = RunEstimator.resolution_class(v_info)
+        return [(encoder, codec, resolution), (encoder, resolution), (encoder,), ()]
+
+    def load(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            select rr.cmd, rr.end_running_time - rr.start_running_time,
+                   vv.video_duration, vv.file_size, vv.video_codec, vv.video_width, vv.video_height, vv.video_bit_rate,
+                   oo.file_size
+            from "Run_Task_Record" rr
+            join "Video_File_State" vv on vv.id = rr.video_file_id
+            join "Video_File_State" oo on oo.id = rr.output_video_file_id
+            where rr.output_has_error = False and rr.end_running_time > rr.start_running_time
+              and not exists (select 1 from "Run_Segment_Record" ss where ss.run_record_id = rr.id)
+            order by rr.id desc
+            limit ?
+        ''', (self.history_limit,))
+        for cmd, elapsed, duration, in_size, codec, width, height, bit_rate, out_size in cursor.fetchall():
+            result = re.search(r'-c:v\s+(\S+)', cmd or '')
+            v_info = {'duration': duration, 'size': in_size, 'video_codec': codec, 'video_width': width,
+                      'video_height': height, 'video_bit_rate': bit_rate}
+            self.add(result.group(1) if result else 'hevc_qsv', v_info, elapsed, out_size)
+        return self
+
+    def add(self, encoder, v_info, elapsed, output_size):
+        # 一次成功的转码, 转码成功时调用 后续的估算 马上使用这条记录
+        in_size = int(v_info.get('size') or 0)
+        cost = estimate_task_cost(v_info)
+        if elapsed <= 0 or cost <= 0 or in_size <= 0 or not output_size:
+            return
+        sample = (cost / elapsed, int(output_size) / in_size)
+        for key in self.bucket_keys(encoder, v_info):
+            self.samples.setdefault(key, []).append(sample)
+        self.sample_count += 1
+
+    def rates(self, encoder, v_info):
+        """
+        :return: (速度, 压缩比)
+        """
+        for key in self.bucket_keys(encoder, v_info):
+            samples = self.samples.get(key)
+            if samples and len(samples) >= self.min_samples:
+                return (statistics.median(x[0] for x in samples),
+                        statistics.median(x[1] for x in samples))
+        return self.default_speed, self.default_ratio
+
+    def predict(self, task):
+        """
+        估算一个任务 (整个文件 / 分段 / 拼接) 的转码秒数 和 输出字节数
+        分段按时长占整个文件的比例计算; 拼接只复制数据, 时间忽略不计, 输出为整个文件的大小
+        """
+        v_info = task['v_info']
+        speed, ratio = self.rates(self.task_encoder(task), v_info)
+        full_duration = float(v_info.get('duration') or 0)
+        part = 1.0
+        if task.get('kind') == 'segment' and full_duration > 0:
+            part = float(task['duration']) / full_duration
+        output_bytes = int(int(v_info.get('size') or 0) * ratio * part)
+        if task.get('kind') == 'concat':
+            return 0.0, output_bytes
+        cost = task.get('cost')
+        if cost is None:
+            cost = estimate_task_cost(v_info) * part
+        return cost / speed, output_bytes
+
+    @staticmethod
+    def free_bytes(path):
+        return shutil.disk_usage(path).free
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from DatabaseHelper import retry_on_database_locked
+
+
+class SamplePreflight:
+    """
+    转码前的抽样预检: 用选定的编码方式 在视频中均匀取 sample_count 段, 每段编码 sample_seconds 秒,
+    按 (抽样输出的字节数 / 抽样的秒数) × 总时长 推算输出文件大小。
+    推算的大小 超过原文件的 max_ratio 倍 (变大 或者 压缩得太少) 时 不转码,
+    在 task['skip_reason'] 中写入推算结果, 由 check_bypass 记录到 ByPass_File_Log。
+    结果按 (快速指纹, 编码方式, 质量) 保存在 Preflight_Result 表中, 同一个文件不会重复抽样;
+    与 ProbeCache 一样 启动时读入内存, 新结果由 flush 批量写回。
+    抽样编码和正式转码 使用同一个编码器, max_parallel 限制同时进行的抽样个数。
+    """
+
+    def __init__(self, db_path, sample_count=3, sample_seconds=5, max_ratio=0.95, min_duration=120, timeout=120,
+                 max_parallel=1):
+        self.db_path = db_path
+        self.sample_count = max(1, sample_count)
+        self.sample_seconds = sample_seconds
+        self.max_ratio = max_ratio
+        self.min_duration = min_duration    # 比这个短的视频 抽样的意义不大, 直接转码
+        self.timeout = timeout              # 每一段抽样编码的超时秒数
+        self.results = {}       # (指纹, 编码方式, 质量) -> (抽样秒数, 推算大小, 压缩比)
+        self.dirty_rows = {}
+        self.lock = threading.Lock()
+        self._slots = threading.Semaphore(max(1, max_parallel))
+
+    def load(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                select file_fingerprint, profile, quality, sample_seconds, predicted_size, ratio
+                from "Preflight_Result"
+            ''')
+            with self.lock:
+                for row in cursor.fetchall():
+                    self.results[tuple(row[:3])] = tuple(row[3:])
+        finally:
+            conn.close()
+        return self
+
+    @retry_on_database_locked()
+    def flush(self):
+        with self.lock:
+            dirty_rows = self.dirty_rows
+            self.dirty_rows = {}
+        if not dirty_rows:
+            return
+        now = int(time.time())
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executemany('''
+                insert or replace into "Preflight_Result" (
+                    file_fingerprint, profile, quality, sample_seconds, predicted_size, ratio, create_time
+                ) values (?,?,?,?,?,?,?)
+            ''', [(*key, *value, now) for key, value in dirty_rows.items()])
+            conn.commit()
+        except Exception:
+            with self.lock:
+                for key, value in dirty_rows.items():
+                    self.dirty_rows.setdefault(key, value)
+            raise
+        finally:
+            conn.close()
+
+    def sample_points(self, duration):
+        # 均匀分布在 (0, duration) 之间, 避开片头片尾
+        return [duration * (i + 1) / (self.sample_count + 1) for i in range(self.sample_count)]
+
+    def measure(self, task, temp_dir):
+        """
+        抽样编码 推算输出大小
+        :return: (抽样秒数, 推算大小, 压缩比), 抽样全部失败时返回 None
+        """
+        profile, quality = task['profile'], task['global_quality']
+        duration = float(task['v_info']['duration'])
+        base = os.path.join(temp_dir, f"{os.path.basename(task['file_path'])}_{time.time()}.preflight")
+        sample_bytes, sample_seconds = 0, 0.0
+        for i, start in enumerate(self.sample_points(duration)):
+            seconds = min(self.sample_seconds, duration - start)
+            sample_path = f"{base}_{i}{profile.output_ext}"
+            command = profile.command(task['file_path'], sample_path, quality,
+                                      input_args=['-ss', f'{start:.3f}'], output_args=['-t', f'{seconds:.3f}'])
+            try:
+                with self._slots:
+                    result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, timeout=self.timeout)
+                if result.returncode == 0 and os.path.getsize(sample_path) > 0:
+                    sample_bytes += os.path.getsize(sample_path)
+                    sample_seconds += seconds
+            except (OSError, subprocess.TimeoutExpired):
+                pass    # 这一段抽样失败, 只用其他段推算
+            finally:
+                if os.path.exists(sample_path):
+                    os.remove(sample_path)
+        if sample_seconds <= 0:
+            return None
+        predicted_size = int(sample_bytes / sample_seconds * duration)
+        return sample_seconds, predicted_size, predicted_size / max(1, int(task['v_info']['size']))
+
+    def check(self, task, temp_dir):
+        """
+        预检一个任务, 不值得转码时 设置 task['skip_reason']
+        :return: (抽样秒数, 推算大小, 压缩比), 没有预检时返回 None
+        """
+        if task.get('skip_reason') or float(task['v_info']['duration'] or 0) < self.min_duration:
+            return None
+        key = (task['fingerprint'], task['profile'].name, str(task['global_quality']))
+        with self.lock:
+            result = self.results.get(key)
+        if result is None:
+            result = self.measure(task, temp_dir)
+            if result is None:
+                return None
+            with self.lock:
+                self.results[key] = result
+                self.dirty_rows[key] = result
+        sample_seconds, predicted_size, ratio = result
+        if ratio > self.max_ratio:
+            task['skip_reason'] = (f"抽样预检: 抽样 {sample_seconds:.0f} 秒, 预计输出 {predicted_size} 字节, "
+                                   f"为原文件的 {ratio:.2f} 倍 (上限 {self.max_ratio}), 不转码: {task['file_path']}")
+            task['skip_kind'] = 'preflight'
+        return result
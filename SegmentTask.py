@@ -0,0 +1,128 @@
+import os
+from FFmpegUtil import FFmpegUtil
+from TaskScheduler import estimate_task_cost
+
+
+class SegmentSplitter:
+    """
+    把一个长视频 按关键帧切分成若干段, 每一段作为一个独立的任务 占用一个 slot 转码,
+    全部完成后 再生成一个 concat 任务, 用 concat demuxer 把各段拼接成最终的输出文件。
+    每一段从关键帧开始 (-ss 放在 -i 之前, 定位到关键帧是精确的), 段与段之间没有重叠也没有空隙。
+
+    同一个文件的所有分段任务 共享一个 group dict:
+        task:             原始的(不分段时的)任务
+        segment_count:    分段个数
+        segment_dir:      分段输出文件所在的目录
+        finished_count:   已经结束(完成/失败/略过) 的分段个数
+        failed:           是否有分段失败
+        bypass:           None 还没检查 / True 整个文件略过 / False 需要转码
+        run_record_id:    Run_Task_Record 的 id, 整个文件只有一条记录
+        video_file_id:    Video_File_State 的 id
+    """
+
+    def __init__(self, min_duration=3600, segment_count=4, keyframe_search_seconds=30):
+        self.min_duration = min_duration
+        self.segment_count = segment_count
+        self.keyframe_search_seconds = keyframe_search_seconds
+
+    def should_split(self, task):
+        return self.segment_count > 1 and float(task['duration']) >= self.min_duration
+
+    def split_points(self, file_path, duration):
+        # 返回分段的时间点 [0, k1, k2, ..., duration], k 都是关键帧
+        points = [0.0]
+        for i in range(1, self.segment_count):
+            keyframe = FFmpegUtil.find_keyframe_after(
+                file_path, duration * i / self.segment_count, self.keyframe_search_seconds)
+            if keyframe is not None and points[-1] < keyframe < duration:
+                points.append(keyframe)
+        points.append(duration)
+        return points
+
+    def split(self, task):
+        """
+        :return: 分段任务的列表, 无法分段(找不到关键帧)时 返回只包含原任务的列表
+        """
+        duration = float(task['duration'])
+        points = self.split_points(task['file_path'], duration)
+        if len(points) <= 2:
+            return [task]
+
+        segment_dir = task['dstfile_path'] + ".segments"   # 第一个分段开始运行时创建
+        group = {
+            'task': task,
+            'segment_count': len(points) - 1,
+            'segment_dir': segment_dir,
+            'finished_count': 0,
+            'failed': False,
+            'bypass': None,
+            'run_record_id': None,
+            'video_file_id': None,
+        }
+        segment_tasks = []
+        running_output_base = os.path.splitext(task['running_output_path'])[0]
+        total_cost = estimate_task_cost(task['v_info'])
+        for i in range(len(points) - 1):
+            start, end = points[i], points[i + 1]
+            segment_path = os.path.join(segment_dir, f"segment_{i:03d}.mkv")
+            command = task['profile'].command(
+                task['file_path'], segment_path, task['global_quality'],
+                input_args=['-ss', f'{start:.6f}'],
+                output_args=['-t', f'{end - start:.6f}'],
+            )
+            segment_tasks.append({
+                **task,
+                'kind': 'segment',
+                'duration': end - start,
+                'dstfile_path': segment_path,
+                'command': command,
+                'running_output_path': f"{running_output_base}.segment_{i:03d}.txt",
+                'cost': total_cost * (end - start) / duration,
+                'segment_group': group,
+                'segment_index': i,
+                'segment_start': start,
+                'segment_end': end,
+            })
+        return segment_tasks
+
+    @staticmethod
+    def build_concat_task(group):
+        # 所有分段都完成后 生成拼接任务: 只复制数据 不重新编码
+        task = group['task']
+        list_path = os.path.join(group['segment_dir'], "concat_list.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for i in range(group['segment_count']):
+                segment_path = os.path.abspath(os.path.join(group['segment_dir'], f"segment_{i:03d}.mkv"))
+                escaped = segment_path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        command = [
+            'ffmpeg',
+            '-hide_banner',
+            '-nostats', '-progress', 'pipe:1',
+            '-f', 'concat', '-safe', '0',
+            '-i', list_path,
+            '-c', 'copy',
+            task['dstfile_path'], '-y'
+        ]
+        return {
+            **task,
+            'kind': 'concat',
+            'command': command,
+            'running_output_path': f"{os.path.splitext(task['running_output_path'])[0]}.concat.txt",
+            'segment_group': group,
+        }
+
+    @staticmethod
+    def remove_segments(group):
+        # 删除分段的中间文件, 同一组的多个分段都可能调用, 目录已经删除时 直接返回
+        if not os.path.isdir(group['segment_dir']):
+            return
+        for file_name in os.listdir(group['segment_dir']):
+            try:
+                os.remove(os.path.join(group['segment_dir'], file_name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(group['segment_dir'])
+        except OSError:
+            pass
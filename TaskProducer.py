@@ -0,0 +1,178 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from FFmpegUtil import FFmpegUtil
+from EncoderProfile import ProfileEngine
+
+
+class TaskProducer:
+    # 任务生产者
+    # 在一个有大小限制的线程池中 并行的 ffprobe + 计算 sha256,
+    # 每个文件处理完 立刻放入任务队列, 转码不用等整个目录都 probe 完才开始
+    # 传入 probe_cache 时 (路径, 大小, 修改时间) 都没变的文件 直接使用缓存的结果 (ffprobe 信息 + 哈希)
+    # keep_open 时 (监控目录模式) 可以用 add_files 继续追加文件, 调用 close 之后 处理完所有文件才算结束
+    # 文件可以是路径 也可以是 FileDiscovery 得到的 os.DirEntry, DirEntry 直接使用它缓存的 stat 结果
+    cache_flush_interval = 200  # 每新增多少条缓存 写回一次数据库
+
+    def __init__(self, file_path_list, output_dir, global_quality, running_output_dir, print_to_area,
+                 max_workers=4, task_queue=None, probe_cache=None, notify=None, splitter=None, keep_open=False,
+                 profiles=None, preflight=None, on_load_failed=None, probe_service=None):
+        self.file_path_list = file_path_list
+        self.output_dir = output_dir
+        self.global_quality = global_quality
+        self.running_output_dir = running_output_dir
+        self.print_to_area = print_to_area
+        self.max_workers = max(1, max_workers)
+        self.task_queue = task_queue if task_queue is not None else queue.Queue()
+        self.probe_cache = probe_cache
+        self.notify = notify    # 放入任务 和 全部完成时 调用, 用来唤醒等待任务的消费者
+        self.splitter = splitter    # SegmentSplitter, 长视频切分成多个分段任务
+        self.profiles = profiles if profiles is not None else ProfileEngine(global_quality)  # 每个文件的编码方式
+        self.preflight = preflight  # SamplePreflight, probe 之后 抽样编码 去掉不值得转码的文件
+        self.on_load_failed = on_load_failed    # probe 失败时调用 on_load_failed(文件路径)
+        self.probe_service = probe_service      # ProbeService, 限制同时运行的 ffprobe 个数 和 超时; 为空时直接运行 ffprobe
+        self.total_count = len(file_path_list)  # 需要 probe 的文件个数
+        self.failed_count = 0                   # probe 失败 没有进入任务队列的文件个数
+        self._count_lock = threading.Lock()
+        self._done_event = threading.Event()
+        self._thread = None
+        self._input = queue.Queue()     # 等待 probe 的 (文件, 是否排在队列最前面), None 为结束标记
+        self._closed = False
+        self._pending = len(file_path_list)     # 已经加入 还没有处理完的文件个数
+        for file_path in file_path_list:
+            self._input.put((file_path, False))
+        if not keep_open:
+            self.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="TaskProducer", daemon=True)
+        self._thread.start()
+        return self
+
+    def is_done(self):
+        # 所有文件都 probe 完了(成功进入队列 或者 失败)
+        return self._done_event.is_set()
+
+    def is_idle(self):
+        # 已经加入的文件都处理完了, 监控目录模式下 还可能继续追加
+        with self._count_lock:
+            return self._pending == 0
+
+    def wait(self, timeout=None):
+        return self._done_event.wait(timeout)
+
+    def add_files(self, file_path_list, front=False):
+        # 运行中追加文件, close 之后不能再追加
+        # front: probe 完成后 任务排在队列最前面 (例如 上一次运行中断的任务)
+        with self._count_lock:
+            if self._closed:
+                raise RuntimeError("task producer is closed")
+            self.total_count += len(file_path_list)
+            self._pending += len(file_path_list)
+        for file_path in file_path_list:
+            self._input.put((file_path, front))
+
+    def close(self):
+        # 不再追加文件, 已经加入的文件处理完后 is_done 为 True
+        with self._count_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._input.put(None)
+
+    def _run(self):
+        # 用信号量限制 已提交但未完成的个数, 避免一次把几千个文件都塞进线程池的等待队列
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def release(_future):
+            slots.release()
+            with self._count_lock:
+                self._pending -= 1
+                idle = self._pending == 0 and not self._closed
+            # 监控目录模式下 没有文件可处理时 把缓存写回数据库
+            if idle and (self.probe_cache is not None and self.probe_cache.pending_count() > 0
+                         or self.preflight is not None):
+                self._flush_cache()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="probe") as pool:
+                while True:
+                    entry = self._input.get()
+                    if entry is None:
+                        break
+                    slots.acquire()
+                    pool.submit(self._load_one, *entry).add_done_callback(release)
+        except Exception as e:
+            self.print_to_area(f"😱 task producer error: {e}", color='red')
+        finally:
+            self._flush_cache()
+            self._done_event.set()
+            self._notify()
+
+    def _notify(self):
+        if self.notify is not None:
+            self.notify()
+
+    def _flush_cache(self):
+        try:
+            if self.probe_cache is not None:
+                self.probe_cache.flush()
+            if self.preflight is not None:
+                self.preflight.flush()
+        except Exception as e:
+            self.print_to_area(f"😱 probe cache flush error: {e}", color='red')
+
+    def _load_one(self, item, front=False):
+        file_path = os.fspath(item)
+        self.print_to_area(f"loading:{file_path}")
+        try:
+            cached = None
+            if self.probe_cache is not None:
+                st = item.stat() if isinstance(item, os.DirEntry) else os.stat(file_path)
+                cached = self.probe_cache.get(file_path, st)
+            if cached is not None:
+                v_info, sha256, fingerprint = cached
+                task = FFmpegUtil.build_av1_task(file_path, self.output_dir, self.global_quality,
+                                                 self.running_output_dir, v_info=v_info, sha256=sha256,
+                                                 fingerprint=fingerprint, profiles=self.profiles)
+                if fingerprint is None:     # 旧版本的缓存 补上指纹
+                    self.probe_cache.put(file_path, st, v_info, sha256, task['fingerprint'])
+            else:
+                task = FFmpegUtil.build_av1_task(
+                    file_path, self.output_dir, self.global_quality, self.running_output_dir, profiles=self.profiles,
+                    probe=self.probe_service.probe if self.probe_service is not None else None)
+                if self.probe_cache is not None:
+                    self.probe_cache.put(file_path, st, task['v_info'], task['sha256'], task['fingerprint'])
+                    if self.probe_cache.pending_count() >= self.cache_flush_interval:
+                        self._flush_cache()
+        except Exception as e:  # ffprobe 解析出错
+            with self._count_lock:
+                self.failed_count += 1
+            self.print_to_area(f"😱load error :{e}", color='red')
+            if self.on_load_failed is not None:
+                self.on_load_failed(file_path)
+            self._notify()
+            return
+        if self.preflight is not None:
+            try:
+                self.preflight.check(task, self.running_output_dir)
+            except Exception as e:  # 预检出错 照常转码
+                self.print_to_area(f"😱 preflight error :{e}", color='red')
+        put = self.task_queue.put_front if front and hasattr(self.task_queue, 'put_front') else self.task_queue.put
+        for sub_task in self._split(task):
+            put(sub_task)
+        self._notify()
+        self.print_to_area(f"👌 加入任务队列:{file_path}")
+
+    def _split(self, task):
+        if self.splitter is None or not self.splitter.should_split(task):
+            return [task]
+        try:
+            tasks = self.splitter.split(task)
+        except Exception as e:  # 查找关键帧出错 不分段
+            self.print_to_area(f"😱 split error :{e}", color='red')
+            return [task]
+        if len(tasks) > 1:
+            self.print_to_area(f"✂️ 分成 {len(tasks)} 段:{task['file_path']}")
+        return tasks
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+
+try:
+    import psutil   # 可选依赖, 没有安装时 使用 os.getloadavg
+except ImportError:
+    psutil = None
+
+
+def cpu_load():
+    """
+    当前 CPU 负载, 0~1 之间(可能略大于1), 无法获取时返回 None
+    """
+    if psutil is not None:
+        return psutil.cpu_percent(interval=None) / 100
+    if hasattr(os, 'getloadavg'):
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    return None
+
+
+class AdaptiveConcurrency:
+    """
+    根据实时吞吐量 调整同时运行的 ffmpeg 个数。
+    吞吐量 = 所有任务 每秒钟一共编码了多少秒的视频 (由 -progress 的 out_time 增量累加得到)。
+    每隔 adjust_interval 秒 测量一次吞吐量, 用爬山法调整:
+    试探性的 +1/-1 后 吞吐量提升超过 min_gain 就继续往同一个方向, 否则退回原来的并发数,
+    在原来的并发数上 停留 settle_windows 个周期后 再向另一个方向试探。CPU 已经跑满时 不再增加。
+    只有所有 slot 都在运行任务时 测量才有效, 任务不够时 不做调整。
+    """
+
+    def __init__(self, min_slots, max_slots, initial_slots=None, adjust_interval=30, min_gain=0.05,
+                 cpu_high=0.95, settle_windows=4):
+        self.min_slots = max(1, min_slots)
+        self.max_slots = max(self.min_slots, max_slots)
+        self.limit = min(max(initial_slots or self.min_slots, self.min_slots), self.max_slots)
+        self.adjust_interval = adjust_interval
+        self.min_gain = min_gain
+        self.cpu_high = cpu_high
+        self.settle_windows = settle_windows
+        self.direction = 1              # 下一次试探的方向
+        self.probing_from = None        # 正在试探时 试探前的并发数
+        self.hold = 0                   # 还要停留多少个周期 才进行下一次试探
+        self.throughput = {}            # 并发数 -> 最近一次测量到的吞吐量
+        self.encoded_seconds = 0.0      # 累计编码的视频秒数
+        self.window_start_time = time.time()
+        self.window_start_encoded = 0.0
+        self.window_valid = True        # 窗口内 slot 是否一直是满的
+
+    def add_encoded_seconds(self, seconds):
+        if seconds > 0:
+            self.encoded_seconds += seconds
+
+    def observe_running(self, running_count):
+        # 有 slot 空闲(任务不够) 时 这个窗口的测量不能代表当前并发数的吞吐量
+        if running_count < self.limit:
+            self.window_valid = False
+
+    def reset_window(self, now):
+        self.window_start_time = now
+        self.window_start_encoded = self.encoded_seconds
+        self.window_valid = True
+
+    def next_probe(self, limit):
+        # 按当前方向试探的下一个并发数, 超出范围 或 CPU 跑满时 换一个方向, 都不行返回 None
+        load = cpu_load()
+        for direction in (self.direction, -self.direction):
+            new_limit = limit + direction
+            if new_limit < self.min_slots or new_limit > self.max_slots:
+                continue
+            if direction > 0 and load is not None and load >= self.cpu_high:
+                continue    # CPU 已经跑满 增加并发只会互相抢占
+            self.direction = direction
+            return new_limit
+        return None
+
+    def maybe_adjust(self, now=None):
+        """
+        到达调整周期时 根据这个周期的吞吐量 调整并发数
+        :return: (旧的并发数, 新的并发数, 吞吐量), 没有调整时返回 None
+        """
+        now = now if now is not None else time.time()
+        elapsed = now - self.window_start_time
+        if elapsed < self.adjust_interval:
+            return None
+        valid = self.window_valid
+        throughput = (self.encoded_seconds - self.window_start_encoded) / elapsed
+        self.reset_window(now)
+        if not valid:
+            return None
+
+        old_limit = self.limit
+        self.throughput[old_limit] = throughput
+        if self.probing_from is not None:
+            previous = self.throughput.get(self.probing_from, 0)
+            if throughput >= previous * (1 + self.min_gain):
+                # 试探成功 继续往同一个方向
+                direction = self.direction
+                self.probing_from = old_limit
+                new_limit = self.next_probe(old_limit)
+                if new_limit is None or self.direction != direction:
+                    # 这个方向已经到头了, 停在当前并发数
+                    self.direction = -direction
+                    self.probing_from = None
+                    self.hold = self.settle_windows
+                    return None
+            else:
+                # 试探失败 退回原来的并发数 停留一段时间后 向另一个方向试探
+                new_limit = self.probing_from
+                self.direction = -1 if old_limit > new_limit else 1
+                self.probing_from = None
+                self.hold = self.settle_windows
+        elif self.hold > 0:
+            self.hold -= 1
+            return None
+        else:
+            new_limit = self.next_probe(old_limit)
+            if new_limit is None:
+                return None
+            self.probing_from = old_limit
+        self.limit = new_limit
+        return old_limit, new_limit, throughput
+
+
+def estimate_task_cost(v_info):
+    """
+    估算一个任务的转码工作量, 单位是 "1080p 视频秒":
+    时长 × 像素数(1920x1080 记为 1), 码率越高 解码越慢, 每 50Mbps 多算一倍
+    """
+    duration = float(v_info.get('duration') or 0)
+    pixels = int(v_info.get('video_width') or 0) * int(v_info.get('video_height') or 0) / (1920 * 1080)
+    bitrate_factor = 1 + int(v_info.get('video_bit_rate') or 0) / 50_000_000
+    return duration * max(pixels, 0.01) * bitrate_factor
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def projected_makespan(cost_list, slots, nominal_speed=1.0):
+    """
+    按 cost_list 的顺序 把任务依次分配给最早空闲的 slot, 返回全部完成需要的秒数
+    :param nominal_speed: 一个 slot 每秒能完成多少 "1080p 视频秒"
+    """
+    finish_times = [0.0] * max(1, slots)
+    for cost in cost_list:
+        earliest = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, earliest + cost / nominal_speed)
+    return max(finish_times)
+
+
+class TaskOrderQueue:
+    """
+    可以指定出队顺序的任务队列, 接口和 queue.Queue 的 put / get(block=False) / empty / qsize 一致
+    fifo: 先进先出
+    ljf:  工作量大的先出 (longest processing time first), 减少最后只剩一个大文件在跑的时间, 总时长最短
+    sjf:  工作量小的先出 (shortest job first), 平均每个文件的等待时间最短
+    put_front 放入的任务 总是排在普通任务之前
+    """
+    policies = ('fifo', 'ljf', 'sjf')
+
+    def __init__(self, policy='fifo'):
+        if policy not in self.policies:
+            raise ValueError(f"unknown task order policy: {policy}, must be one of {self.policies}")
+        self.policy = policy
+        self.heap = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def sort_key(self, task):
+        if self.policy == 'fifo':
+            return 0
+        cost = task.get('cost')
+        if cost is None:
+            cost = task['cost'] = estimate_task_cost(task['v_info'])
+        return -cost if self.policy == 'ljf' else cost
+
+    def put(self, task, front=False):
+        with self.lock:
+            heapq.heappush(self.heap, (0 if front else 1, self.sort_key(task), next(self.counter), task))
+
+    def put_front(self, task):
+        self.put(task, front=True)
+
+    def get(self, block=False):
+        # 只支持非阻塞的 get, 等待任务由调用者的事件循环负责
+        with self.lock:
+            if not self.heap:
+                raise queue.Empty
+            return heapq.heappop(self.heap)[-1]
+
+    def empty(self):
+        with self.lock:
+            return not self.heap
+
+    def qsize(self):
+        with self.lock:
+            return len(self.heap)
+
+    def tasks_in_order(self):
+        # 按出队顺序 返回队列中的任务
+        with self.lock:
+            items = sorted(self.heap, key=lambda x: x[:3])
+        return [x[-1] for x in items]
@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from FFmpegUtil import FFmpegUtil
+
+try:
+    import psutil   # 可选依赖, 没有 /proc 的系统 (windows / macOS) 用它读取进程的资源使用
+except ImportError:
+    psutil = None
+
+
+class ProcessStats:
+    """
+    读取一个进程 到目前为止的资源使用:
+    {"cpu_seconds": 用户态+内核态 CPU 秒数, "rss": 当前内存, "peak_rss": 内存峰值, "read_bytes", "write_bytes": 实际读写存储的字节数}
+    linux 直接读 /proc/<pid>/stat status io, 其他系统使用 psutil; 读不到的项为 None, 进程已经退出时 read 返回 None
+    """
+    proc_dir = '/proc'
+    clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    @staticmethod
+    def available():
+        return os.path.isdir(ProcessStats.proc_dir) or psutil is not None
+
+    @staticmethod
+    def read(pid):
+        if os.path.isdir(ProcessStats.proc_dir):
+            return ProcessStats.read_proc(pid)
+        if psutil is not None:
+            return ProcessStats.read_psutil(pid)
+        return None
+
+    @staticmethod
+    def read_proc(pid):
+        base = os.path.join(ProcessStats.proc_dir, str(pid))
+        stats = {"cpu_seconds": None, "rss": None, "peak_rss": None, "read_bytes": None, "write_bytes": None}
+        try:
+            with open(os.path.join(base, 'stat'), 'rb') as f:
+                # 进程名 (第2项) 中可能有空格和括号, 从最后一个 ')' 之后开始数: state 是第3项, utime stime 是第14 15项
+                fields = f.read().rsplit(b')', 1)[1].split()
+            stats["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / ProcessStats.clock_ticks
+            with open(os.path.join(base, 'status'), 'rb') as f:
+                for line in f:
+                    if line.startswith(b'VmRSS:'):
+                        stats["rss"] = int(line.split()[1]) * 1024
+                    elif line.startswith(b'VmHWM:'):
+                        stats["peak_rss"] = int(line.split()[1]) * 1024
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+        except (OSError, IndexError, ValueError):
+            pass
+        try:
+            # 只有同一个用户的进程才能读 io, 读不到时 保持 None
+            with open(os.path.join(base, 'io'), 'rb') as f:
+                for line in f:
+                    key, _, value = line.partition(b':')
+                    if key in (b'read_bytes', b'write_bytes'):
+                        stats[key.decode()] = int(value)
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    @staticmethod
+    def read_psutil(pid):
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                cpu = process.cpu_times()
+                memory = process.memory_info()
+                stats = {
+                    "cpu_seconds": cpu.user + cpu.system,
+                    "rss": memory.rss,
+                    "peak_rss": getattr(memory, 'peak_wset', None),     # 只有 windows 有峰值
+                    "read_bytes": None,
+                    "write_bytes": None,
+                }
+                try:
+                    io = process.io_counters()  # macOS 没有
+                    stats["read_bytes"], stats["write_bytes"] = io.read_bytes, io.write_bytes
+                except (AttributeError, psutil.AccessDenied):
+                    pass
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            return {"cpu_seconds": None, "rss": None, "peak_rss": None, "read_bytes": None, "write_bytes": None}
+        return stats
+
+
+class TelemetryRecorder:
+    """
+    一个 ffmpeg 进程的运行数据: 每次 sample 记录一次 进程资源 和 最近一组 -progress 的 fps speed bitrate
+    汇总值 (CPU 时间 内存峰值 读写字节数 平均速度...) 随采样累计, 时间序列最多保留 max_points 个点:
+    超过时 丢掉一半的点 之后每隔一个采样才保留一个, 长任务的序列 间隔变大 但总是覆盖整个运行时间
+    """
+    columns = ('t', 'cpu_percent', 'rss', 'read_bytes', 'write_bytes', 'out_seconds', 'fps', 'speed', 'bitrate_kbps')
+
+    def __init__(self, pid, start_time, max_points=240):
+        self.pid = pid
+        self.start_time = start_time
+        self.max_points = max(2, max_points)
+        self.stride = 1             # 每隔几个采样 保留一个点
+        self.sample_count = 0
+        self.rows = []
+        self.last = {"cpu_seconds": None, "rss": None, "peak_rss": None, "read_bytes": None, "write_bytes": None}
+        self.last_cpu = (start_time, 0.0)   # 上一次读到 CPU 时间的 (时间点, CPU 秒数), 用于计算区间的 CPU 使用率
+        self.peak_rss = None
+        self.progress = {}
+        self.fps_sum = 0.0
+        self.fps_count = 0
+        self.min_speed = None
+
+    @staticmethod
+    def number(value):
+        # -progress 中的 "2.5x" "1234.5kbits/s" "N/A"
+        try:
+            return float(str(value).rstrip('xkbits/').strip())
+        except ValueError:
+            return None
+
+    def sample(self, now, progress, read_process=True):
+        # read_process=False: 进程已经退出, 只记录进度, 资源使用 沿用上一次采样的值
+        cpu_percent = None
+        if read_process:
+            stats = ProcessStats.read(self.pid)
+            if stats is not None:
+                self.last = stats
+                for rss in (stats["rss"], stats["peak_rss"]):
+                    if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                        self.peak_rss = rss
+                if stats["cpu_seconds"] is not None:
+                    last_time, last_cpu = self.last_cpu
+                    if now > last_time:
+                        cpu_percent = round((stats["cpu_seconds"] - last_cpu) / (now - last_time) * 100, 1)
+                    self.last_cpu = (now, stats["cpu_seconds"])
+        self.progress = progress or {}
+        fps = self.number(self.progress.get('fps', ''))
+        speed = self.number(self.progress.get('speed', ''))
+        bitrate = self.number(self.progress.get('bitrate', ''))
+        if fps is not None and fps > 0:
+            self.fps_sum += fps
+            self.fps_count += 1
+        if speed is not None and speed > 0 and (self.min_speed is None or speed < self.min_speed):
+            self.min_speed = speed
+
+        self.sample_count += 1
+        if self.sample_count % self.stride != 0:
+            return
+        self.rows.append([round(now - self.start_time, 1), cpu_percent, self.last["rss"],
+                          self.last["read_bytes"], self.last["write_bytes"],
+                          FFmpegUtil.progress_seconds(self.progress), fps, speed, bitrate])
+        if len(self.rows) > self.max_points:
+            self.rows = self.rows[::-2][::-1]     # 隔一个丢一个, 保留最新的点
+            self.stride *= 2
+
+    def summary(self, end_time):
+        wall_seconds = max(end_time - self.start_time, 0)
+        cpu_seconds = self.last["cpu_seconds"]
+        encoded_seconds = FFmpegUtil.progress_seconds(self.progress)
+        return {
+            "wall_seconds": round(wall_seconds, 3),
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": round(cpu_seconds / wall_seconds * 100, 1) if cpu_seconds is not None and wall_seconds > 0 else None,
+            "peak_rss": self.peak_rss,
+            "read_bytes": self.last["read_bytes"],
+            "write_bytes": self.last["write_bytes"],
+            "encoded_seconds": encoded_seconds,
+            "avg_speed": round(encoded_seconds / wall_seconds, 3) if wall_seconds > 0 else None,
+            "min_speed": self.min_speed,
+            "avg_fps": round(self.fps_sum / self.fps_count, 2) if self.fps_count else None,
+            "bitrate_kbps": self.number(self.progress.get('bitrate', '')),  # ffmpeg 输出的是 到目前为止的平均码率
+            "sample_count": self.sample_count,
+        }
+
+    def series_json(self):
+        return json.dumps({"columns": self.columns, "rows": self.rows}, separators=(',', ':'))
+
+    def finish(self, end_time, progress):
+        """
+        进程退出后调用, 用最后一组进度补一个点
+        :return: (summary, series_json), 由 MyDB.record_task_telemetry 写入 Run_Task_Telemetry
+        """
+        self.stride = 1     # 最后一个点总是保留
+        self.sample(end_time, progress, read_process=False)
+        return self.summary(end_time), self.series_json()
+
+
+class TaskTelemetry:
+    """
+    每隔 interval 秒 对所有正在运行的 ffmpeg 进程采样一次, 由主循环调用 due() 判断是否到了采样时间
+    每个任务 (分段转码时 每一段) 结束时 汇总值和时间序列写入 Run_Task_Telemetry, 用 run_record_id 与 Run_Task_Record 关联
+    """
+
+    def __init__(self, interval=5.0, max_points=240):
+        self.interval = max(0.1, interval)
+        self.max_points = max_points
+        self.next_sample_time = 0
+
+    def start(self, pid, start_time=None):
+        return TelemetryRecorder(pid, start_time if start_time is not None else time.time(), self.max_points)
+
+    def due(self, now):
+        if now < self.next_sample_time:
+            return False
+        self.next_sample_time = now + self.interval
+        return True
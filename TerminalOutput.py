@@ -1,6 +1,7 @@
 import os
 import sys
-import re
+import unicodedata
+from functools import lru_cache
 
 class TerminalOutput:
     # 命令行终端操作
@@ -42,14 +43,20 @@ class TerminalOutput:
             raise ValueError(t)
 
 
+    @staticmethod
+    @lru_cache(maxsize=8192)
+    def char_width(char):
+        # 单个字符的显示宽度: 组合字符 0, 东亚宽字符(中文 全角 emoji) 2, 其他 1
+        if unicodedata.combining(char):
+            return 0
+        return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
     @staticmethod
     def get_display_width(s):
         # 计算字符串的显示宽度
-        one_char_width = re.findall(r'[A-Za-z0-9\u0020-\u007F]', s)  # 英文字符、数字和常见标点
-        one_char_count = len(one_char_width)
-        # 其他字符默认占用 2 个字符宽度
-        total_width = one_char_count + 2 * (len(s) - one_char_count)
-        return total_width
+        if s.isascii():
+            return len(s)
+        return sum(TerminalOutput.char_width(char) for char in s)
 
     @staticmethod
     def truncate_string_by_width(s, l):
@@ -61,10 +68,10 @@ class TerminalOutput:
         result = []
         current_width = 0
         for char in s:
-            char_width = 2 if re.match(r'[^A-Za-z0-9\u0020-\u007F]', char) else 1  # 判断字符是否为非ASCII字符
+            char_width = TerminalOutput.char_width(char)
             if current_width + char_width > l-3:
                 break
             result.append(char)
             current_width += char_width
 
-        return ''.join(result) + ".."
\ No newline at end of file
+        return ''.join(result) + ".."
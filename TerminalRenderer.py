@@ -0,0 +1,174 @@
+import os
+import signal
+import sys
+import threading
+import time
+from TerminalOutput import TerminalOutput
+
+
+class RenderLine:
+    """
+    终端中的一行, 可以作为 tqdm 的 file 参数:
+    tqdm 每次刷新写入 '\\r' + 进度条文本, 这里只保留最后一次的文本 交给 renderer, 不直接写终端
+    """
+    encoding = 'utf-8'  # tqdm 根据 encoding 判断能否使用 unicode 字符画进度条
+
+    def __init__(self, renderer, row):
+        self.renderer = renderer
+        self.row = row
+
+    def write(self, s):
+        text = s.split('\r')[-1].rstrip('\n').rstrip()
+        if text:
+            self.renderer.set_line(self.row, text)
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class TerminalRenderer:
+    """
+    终端输出: 各个线程只修改内存中的行 (set_line / log), 由渲染线程统一输出,
+    每一帧只重绘内容有变化的行, 所有转义序列拼成一个字符串 一次 write + flush, 帧率不超过 max_fps。
+    终端大小缓存起来, 收到 SIGWINCH(窗口大小改变) 时才重新获取 并重绘所有行;
+    没有 SIGWINCH 的系统(windows) 每隔 size_check_interval 秒检查一次。
+    """
+    colors = {'red': "\033[31m", 'green': "\033[32m"}
+    size_check_interval = 2
+
+    def __init__(self, max_fps=10, stream=None):
+        self.max_fps = max_fps
+        self.stream = stream if stream is not None else sys.stdout
+        self.lines = {}         # 行号 -> (文本, 颜色, 是否是标题)
+        self.rendered = {}      # 行号 -> 上一次输出到终端的文本(已裁剪, 带颜色)
+        self.log_start_line = None
+        self.log_buff = []
+        self.log_size = 0
+        self.log_dirty = False
+        self.park_line = 1      # 每一帧结束后 光标停留的行
+        self.lock = threading.Lock()
+        self._dirty_event = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._size = None
+        self._size_time = 0
+        if hasattr(signal, 'SIGWINCH') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGWINCH, self._on_resize)
+
+    def _on_resize(self, _signum, _frame):
+        # 信号处理函数中 只做标记, 下一帧重新获取大小
+        self._size = None
+        self._dirty_event.set()
+
+    def terminal_size(self):
+        now = time.time()
+        if self._size is None or (not hasattr(signal, 'SIGWINCH') and now - self._size_time > self.size_check_interval):
+            try:
+                size = os.get_terminal_size()
+            except OSError:     # 输出不是终端
+                size = os.terminal_size((120, 40))
+            if size != self._size:
+                self.rendered = {}  # 大小变了 所有行重绘
+            self._size = size
+            self._size_time = now
+        return self._size
+
+    @property
+    def columns(self):
+        return self.terminal_size().columns
+
+    def set_line(self, row, text, color=None):
+        with self.lock:
+            if self.lines.get(row) != (text, color, False):
+                self.lines[row] = (text, color, False)
+                self._dirty_event.set()
+
+    def set_title(self, row, text):
+        # 标题按终端宽度 两边补上 =, 宽度变化时 重新生成
+        with self.lock:
+            self.lines[row] = (text, 'red', True)
+            self._dirty_event.set()
+
+    def line(self, row):
+        return RenderLine(self, row)
+
+    def set_log_area(self, start_line, size):
+        with self.lock:
+            self.log_start_line = start_line
+            self.log_size = size
+            self.log_buff = []
+            self.log_dirty = True
+            self.park_line = max(self.park_line, start_line + size)
+            self._dirty_event.set()
+
+    def log(self, text, color=None):
+        # 日志区域只显示最近 log_size 条, 每一条占一行
+        text = text.replace('\n', ' ').replace('\r', ' ')
+        with self.lock:
+            self.log_buff.append((text, color))
+            if len(self.log_buff) > self.log_size:
+                del self.log_buff[0]
+            self.log_dirty = True
+            self._dirty_event.set()
+
+    def format_title(self, text, width):
+        text_c = TerminalOutput.get_display_width(text)
+        split_text_c = max(3, (width - text_c - 2) // 2)
+        return f"{'=' * split_text_c} {text} {'=' * split_text_c}"
+
+    def render(self):
+        # 输出一帧, 只包含内容有变化的行
+        width = self.columns - 1    # 最后一列不写, 避免自动换行
+        with self.lock:
+            if self.log_dirty and self.log_start_line is not None:
+                for i in range(self.log_size):
+                    row = self.log_start_line + i
+                    if i < len(self.log_buff):
+                        text, color = self.log_buff[i]
+                        self.lines[row] = (f"[{i + 1}]: {text}", color, False)
+                    else:
+                        self.lines[row] = (f"[{i + 1}]:", None, False)
+                self.log_dirty = False
+            lines = list(self.lines.items())
+        out = []
+        for row, (text, color, is_title) in lines:
+            if is_title:
+                text = self.format_title(text, width)
+            text = TerminalOutput.truncate_string_by_width(text, width)
+            if color in self.colors:
+                text = f"{self.colors[color]}{text}\033[0m"
+            if self.rendered.get(row) == text:
+                continue
+            self.rendered[row] = text
+            out.append(f"\033[{row};1H{text}\033[K")
+        if out:
+            out.append(f"\033[{self.park_line + 1};1H")
+            self.stream.write(''.join(out))
+            self.stream.flush()
+
+    def _run(self):
+        frame_interval = 1 / self.max_fps
+        while not self._stop:
+            self._dirty_event.wait(timeout=self.size_check_interval)
+            self._dirty_event.clear()
+            try:
+                self.render()
+            except Exception:
+                pass    # 终端输出出错 不影响转码
+            time.sleep(frame_interval)
+
+    def start(self):
+        self.stream.write("\033[2J")
+        self._thread = threading.Thread(target=self._run, name="TerminalRenderer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # 停止渲染线程 并输出最后一帧
+        self._stop = True
+        self._dirty_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.render()
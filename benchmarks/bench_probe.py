@@ -0,0 +1,117 @@
+"""
+比较 ContainerProbe (直接读取文件头) 和 ffprobe 的 probe 速度, 并检查两者的结果是否一致
+
+    python benchmarks/bench_probe.py                 生成 mp4 / mkv 样本文件 (稀疏文件, 只有文件头) 进行测试
+    python benchmarks/bench_probe.py -d E:/videos    使用目录中的真实视频文件
+    python benchmarks/bench_probe.py --no-ffprobe    没有安装 ffprobe 时 只测量 ContainerProbe
+
+每个文件重复 probe --repeat 次, 输出每个文件的中位数耗时 (毫秒) 和 不一致的字段
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ContainerProbe import ContainerProbe
+from FFmpegUtil import FFmpegUtil
+from synthetic import SampleMedia
+
+
+def generate_samples(dir_path):
+    paths = []
+    for name, kwargs in (('1080p_short', dict(duration=120)),
+                         ('1080p_long', dict(duration=2 * 3600)),
+                         ('720p_30fps', dict(duration=1800, width=1280, height=720, fps=30, video_bitrate=2000000))):
+        paths.append(os.path.join(dir_path, f"{name}.mp4"))
+        SampleMedia.write_mp4(paths[-1], **kwargs)
+        paths.append(os.path.join(dir_path, f"{name}_moov_at_end.mp4"))
+        SampleMedia.write_mp4(paths[-1], moov_at_end=True, **kwargs)
+        paths.append(os.path.join(dir_path, f"{name}.mkv"))
+        SampleMedia.write_mkv(paths[-1], **kwargs)
+    return paths
+
+
+def timed(fn, file_path, repeat):
+    result, times = None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(file_path)
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def compare(a, b):
+    # 数字字段 相差 1% 以内 (码率 时长的计算方式不同) 视为一致
+    diff = []
+    for key in a:
+        x, y = a.get(key), b.get(key)
+        try:
+            x_num, y_num = float(x), float(y)
+            if abs(x_num - y_num) <= max(abs(y_num) * 0.01, 1):
+                continue
+        except (TypeError, ValueError):
+            if x == y:
+                continue
+        diff.append(f"{key}: {x} / {y}")
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ContainerProbe vs ffprobe")
+    parser.add_argument('-d', '--dir', help="视频文件目录, 不指定时 生成样本文件")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--no-ffprobe', action='store_true', help="只测量 ContainerProbe")
+    parser.add_argument('--json', help="结果写入这个 json 文件")
+    args = parser.parse_args()
+    use_ffprobe = not args.no_ffprobe and shutil.which('ffprobe') is not None
+
+    temp_dir = None
+    if args.dir:
+        paths = list(FFmpegUtil.load_video_from_dir(args.dir, True))
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="bench_probe_")
+        paths = generate_samples(temp_dir)
+    rows = []
+    try:
+        for file_path in paths:
+            header_info, header_ms = timed(ContainerProbe.read, file_path, args.repeat)
+            row = {'file': os.path.basename(file_path), 'header_ms': round(header_ms, 3),
+                   'header_ok': header_info is not None}
+            if use_ffprobe:
+                try:
+                    ffprobe_info, ffprobe_ms = timed(FFmpegUtil.ffmpeg_video_info, file_path, args.repeat)
+                    row['ffprobe_ms'] = round(ffprobe_ms, 3)
+                    row['diff'] = compare(header_info, ffprobe_info) if header_info is not None else []
+                except Exception as e:
+                    row['ffprobe_error'] = str(e)
+            rows.append(row)
+            print(f"{row['file']:<40} header {row['header_ms']:>8.3f} ms {'' if row['header_ok'] else '(fallback)'}"
+                  + (f"  ffprobe {row['ffprobe_ms']:>8.3f} ms" if 'ffprobe_ms' in row else '')
+                  + (f"  diff: {row['diff']}" if row.get('diff') else ''))
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    header_times = [r['header_ms'] for r in rows if r['header_ok']]
+    ffprobe_times = [r['ffprobe_ms'] for r in rows if 'ffprobe_ms' in r]
+    summary = {
+        'files': len(rows),
+        'header_read': len(header_times),
+        'header_median_ms': round(statistics.median(header_times), 3) if header_times else None,
+        'ffprobe_median_ms': round(statistics.median(ffprobe_times), 3) if ffprobe_times else None,
+        'mismatched_files': sum(1 for r in rows if r.get('diff')),
+    }
+    print(json.dumps(summary, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump({'summary': summary, 'files': rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
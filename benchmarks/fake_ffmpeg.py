@@ -0,0 +1,91 @@
+"""
+端到端基准测试中 代替 ffmpeg / ffprobe 的脚本, 第一个参数是扮演的程序: fake_ffmpeg.py ffmpeg|ffprobe 原来的参数...
+run_benchmarks.py 在临时目录中生成名为 ffmpeg / ffprobe 的启动脚本, 放在 PATH 的最前面
+
+视频时长由文件大小推算: 时长 = 文件大小 × 8 / FAKE_FFMPEG_BITRATE
+ffmpeg:  按 FAKE_FFMPEG_SPEED 倍速 "转码", 每隔 FAKE_FFMPEG_PERIOD 秒 输出一组 -progress (和 没有 -nostats 时的状态行),
+         输出文件边转码边变大 (稀疏文件), 结束时为 FAKE_FFMPEG_RATIO × 输入大小; 中途被杀掉时 留下写了一半的输出文件
+ffprobe: 输出 -show_format -show_streams 的 json; -read_intervals 时 每 2 秒一个关键帧
+"""
+import json
+import os
+import sys
+import time
+
+from synthetic import progress_block, progress_times, stats_line, stderr_capture, time_str
+
+BITRATE = int(os.environ.get('FAKE_FFMPEG_BITRATE', 8000000))
+SPEED = float(os.environ.get('FAKE_FFMPEG_SPEED', 100))
+PERIOD = float(os.environ.get('FAKE_FFMPEG_PERIOD', 0.1))
+RATIO = float(os.environ.get('FAKE_FFMPEG_RATIO', 0.5))
+FPS = 24
+
+
+def duration_of(path):
+    return os.path.getsize(path) * 8 / BITRATE
+
+
+def arg_value(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def ffprobe(args):
+    path = args[-1]
+    if '-read_intervals' in args:
+        start, _, length = arg_value(args, '-read_intervals').partition('%+')
+        t = float(start) - float(start) % 2
+        while t < float(start) + float(length or 30):
+            print(f"{t:.6f},K_")
+            print(f"{t + 1:.6f},__")
+            t += 2
+        return 0
+    size = os.path.getsize(path)
+    print(json.dumps({
+        "format": {"duration": f"{duration_of(path):.6f}", "size": str(size), "bit_rate": str(BITRATE),
+                   "tags": {"encoder": "Lavf60.16.100"}},
+        "streams": [
+            {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080, "pix_fmt": "yuv420p",
+             "avg_frame_rate": f"{FPS}/1", "bit_rate": str(BITRATE - 128000)},
+            {"codec_type": "audio", "codec_name": "aac", "sample_rate": "48000", "bit_rate": "128000"},
+        ]}))
+    return 0
+
+
+def ffmpeg(args):
+    input_path, output_path = arg_value(args, '-i'), args[-2]
+    if '-f' in args and arg_value(args, '-f') == 'concat':
+        # 拼接: 输入是分段列表, 输出大小为各段之和
+        with open(input_path, encoding='utf8') as f:
+            parts = [line.strip()[len("file '"):-1] for line in f if line.startswith('file ')]
+        duration = sum(duration_of(p) / RATIO for p in parts)
+    else:
+        duration = duration_of(input_path) - float(arg_value(args, '-ss', 0))
+        duration = min(duration, float(arg_value(args, '-t', duration)))
+    progress = arg_value(args, '-progress') == 'pipe:1'
+    with_stats = '-nostats' not in args
+    capture = stderr_capture(input_path, output_path, duration, FPS, SPEED, PERIOD, with_stats=False)
+    head, _, summary = capture.partition(b'\nvideo:')
+    sys.stderr.buffer.write(head + b'\n')
+    sys.stderr.flush()
+    with open(output_path, 'wb') as output:
+        output.write(f"fake output of {os.path.basename(input_path)} {time_str(duration)}".encode())
+        output.flush()
+        for t in progress_times(duration, SPEED, PERIOD):
+            time.sleep(PERIOD)
+            output.truncate(int(t * BITRATE / 8 * RATIO))
+            output.flush()
+            if with_stats:
+                sys.stderr.write(stats_line(t, FPS, SPEED) + '\r')
+                sys.stderr.flush()
+            if progress:
+                sys.stdout.buffer.write(progress_block(t, duration, FPS, SPEED))
+                sys.stdout.flush()
+        output.truncate(int(duration * BITRATE / 8 * RATIO))
+    sys.stderr.buffer.write(b'\nvideo:' + summary)
+    sys.stderr.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    program = sys.argv[1]
+    sys.exit(ffprobe(sys.argv[2:]) if program == 'ffprobe' else ffmpeg(sys.argv[2:]))
@@ -0,0 +1,260 @@
+"""
+在本机上运行 分布式模式: 一个协调节点 + 多个 worker, 共用一个临时数据库, 用 fake_ffmpeg.py 代替 ffmpeg / ffprobe
+每个节点是一个单独的 multi_run_ffmpeg.py 进程 (headless, 各自的 config.ini 和 事件文件), 结束后检查:
+1. Job_Lease 中的每个任务都是 done, 每个输入文件 在 Run_Task_Record 中只有一次成功的运行记录
+2. 杀掉一个正在转码的 worker (连同它的 ffmpeg) 后, 它持有的任务 在租约到期之后 才由其他 worker 领取并完成
+3. 成功的运行记录 指向的输出文件 大小与记录的一致: 被杀掉的 worker 写了一半的输出文件 不能被当作已经完成
+   (fake ffmpeg 边转码边写输出文件, 并且打开了 skip_existing_output)
+
+    python benchmarks/localhost_cluster.py                  2 个 worker, 杀掉其中一个
+    python benchmarks/localhost_cluster.py -w 3 -n 12
+    python benchmarks/localhost_cluster.py --no-kill        只检查正常运行
+    python benchmarks/localhost_cluster.py --keep           保留临时目录 (数据库 各节点的日志 和 事件文件)
+
+所有检查通过时返回 0, 否则输出失败的检查 返回 1; 需要 POSIX shell, 只支持 linux / macOS
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), "multi_run_ffmpeg.py")
+
+from run_benchmarks import write_fake_tools
+from synthetic import make_sparse_file
+
+BITRATE = 8000000
+
+
+def write_config(node_dir, cluster_dir, args):
+    with open(os.path.join(node_dir, "config.ini"), 'w', encoding='utf-8') as f:
+        f.write(f"""[Input]
+video_dir_path = {os.path.join(cluster_dir, 'in')}
+database_path = {os.path.join(cluster_dir, 'cluster.db')}
+max_processes = {args.slots}
+print_buff_size = 10
+probe_workers = 2
+[Output]
+video_dir_path = {os.path.join(cluster_dir, 'out')}
+running_output_dir = {os.path.join(node_dir, 'running')}
+global_quality = 24
+[Prefilter]
+skip_existing_output = true
+[Headless]
+enabled = true
+event_sink = {os.path.join(node_dir, 'events.jsonl')}
+progress_interval = 1.0
+[Distributed]
+lease_seconds = {args.lease_seconds}
+heartbeat_interval = 1
+poll_interval = 0.5
+prefetch = 1
+max_attempts = 3
+exit_when_done = true
+status_interval = 1
+""")
+
+
+def start_node(cluster_dir, name, role, args, env):
+    node_dir = os.path.join(cluster_dir, name)
+    os.makedirs(os.path.join(node_dir, 'running'))
+    write_config(node_dir, cluster_dir, args)
+    log = open(os.path.join(node_dir, 'node.log'), 'wb')
+    process = subprocess.Popen([sys.executable, MAIN_SCRIPT, role], cwd=node_dir, env=env,
+                               stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return {'name': name, 'dir': node_dir, 'process': process, 'owner': f"{socket.gethostname()}:{process.pid}"}
+
+
+def read_events(node):
+    path = os.path.join(node['dir'], 'events.jsonl')
+    if not os.path.exists(path):
+        return []
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass    # 进程被杀掉时 最后一行可能不完整
+    return events
+
+
+def wait_for(condition, timeout, interval=0.2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def kill_worker(node, db_path):
+    """
+    模拟 worker 所在的机器崩溃: SIGKILL worker 和 它正在运行的 ffmpeg (ffmpeg 在单独的进程组中)
+    :return: {路径: 杀掉时的 lease_expire}, worker 持有租约的任务
+    """
+    node['process'].send_signal(signal.SIGKILL)
+    node['process'].wait()
+    events = read_events(node)
+    ended = {(e['file'], e.get('segment_index')) for e in events if e['event'] == 'task_end'}
+    for e in events:
+        if e['event'] == 'task_start' and (e['file'], e.get('segment_index')) not in ended:
+            try:
+                os.killpg(e['pid'], signal.SIGKILL)
+            except OSError:
+                pass
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return dict(conn.execute('select file_path, lease_expire from "Job_Lease" where owner=? and state=?',
+                                 (node['owner'], 'leased')).fetchall())
+    finally:
+        conn.close()
+
+
+def check(db_path, input_paths, workers, killed, held_at_kill):
+    failures = []
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        states = dict(conn.execute('select file_path, state from "Job_Lease"').fetchall())
+        attempts = dict(conn.execute('select file_path, attempt_count from "Job_Lease"').fetchall())
+        success_counts = dict(conn.execute('''
+            select vv.file_path, count(*) from "Run_Task_Record" rr
+            join "Video_File_State" vv on rr.video_file_id=vv.id
+            where rr.output_has_error=False and rr.end_running_time is not null
+            group by vv.file_path
+        ''').fetchall())
+        record_count = conn.execute('select count(*) from "Run_Task_Record"').fetchone()[0]
+        outputs = conn.execute('''
+            select oo.file_path, cast(oo.file_size as integer) from "Run_Task_Record" rr
+            join "Video_File_State" oo on rr.output_video_file_id=oo.id
+            where rr.output_has_error=False
+        ''').fetchall()
+    finally:
+        conn.close()
+    if sorted(states) != sorted(input_paths):
+        failures.append(f"Job_Lease 中的任务 {len(states)} 个, 输入文件 {len(input_paths)} 个")
+    for path in input_paths:
+        if states.get(path) != 'done':
+            failures.append(f"任务没有完成: {path} state={states.get(path)}")
+        if success_counts.get(path, 0) != 1:
+            failures.append(f"成功的运行记录 {success_counts.get(path, 0)} 条 (应该是 1 条): {path}")
+    if record_count < len(input_paths):
+        failures.append(f"Run_Task_Record 只有 {record_count} 条")
+    for output_path, size in outputs:
+        actual = os.path.getsize(output_path) if os.path.exists(output_path) else None
+        if actual != size:
+            failures.append(f"输出文件大小 {actual}, 成功的运行记录中是 {size}: {output_path}")
+
+    if killed is not None:
+        if not held_at_kill:
+            failures.append("被杀掉的 worker 没有持有任何租约, 没有检查到接管")
+        starts = {}
+        for node in workers:
+            if node is killed:
+                continue
+            for e in read_events(node):
+                if e['event'] == 'task_start':
+                    starts.setdefault(e['file'], []).append((e['time'], node['name']))
+        for path, lease_expire in held_at_kill.items():
+            taken = starts.get(path, [])
+            if not taken:
+                failures.append(f"被杀掉的 worker 的任务 没有被其他 worker 领取: {path}")
+            elif min(t for t, _ in taken) < lease_expire:
+                failures.append(f"租约到期之前 任务就被其他 worker 领取了: {path}")
+            if attempts.get(path, 0) < 2:
+                failures.append(f"接管的任务 attempt_count={attempts.get(path)}: {path}")
+    return failures, record_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本机运行 协调节点 + 多个 worker, 检查任务分配 和 崩溃后的接管")
+    parser.add_argument('-w', '--workers', type=int, default=2)
+    parser.add_argument('-n', '--files', type=int, default=8, help="输入文件个数")
+    parser.add_argument('--slots', type=int, default=2, help="每个 worker 同时运行的 ffmpeg 个数")
+    parser.add_argument('--seconds', type=float, default=3, help="每个文件 fake ffmpeg 转码多少秒")
+    parser.add_argument('--lease-seconds', type=float, default=5)
+    parser.add_argument('--no-kill', action='store_true', help="不杀掉 worker")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--keep', action='store_true', help="保留临时目录")
+    args = parser.parse_args()
+    if os.name == 'nt':
+        print("localhost cluster needs a POSIX shell for the fake ffmpeg")
+        return 1
+    if args.workers < 2 and not args.no_kill:
+        parser.error("杀掉 worker 的检查 至少需要 2 个 worker")
+
+    cluster_dir = tempfile.mkdtemp(prefix="localhost_cluster_")
+    db_path = os.path.join(cluster_dir, 'cluster.db')
+    for d in ('in', 'out', 'bin'):
+        os.makedirs(os.path.join(cluster_dir, d))
+    write_fake_tools(os.path.join(cluster_dir, 'bin'))
+    speed = 60.0    # fake ffmpeg 按 60 倍速转码, 每个文件 seconds × 60 秒视频
+    input_paths = []
+    for i in range(args.files):
+        input_paths.append(os.path.join(cluster_dir, 'in', f"video_{i:03d}.mp4"))
+        make_sparse_file(input_paths[-1], int(speed * args.seconds * BITRATE / 8))
+    env = dict(os.environ, PATH=os.path.join(cluster_dir, 'bin') + os.pathsep + os.environ['PATH'],
+               FAKE_FFMPEG_SPEED=str(speed), FAKE_FFMPEG_BITRATE=str(BITRATE), FAKE_FFMPEG_PERIOD='0.2')
+
+    nodes = []
+    failures = []
+    killed, held_at_kill = None, {}
+    start = time.time()
+    try:
+        # 先建好数据库 再同时启动其他节点, 避免多个进程同时建表
+        coordinator = start_node(cluster_dir, 'coordinator', 'coordinator', args, env)
+        nodes.append(coordinator)
+        wait_for(lambda: os.path.exists(db_path), 30)
+        workers = [start_node(cluster_dir, f"worker{i}", 'worker', args, env) for i in range(args.workers)]
+        nodes.extend(workers)
+
+        if not args.no_kill:
+            killed = workers[0]
+            if wait_for(lambda: any(e['event'] == 'task_start' for e in read_events(killed)), args.timeout):
+                time.sleep(0.5)     # 让 ffmpeg 转码一会儿
+                held_at_kill = kill_worker(killed, db_path)
+                print(f"killed {killed['name']} at +{time.time() - start:.1f}s, "
+                      f"holding {len(held_at_kill)} leases: {[os.path.basename(p) for p in held_at_kill]}")
+            else:
+                failures.append(f"{killed['name']} 没有开始任何任务")
+
+        for node in nodes:
+            if node is killed:
+                continue
+            try:
+                code = node['process'].wait(max(1, args.timeout - (time.time() - start)))
+                if code != 0:
+                    failures.append(f"{node['name']} 退出码 {code}, 见 {os.path.join(node['dir'], 'node.log')}")
+            except subprocess.TimeoutExpired:
+                failures.append(f"{node['name']} 超过 {args.timeout} 秒没有结束")
+        elapsed = time.time() - start
+        check_failures, record_count = check(db_path, input_paths, workers, killed, held_at_kill)
+        failures.extend(check_failures)
+        print(json.dumps({'workers': args.workers, 'files': args.files, 'elapsed_s': round(elapsed, 2),
+                          'run_records': record_count, 'killed': killed['name'] if killed else None,
+                          'taken_over': len(held_at_kill), 'failures': len(failures)}, ensure_ascii=False))
+    finally:
+        for node in nodes:
+            if node['process'].poll() is None:
+                node['process'].kill()
+                node['process'].wait()
+        if args.keep or failures:
+            print(f"temp dir kept: {cluster_dir}")
+        else:
+            shutil.rmtree(cluster_dir, ignore_errors=True)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+运行器热点路径的基准测试, 离线运行: 合成的 ffmpeg 输出, 稀疏文件, 临时 SQLite 数据库, 代替 ffmpeg 的脚本
+
+    python benchmarks/run_benchmarks.py                         全部运行, 结果写入 benchmarks/results/时间.json
+    python benchmarks/run_benchmarks.py -k db -k sha256         只运行名称包含 db 或 sha256 的测试
+    python benchmarks/run_benchmarks.py --quick                 数据量小一些, 用于快速检查
+    python benchmarks/run_benchmarks.py --compare old.json      与之前的结果比较, 变慢超过 --threshold 时 返回 1
+
+每个测试重复 --repeat 次 取中位数, 结果中的 us_per_op 越小越好 (端到端测试为每个文件的墙上时间)
+端到端测试 (e2e_*) 需要能在 PATH 中放入 ffmpeg / ffprobe 脚本, 目前只支持 linux / macOS
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_sparse_file, progress_blocks, stats_lines, stderr_capture, time_str
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class BenchRunner:
+    # 运行测试 记录结果: measure(名称, 不带参数的函数, 每次调用包含的操作次数), 结果为每个操作的耗时
+
+    def __init__(self, repeat=5, quick=False, keywords=None):
+        self.repeat = repeat
+        self.quick = quick
+        self.keywords = keywords or []
+        self.results = {}
+
+    def selected(self, name):
+        return not self.keywords or any(k in name for k in self.keywords)
+
+    def measure(self, name, fn, ops, repeat=None, **extra):
+        if not self.selected(name):
+            return
+        times = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        median = statistics.median(times)
+        self.results[name] = {
+            'ops': ops,
+            'median_s': round(median, 6),
+            'best_s': round(min(times), 6),
+            'us_per_op': round(median / ops * 1e6, 3),
+            **extra,
+        }
+        print(f"{name:<40} {self.results[name]['us_per_op']:>12.3f} us/op  ({ops} ops, median {median:.4f} s)")
+
+    def scale(self, normal, quick):
+        return quick if self.quick else normal
+
+
+def bench_parsing(runner):
+    from FFmpegUtil import FFmpegUtil, FFmpegProgressParser
+    duration = runner.scale(7200, 600)
+    lines = stats_lines(duration, period=0.1)
+    times = [time_str(x * 0.37) for x in range(len(lines))]
+    runner.measure('ttime2second', lambda: [FFmpegUtil.ttime2second(x) for x in times], len(times))
+    runner.measure('match_ffmpeg_running_output', lambda: [FFmpegUtil.match_ffmpeg_running_output(x) for x in lines],
+                   len(lines))
+    blocks = progress_blocks(duration, period=0.1).split(b'\n')
+
+    def parse_progress():
+        parser = FFmpegProgressParser()
+        for line in blocks:
+            progress = parser.feed(line)
+            if progress is not None:
+                FFmpegUtil.progress_seconds(progress)
+
+    runner.measure('progress_parser_feed', parse_progress, len(blocks))
+    # enqueue_output 的切分: 旧格式 \r 分隔的状态行 和 -progress 的 \n 分隔的行
+    capture = stderr_capture('/videos/input.mp4', '/videos/output.mp4', duration, period=0.1) * 4
+    line_count = sum(1 for _ in FFmpegUtil.iter_stream_lines(io.BytesIO(capture)))
+    runner.measure('iter_stream_lines_stderr', lambda: sum(1 for _ in FFmpegUtil.iter_stream_lines(io.BytesIO(capture))),
+                   line_count, bytes=len(capture))
+    # 管道每次只能读到一小块
+    small_reads = [capture[i:i + 512] for i in range(0, len(capture), 512)]
+
+    class ChunkStream:
+        def __init__(self):
+            self.chunks = iter(small_reads)
+
+        def read(self, _size):
+            return next(self.chunks, b'')
+
+    runner.measure('iter_stream_lines_small_reads', lambda: sum(1 for _ in FFmpegUtil.iter_stream_lines(ChunkStream())),
+                   line_count, bytes=len(capture))
+
+
+def bench_terminal(runner):
+    from TerminalOutput import TerminalOutput
+    from TerminalRenderer import TerminalRenderer
+    count = runner.scale(20000, 2000)
+    ascii_lines = [f"loading:/mnt/videos/season_{i % 10}/episode_{i:05d}_1080p_web-dl_h264_aac.mp4 " * 2
+                   for i in range(count)]
+    wide_lines = [f"👌 加入任务队列:/mnt/视频/第{i % 10}季/第{i:05d}集 高清 中文字幕.mkv " * 2 for i in range(count)]
+    runner.measure('truncate_string_by_width_ascii',
+                   lambda: [TerminalOutput.truncate_string_by_width(x, 119) for x in ascii_lines], count)
+    runner.measure('truncate_string_by_width_wide',
+                   lambda: [TerminalOutput.truncate_string_by_width(x, 119) for x in wide_lines], count)
+    # print_to_area = renderer.log, 每 100 条日志 渲染一帧 (终端模式下 渲染线程按帧率输出)
+    renderer = TerminalRenderer(max_fps=10, stream=io.StringIO())
+    renderer.set_log_area(10, 20)
+    mixed = ascii_lines[:count // 2] + wide_lines[:count // 2]
+
+    def log_and_render():
+        renderer.stream = io.StringIO()
+        for i, text in enumerate(mixed):
+            renderer.log(text)
+            if i % 100 == 0:
+                renderer.render()
+
+    runner.measure('print_to_area_render', log_and_render, len(mixed))
+
+
+def bench_hash(runner, temp_dir):
+    from FileHasher import FileHasher
+    count = runner.scale(50, 10)
+    paths = [make_sparse_file(os.path.join(temp_dir, f"sparse_{i}.mkv"), 4 * 1024 ** 3 + i * 4096)
+             for i in range(count)]
+    # 稀疏文件的空洞不需要读磁盘, 测到的是 页缓存命中时的 CPU 开销
+    runner.measure('cal_sample_sha256', lambda: [FileHasher.sample_sha256(p) for p in paths], count)
+    runner.measure('fast_fingerprint', lambda: [FileHasher.fast_fingerprint(p) for p in paths], count)
+
+
+def fake_v_info(i):
+    return {
+        "file_path": f"/videos/{i // 100}/video_{i:06d}.mp4", "duration": "1800.000000", "size": str(1800000000 + i),
+        "encoder": "Lavf60.16.100", "video_codec": "h264", "video_width": 1920, "video_height": 1080,
+        "video_pix_fmt": "yuv420p", "video_bit_rate": "7872000", "video_fps": 24, "audio_codec": "aac",
+        "audio_sample_rate": "48000", "audio_bit_rate": 128000,
+    }
+
+
+def bench_db(runner, temp_dir):
+    from DatabaseHelper import MyDB, SuccessIndex
+    count = runner.scale(5000, 500)
+    quiet = lambda *args, **kwargs: None
+    tasks = [{'v_info': fake_v_info(i), 'sha256': f"{i:064x}", 'fingerprint': f"fp{i:062x}"} for i in range(count)]
+    state = {}
+
+    def fresh_db():
+        path = os.path.join(temp_dir, f"bench_{time.perf_counter_ns()}.db")
+        db = MyDB(path, quiet)
+        db.init_db()
+        return db
+
+    def insert_direct():
+        db = fresh_db()
+        conn = db.get_conn()
+        for task in tasks:
+            db.insert_video_file_state(conn, task)
+        state['direct'] = db
+
+    def insert_with_writer():
+        # 主循环的写法: 文件记录 + 运行记录 + 结束记录 都交给写线程, 批量 commit
+        db = fresh_db()
+        db.start_writer()
+        for task in tasks:
+            vfile_id = db.submit(db.insert_video_file_state, task)
+            run_id = db.submit(db.record_start_run, vfile_id, "ffmpeg -i x y", "/tmp/out.txt")
+            db.submit(db.record_end_run, run_id, False, None)
+        db.close_writer()
+        state['writer'] = db
+
+    runner.measure('db_insert_video_file_state', insert_direct, count, repeat=min(runner.repeat, 3))
+    runner.measure('db_writer_task_records', insert_with_writer, count, repeat=min(runner.repeat, 3))
+    db = state.get('writer')
+    if db is None:
+        return
+    conn = sqlite3.connect(db.db_path)
+    lookups = [(t['sha256'], t['fingerprint']) for t in tasks[::-7]] + [(f"{i:064x}", None) for i in range(200)]
+    runner.measure('db_check_success_sha256', lambda: [db.check_success_sha256(conn, s, f) for s, f in lookups],
+                   len(lookups))
+    runner.measure('success_index_load', lambda: SuccessIndex().load(conn), count)
+    index = SuccessIndex().load(conn)
+    runner.measure('success_index_lookup', lambda: [index.lookup(s, f) for s, f in lookups], len(lookups))
+    # 预过滤: 路径 大小 修改时间 与 Probe_Cache 一致, 指纹对应成功的运行记录
+    conn.executemany('''
+        insert or replace into "Probe_Cache" (file_path, file_size, mtime_ns, v_info, file_sample_sha256,
+                                              file_fingerprint, create_time, last_hit_time)
+        values (?,?,?,?,?,?,?,?)
+    ''', [(t['v_info']['file_path'], int(t['v_info']['size']), 1, json.dumps(t['v_info']), t['sha256'],
+           t['fingerprint'], 0, 0) for t in tasks])
+    conn.commit()
+    stat_rows = [(t['v_info']['file_path'], int(t['v_info']['size']), 1) for t in tasks]
+    runner.measure('db_find_done_files', lambda: MyDB.find_done_files(conn, stat_rows), len(stat_rows))
+    conn.close()
+
+
+def write_fake_tools(bin_dir):
+    # PATH 中的 ffmpeg / ffprobe, 转给 fake_ffmpeg.py
+    for program in ('ffmpeg', 'ffprobe'):
+        path = os.path.join(bin_dir, program)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_ffmpeg.py")}" '
+                    f'{program} "$@"\n')
+        os.chmod(path, 0o755)
+
+
+def bench_e2e(runner, temp_dir):
+    """
+    端到端: 生成一批稀疏的输入文件, 用 fake ffmpeg 以 FAKE_FFMPEG_SPEED 倍速 "转码", headless 模式运行整个 FFmpegManager
+    理想时间 = 所有视频时长 / 倍速 / 并发数, overhead = 实际时间 / 理想时间
+    第二次运行时 所有文件都已经转码成功, 测量预过滤 (不启动 ffprobe) 的速度
+    """
+    if os.name == 'nt':
+        print("e2e benchmarks need a POSIX shell for the fake ffmpeg, skipped")
+        return
+    if not (runner.selected('e2e_run') or runner.selected('e2e_rerun')):
+        return
+    from EventSink import JsonLineSink
+    from DatabaseHelper import MyDB, ProbeCache
+    from FFmpegUtil import FFmpegUtil
+    from multi_run_ffmpeg import FFmpegManager
+
+    count, slots, seconds = runner.scale(24, 6), 4, 60
+    speed, bitrate = 200.0, 8000000
+    run_dir = os.path.join(temp_dir, "e2e")
+    input_dir, output_dir, running_dir, bin_dir = [os.path.join(run_dir, x) for x in ('in', 'out', 'running', 'bin')]
+    for d in (input_dir, output_dir, running_dir, bin_dir):
+        os.makedirs(d)
+    write_fake_tools(bin_dir)
+    for i in range(count):
+        make_sparse_file(os.path.join(input_dir, f"video_{i:03d}.mp4"), int(seconds * (1 + i % 3) * bitrate / 8))
+    total_seconds = sum(seconds * (1 + i % 3) for i in range(count))
+    ideal = total_seconds / speed / slots
+    db_path = os.path.join(run_dir, "e2e.db")
+
+    def run_once():
+        stream = io.StringIO()
+        manager = FFmpegManager(max_processes=slots, sink=JsonLineSink(stream, progress_interval=0))
+        db = MyDB(db_path, manager.print_to_area)
+        db.init_db()
+        start = time.perf_counter()
+        manager.run(db, FFmpegUtil.load_video_from_dir(input_dir), output_dir, running_dir, 24, probe_workers=4,
+                    probe_cache=ProbeCache(db_path).load())
+        elapsed = time.perf_counter() - start
+        events = {}
+        for line in stream.getvalue().splitlines():
+            event = json.loads(line)['event']
+            events[event] = events.get(event, 0) + 1
+        return elapsed, events
+
+    old_env = {k: os.environ.get(k) for k in ('PATH', 'FAKE_FFMPEG_SPEED', 'FAKE_FFMPEG_BITRATE')}
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['FAKE_FFMPEG_SPEED'] = str(speed)
+    os.environ['FAKE_FFMPEG_BITRATE'] = str(bitrate)
+    try:
+        first, events = run_once()
+        rerun, rerun_events = run_once()
+    finally:
+        for key, value in old_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    done = events.get('task_end', 0)
+    result = {'ops': count, 'median_s': round(first, 6), 'best_s': round(first, 6),
+              'us_per_op': round(first / count * 1e6, 3), 'ideal_s': round(ideal, 3),
+              'overhead': round(first / ideal, 3), 'media_seconds_per_s': round(total_seconds / first, 1),
+              'tasks_done': done, 'events': events}
+    if runner.selected('e2e_run'):
+        runner.results['e2e_run'] = result
+        print(f"{'e2e_run':<40} {result['us_per_op']:>12.3f} us/op  ({count} files, {first:.2f} s, "
+              f"ideal {ideal:.2f} s, overhead x{result['overhead']}, {done} done)")
+    if runner.selected('e2e_rerun'):
+        runner.results['e2e_rerun'] = {'ops': count, 'median_s': round(rerun, 6), 'best_s': round(rerun, 6),
+                                       'us_per_op': round(rerun / count * 1e6, 3), 'events': rerun_events}
+        print(f"{'e2e_rerun':<40} {runner.results['e2e_rerun']['us_per_op']:>12.3f} us/op  "
+              f"({count} files already done, {rerun:.2f} s)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    # 打印与之前结果的比较, 返回变慢超过 threshold 的测试
+    with open(baseline_path, encoding='utf8') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['us_per_op'], result['us_per_op']
+        ratio = new / old if old else float('inf')
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  <-- slower'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            mark = '  faster'
+        print(f"{name:<40} {old:>12.3f} {new:>12.3f} {ratio:>8.2f}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MultiThreadedFFmpegRunner benchmarks")
+    parser.add_argument('-k', dest='keywords', action='append', help="只运行名称包含这个字符串的测试, 可以多次指定")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('-o', '--output', help="结果 json 的路径, 默认 benchmarks/results/时间.json")
+    parser.add_argument('--compare', help="之前的结果 json")
+    parser.add_argument('--threshold', type=float, default=0.10, help="比之前慢多少 (比例) 算作变慢")
+    args = parser.parse_args()
+
+    runner = BenchRunner(args.repeat, args.quick, args.keywords)
+    temp_dir = tempfile.mkdtemp(prefix="ffmpeg_runner_bench_")
+    try:
+        bench_parsing(runner)
+        bench_terminal(runner)
+        bench_hash(runner, temp_dir)
+        bench_db(runner, temp_dir)
+        bench_e2e(runner, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf8') as f:
+        json.dump({
+            'meta': {'time': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                     'python': platform.python_version(), 'platform': platform.platform(),
+                     'quick': args.quick, 'repeat': args.repeat},
+            'results': runner.results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"results: {output}")
+    if args.compare:
+        regressions = compare(runner.results, args.compare, args.threshold)
+        if regressions:
+            print(f"slower than baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+基准测试使用的合成数据: ffmpeg 的 stderr / -progress 输出, 稀疏文件, 只有文件头的 mp4 / mkv 样本
+不需要 ffmpeg 也不需要真实的视频文件
+"""
+import os
+import struct
+
+
+def time_str(seconds):
+    # ffmpeg 的时间格式 01:14:59.29
+    return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{seconds % 60:05.2f}"
+
+
+def progress_times(duration, speed=2.5, period=0.5):
+    # ffmpeg 每隔 period 秒(墙上时间) 报告一次进度, 报告时已经转码到的时间点
+    times = []
+    t = 0.0
+    while t < duration:
+        t = min(duration, t + speed * period)
+        times.append(t)
+    return times
+
+
+def stats_line(t, fps=24, speed=2.5):
+    # 没有 -nostats 时 ffmpeg 输出的状态行, 见 FFmpegUtil.match_ffmpeg_running_output
+    return (f"frame={int(t * fps):6d} fps={fps * speed:4.0f} q=28.0 size={int(t * 500):8d}KiB "
+            f"time={time_str(t)} bitrate={4000.0:6.1f}kbits/s dup=0 drop=0 speed={speed:.3g}x")
+
+
+def stats_lines(duration, fps=24, speed=2.5, period=0.5):
+    return [stats_line(t, fps, speed) for t in progress_times(duration, speed, period)]
+
+
+def progress_block(t, duration, fps=24, speed=2.5):
+    # -progress pipe:1 的一组输出, 以 progress=continue / progress=end 结尾
+    return (f"frame={int(t * fps)}\nfps={fps * speed:.2f}\nstream_0_0_q=28.0\nbitrate=4000.0kbits/s\n"
+            f"total_size={int(t * 500000)}\nout_time_us={int(t * 1000000)}\nout_time_ms={int(t * 1000000)}\n"
+            f"out_time={time_str(t)}0000\ndup_frames=0\ndrop_frames=0\nspeed={speed:.3g}x\n"
+            f"progress={'end' if t >= duration else 'continue'}\n").encode()
+
+
+def progress_blocks(duration, fps=24, speed=2.5, period=0.5):
+    return b''.join(progress_block(t, duration, fps, speed) for t in progress_times(duration, speed, period))
+
+
+def stderr_capture(input_path, output_path, duration, fps=24, speed=2.5, period=0.5, with_stats=True):
+    """
+    一次转码的完整 stderr: 输入输出信息, (没有 -nostats 时) 以 \\r 分隔的状态行, 结束时的统计
+    """
+    header = (
+        f"Input #0, mov,mp4,m4a,3gp,3g2,mj2, from '{input_path}':\n"
+        f"  Metadata:\n    major_brand     : isom\n    encoder         : Lavf60.16.100\n"
+        f"  Duration: {time_str(duration)}, start: 0.000000, bitrate: 4128 kb/s\n"
+        f"  Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 1920x1080, "
+        f"4000 kb/s, {fps} fps, {fps} tbr, 12288 tbn (default)\n"
+        f"  Stream #0:1[0x2](und): Audio: aac (LC) (mp4a / 0x6134706D), 48000 Hz, stereo, fltp, 128 kb/s (default)\n"
+        f"Stream mapping:\n  Stream #0:0 -> #0:0 (h264 (native) -> hevc (hevc_qsv))\n  Stream #0:1 -> #0:1 (copy)\n"
+        f"Output #0, mp4, to '{output_path}':\n"
+        f"  Stream #0:0(und): Video: hevc (hev1 / 0x31766568), nv12(progressive), 1920x1080, q=2-31, {fps} fps\n"
+    )
+    stats = '\r'.join(stats_lines(duration, fps, speed, period)) + '\r' if with_stats else ''
+    summary = ("\nvideo:1048576KiB audio:18750KiB subtitle:0KiB other streams:0KiB global headers:0KiB "
+               "muxing overhead: 0.052103%\n")
+    return (header + stats + summary).encode()
+
+
+def make_sparse_file(path, size, head=b''):
+    """
+    生成指定大小的稀疏文件 (只有 head 和 首 中 尾 各一小块有数据), 不占用磁盘空间
+    首中尾的数据让 sample sha256 / 快速指纹 在不同文件之间不同
+    """
+    seed = os.path.basename(path).encode() * 64
+    with open(path, 'wb') as f:
+        f.write(head or seed[:4096])
+        for offset in (size // 2, max(0, size - 4096)):
+            if offset > f.tell():
+                f.seek(offset)
+                f.write(seed[:4096])
+        f.truncate(size)
+    return path
+
+
+class BitWriter:
+    # 写 H.264 SPS 用的 比特流 (含指数哥伦布编码)
+
+    def __init__(self):
+        self.bits = []
+
+    def u(self, count, value):
+        self.bits.extend((value >> (count - 1 - i)) & 1 for i in range(count))
+
+    def ue(self, value):
+        value += 1
+        length = value.bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value)
+
+    def rbsp(self):
+        self.u(1, 1)
+        while len(self.bits) % 8:
+            self.bits.append(0)
+        data = bytes(int(''.join(map(str, self.bits[i:i + 8])), 2) for i in range(0, len(self.bits), 8))
+        # 防竞争字节 00 00 0x -> 00 00 03 0x
+        out, zeros = bytearray(), 0
+        for byte in data:
+            if zeros >= 2 and byte <= 3:
+                out.append(3)
+                zeros = 0
+            out.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        return bytes(out)
+
+
+class SampleMedia:
+    """
+    生成只有文件头的 mp4 / mkv 样本文件: H.264 High 视频 + AAC 音频, 媒体数据部分是稀疏的空洞 (不占磁盘空间)
+    ffprobe 和 ContainerProbe 都只读取文件头, 可以得到完整的视频信息
+    """
+    encoder = 'Lavf60.16.100'
+
+    @staticmethod
+    def h264_sps(width, height):
+        mbs_w, mbs_h = (width + 15) // 16, (height + 15) // 16
+        w = BitWriter()
+        w.u(8, 100)     # profile_idc: High
+        w.u(8, 0)
+        w.u(8, 40)      # level 4.0
+        w.ue(0)         # seq_parameter_set_id
+        w.ue(1)         # chroma_format_idc 4:2:0
+        w.ue(0)         # bit_depth_luma_minus8
+        w.ue(0)         # bit_depth_chroma_minus8
+        w.u(1, 0)
+        w.u(1, 0)       # seq_scaling_matrix_present_flag
+        w.ue(0)         # log2_max_frame_num_minus4
+        w.ue(2)         # pic_order_cnt_type
+        w.ue(1)         # max_num_ref_frames
+        w.u(1, 0)
+        w.ue(mbs_w - 1)
+        w.ue(mbs_h - 1)
+        w.u(1, 1)       # frame_mbs_only_flag
+        w.u(1, 1)       # direct_8x8_inference_flag
+        crop_w, crop_h = (mbs_w * 16 - width) // 2, (mbs_h * 16 - height) // 2
+        w.u(1, 1 if crop_w or crop_h else 0)
+        if crop_w or crop_h:
+            w.ue(0)
+            w.ue(crop_w)
+            w.ue(0)
+            w.ue(crop_h)
+        w.u(1, 0)       # vui_parameters_present_flag
+        return b'\x67' + w.rbsp()
+
+    @staticmethod
+    def avcc(width, height):
+        sps = SampleMedia.h264_sps(width, height)
+        pps = b'\x68\xeb\xe3\xcb\x22\xc0'
+        return (bytes([1, 100, 0, 40, 0xff, 0xe1]) + struct.pack('>H', len(sps)) + sps
+                + bytes([1]) + struct.pack('>H', len(pps)) + pps + bytes([0xfd, 0xf8, 0xf8, 0]))
+
+    # AAC LC 48000Hz 双声道
+    aac_config = bytes([0x11, 0x90])
+
+    # ---------------- mp4 ----------------
+
+    @staticmethod
+    def box(box_type, *payload):
+        data = b''.join(payload)
+        return struct.pack('>I4s', 8 + len(data), box_type) + data
+
+    @staticmethod
+    def full_box(box_type, *payload):
+        return SampleMedia.box(box_type, b'\x00\x00\x00\x00', *payload)
+
+    @staticmethod
+    def mp4_track(track_id, handler, timescale, sample_count, sample_delta, sample_size, sample_entry, chunk_offset):
+        box, full_box = SampleMedia.box, SampleMedia.full_box
+        duration = sample_count * sample_delta
+        matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+        media_header = (full_box(b'vmhd', b'\x00' * 8) if handler == b'vide'
+                        else full_box(b'smhd', b'\x00' * 4))
+        stbl = box(b'stbl',
+                   full_box(b'stsd', struct.pack('>I', 1), sample_entry),
+                   full_box(b'stts', struct.pack('>III', 1, sample_count, sample_delta)),
+                   full_box(b'stsc', struct.pack('>IIII', 1, 1, sample_count, 1)),
+                   full_box(b'stsz', struct.pack('>II', 0, sample_count),
+                            struct.pack(f'>{sample_count}I', *([sample_size] * sample_count))),
+                   full_box(b'stco', struct.pack('>II', 1, chunk_offset)))
+        return box(b'trak',
+                   box(b'tkhd', b'\x00\x00\x00\x03', struct.pack('>IIIII', 0, 0, track_id, 0, 0), b'\x00' * 16,
+                       matrix, b'\x00' * 8),
+                   box(b'mdia',
+                       full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55c4, 0)),
+                       full_box(b'hdlr', b'\x00' * 4, handler, b'\x00' * 12, b'handler\x00'),
+                       box(b'minf', media_header,
+                           box(b'dinf', full_box(b'dref', struct.pack('>I', 1), box(b'url ', b'\x00\x00\x00\x01'))),
+                           stbl)))
+
+    @staticmethod
+    def write_mp4(path, duration, width=1920, height=1080, fps=24, video_bitrate=4000000, moov_at_end=False):
+        box, full_box = SampleMedia.box, SampleMedia.full_box
+        frames = int(duration * fps)
+        frame_size = video_bitrate // 8 // fps
+        audio_frames = int(duration * 48000 / 1024)
+        audio_size = 128000 // 8 * 1024 // 48000
+        mdat_size = 8 + frames * frame_size + audio_frames * audio_size
+        avc1 = box(b'avc1', b'\x00' * 6, struct.pack('>H', 1), b'\x00' * 16, struct.pack('>HH', width, height),
+                   struct.pack('>IIIH', 0x480000, 0x480000, 0, 1), b'\x00' * 32, struct.pack('>Hh', 0x18, -1),
+                   box(b'avcC', SampleMedia.avcc(width, height)))
+        esds = full_box(b'esds',
+                        bytes([0x03, 25]), struct.pack('>HB', 1, 0),
+                        bytes([0x04, 17, 0x40, 0x15, 0, 0, 0]), struct.pack('>II', 128000, 128000),
+                        bytes([0x05, 2]), SampleMedia.aac_config, bytes([0x06, 1, 2]))
+        mp4a = box(b'mp4a', b'\x00' * 6, struct.pack('>H', 1), b'\x00' * 8, struct.pack('>HHHH', 2, 16, 0, 0),
+                   struct.pack('>I', 48000 << 16), esds)
+        ftyp = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso2avc1mp41')
+
+        def moov(data_offset):
+            # data: 类型 1 (utf8) + locale
+            ilst = box(b'ilst', box(b'\xa9too', box(b'data', struct.pack('>II', 1, 0), SampleMedia.encoder.encode())))
+            matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+            return box(b'moov',
+                       full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, int(duration * 1000)),
+                                struct.pack('>IH', 0x10000, 0x100), b'\x00' * 10, matrix, b'\x00' * 24,
+                                struct.pack('>I', 3)),
+                       SampleMedia.mp4_track(1, b'vide', fps * 512, frames, 512, frame_size, avc1, data_offset),
+                       SampleMedia.mp4_track(2, b'soun', 48000, audio_frames, 1024, audio_size, mp4a,
+                                             data_offset + frames * frame_size),
+                       box(b'udta', full_box(b'meta', full_box(b'hdlr', b'\x00' * 4, b'mdir', b'appl',
+                                                               b'\x00' * 8, b'\x00'), ilst)))
+
+        with open(path, 'wb') as f:
+            f.write(ftyp)
+            if moov_at_end:
+                f.write(struct.pack('>I4s', mdat_size, b'mdat'))
+                f.seek(len(ftyp) + mdat_size)   # 媒体数据部分 是稀疏文件的空洞
+                f.write(moov(len(ftyp) + 8))
+            else:
+                header = moov(0)
+                data_offset = len(ftyp) + len(header) + 8
+                f.write(moov(data_offset))
+                f.write(struct.pack('>I4s', mdat_size, b'mdat'))
+                f.truncate(data_offset + mdat_size - 8)
+
+    # ---------------- mkv ----------------
+
+    @staticmethod
+    def element(element_id, *payload):
+        data = b''.join(payload)
+        id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+        return id_bytes + (0x01 << 56 | len(data)).to_bytes(8, 'big') + data
+
+    @staticmethod
+    def uint(element_id, value):
+        return SampleMedia.element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+    @staticmethod
+    def write_mkv(path, duration, width=1920, height=1080, fps=24, video_bitrate=4000000):
+        e, uint = SampleMedia.element, SampleMedia.uint
+        ebml = e(0x1A45DFA3, uint(0x4286, 1), uint(0x42F7, 1), uint(0x42F2, 4), uint(0x42F3, 8),
+                 e(0x4282, b'matroska'), uint(0x4287, 4), uint(0x4285, 2))
+        info = e(0x1549A966, uint(0x2AD7B1, 1000000), e(0x4489, struct.pack('>d', duration * 1000)),
+                 e(0x4D80, SampleMedia.encoder.encode()), e(0x5741, SampleMedia.encoder.encode()))
+        tracks = e(0x1654AE6B,
+                   e(0xAE, uint(0xD7, 1), uint(0x73C5, 1), uint(0x83, 1), e(0x86, b'V_MPEG4/ISO/AVC'),
+                     uint(0x23E383, 1000000000 // fps), e(0x63A2, SampleMedia.avcc(width, height)),
+                     e(0xE0, uint(0xB0, width), uint(0xBA, height))),
+                   e(0xAE, uint(0xD7, 2), uint(0x73C5, 2), uint(0x83, 2), e(0x86, b'A_AAC'),
+                     e(0x63A2, SampleMedia.aac_config), e(0xE1, e(0xB5, struct.pack('>d', 48000.0)), uint(0x9F, 2))))
+        tags = e(0x1254C367, e(0x7373, e(0x63C0), e(0x67C8, e(0x45A3, b'ENCODER'),
+                                                     e(0x4487, SampleMedia.encoder.encode()))))
+        cluster = e(0x1F43B675, uint(0xE7, 0), e(0xA3, bytes([0x81, 0, 0, 0x80]), b'\x00' * 16))
+        padding = int(duration * video_bitrate / 8)
+        body = info + tracks + tags + cluster
+        with open(path, 'wb') as f:
+            f.write(ebml)
+            f.write(bytes.fromhex('18538067') + (0x01 << 56 | len(body) + 9 + padding).to_bytes(8, 'big'))
+            f.write(body)
+            f.write(b'\xec' + (0x01 << 56 | padding).to_bytes(8, 'big'))  # Void, 内容是稀疏文件的空洞
+            f.truncate(f.tell() + padding)
@@ -1,4 +1,6 @@
 import configparser
+import signal
+import socket
 import subprocess
 import sys
 import time
@@ -11,280 +13,1093 @@ from tqdm import tqdm
 import queue
 import threading
 import traceback
-from FFmpegUtil import FFmpegUtil
+from FFmpegUtil import FFmpegUtil, FFmpegProgressParser
 from TerminalOutput import TerminalOutput
-from DatabaseHelper import MyDB
+from TerminalRenderer import TerminalRenderer
+from EventSink import JsonLineSink
+from FolderWatcher import FolderWatcher
+from FileDiscovery import FileDiscovery
+from DatabaseHelper import MyDB, ProbeCache, SuccessIndex, TaskState
+from TaskProducer import TaskProducer
+from ProcessControl import ProcessControl
+from SegmentTask import SegmentSplitter
+from EncoderProfile import ProfileEngine
+from RunEstimator import RunEstimator
+from SamplePreflight import SamplePreflight
+from JobLease import JobStore, LeaseClient, JobCoordinator
+from FileHasher import FullHashService
+from ProbeService import ProbeService
+from TaskTelemetry import ProcessStats, TaskTelemetry
+from TaskScheduler import AdaptiveConcurrency, TaskOrderQueue, projected_makespan, format_seconds
 
 
 class FFmpegManager(TerminalOutput, FFmpegUtil):
     custom_bar_format = '{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining} {postfix}]'
 
-    def __init__(self, max_processes=1, print_buff_size=22):
+    def __init__(self, max_processes=1, print_buff_size=22, concurrency=None, max_fps=10, sink=None):
+        # max_processes: 最多同时运行的 ffmpeg 个数 (也是进度条的个数)
+        # concurrency: AdaptiveConcurrency, 传入时 根据吞吐量 在 max_processes 以内调整实际的并发数
+        # max_fps: 终端每秒最多刷新几次
+        # sink: JsonLineSink, 传入时为 headless 模式: 不使用终端界面, 日志 进度 任务事件 都写成 JSON 行
         self.max_processes = max_processes
         self.print_buff_size = print_buff_size
-        TerminalOutput.check_terminal_size(120, print_buff_size + max_processes + 7)
-        self.myprint_buff = deque(maxlen=print_buff_size)
+        self.concurrency = concurrency
+        self.sink = sink
         self.bar_start_line = 2  # 进度条输出的行号
         self.print_start_line = self.bar_start_line + max_processes + 2 # print 日志输出的行号 有一行是总进度
-        self.init_output_area()
-        # 同一时间只能有一个线程 向终端中输出（调用print）
-        # 要同步三个：主线程会print  tqdm会print  子线程会print
-        self.print_lock = threading.Lock()
+        self.renderer = None
+        if sink is None:
+            TerminalOutput.check_terminal_size(120, print_buff_size + max_processes + 7)
+            # 主线程 tqdm 子线程 都只修改 renderer 中的行, 由 renderer 的线程统一输出到终端
+            self.renderer = TerminalRenderer(max_fps=max_fps)
+            self.init_output_area()
 
     def init_output_area(self):
         # 初始化终端界面，输出有颜色的区域分割
-        TerminalOutput.clear_screen()
-        TerminalOutput.move_cursor(self.bar_start_line - 1, 1)
-        TerminalOutput.print_title("Process Bar Area:")
-        TerminalOutput.move_cursor(self.print_start_line - 1, 1)
-        TerminalOutput.print_title("Print Output Area:")
-        for i in range(self.print_buff_size):
-            TerminalOutput.move_cursor(self.print_start_line + i, 1)
-            sys.stdout.write(f"[{i + 1}]:")
-        TerminalOutput.move_cursor(self.bar_start_line, 1)
+        self.renderer.set_title(self.bar_start_line - 1, "Process Bar Area:")
+        self.renderer.set_title(self.print_start_line - 1, "Print Output Area:")
+        self.renderer.set_log_area(self.print_start_line, self.print_buff_size)
+        self.renderer.start()
+
+    def close_output_area(self):
+        # 输出最后一帧, 光标移动到输出区域的下方
+        if self.sink is not None:
+            self.sink.close()
+            return
+        self.renderer.stop()
+        TerminalOutput.move_cursor(self.print_start_line + self.print_buff_size + 1, 1)
 
     def print_to_area(self, *args, color='black'):
-        with self.print_lock:
-            # 把args输出到 print_start_line 开始的区域, 字符数目超过一行的裁剪字符
-            # 只显示历史 print_buff_size 条数据 多余的条目抛弃
-            w = os.get_terminal_size().columns
-            # 合并args参数为一个字符串 超出行的字符串裁剪去 并补上两个点
-            str_args = [str(aa) for aa in args]
-            print_text = " ".join(str_args)
-            if len(self.myprint_buff) >= self.print_buff_size:
-                self.myprint_buff.popleft()
-            self.myprint_buff.append({'t': print_text, 'c': color})
-
-            # 把缓存的print内容输出到 终端的指定区域
-            ll = min(len(self.myprint_buff), self.print_buff_size)
-            for i in range(ll):
-                self.move_cursor(self.print_start_line + i, 1)
-                sys.stdout.write(" " * (w - 1))  # Clear the line
-                self.move_cursor(self.print_start_line + i, 1)
-                c = self.myprint_buff[i]['c']
-                if c == 'red':
-                    sys.stdout.write("\033[31m")
-                if c == 'green':
-                    sys.stdout.write("\033[32m")
-
-                print_text = self.myprint_buff[i]['t']
-                print_text = print_text.replace('\n', ' ')
-                print_text = print_text.replace('\r', ' ')
-                print_text = f"[{i + 1}]: {print_text}\n"
-                print_text = TerminalOutput.truncate_string_by_width(print_text,w)
-                sys.stdout.write(print_text)
-                sys.stdout.write('\033[0m')
-
-            self.move_cursor(self.bar_start_line, 1)
-            sys.stdout.flush()
-            self.move_cursor(self.bar_start_line, 1)
+        # 把args输出到 print_start_line 开始的区域, 只显示历史 print_buff_size 条数据
+        # 只放入 renderer 的缓存, 下一帧才输出到终端, 可以在任何线程中调用
+        text = " ".join(str(aa) for aa in args)
+        if self.sink is not None:
+            self.sink.log(text, color)
+        else:
+            self.renderer.log(text, color)
+
+    def emit(self, event, **fields):
+        # headless 模式下 输出一个结构化事件, 终端模式下什么都不做
+        if self.sink is not None:
+            self.sink.emit(event, **fields)
+
+    def print_exc_to_area(self):
+        # 异常的调用栈 逐行输出到 print 区域
+        for line in traceback.format_exc().splitlines():
+            self.print_to_area(line, color='red')
+
+    def new_bar(self, row, total):
+        # 进度条写入 renderer 中的一行, 不直接写终端
+        # headless 模式下 进度条不输出, 只用来保存进度
+        if self.renderer is None:
+            return tqdm(total=total, disable=True)
+        return tqdm(total=total, bar_format=self.custom_bar_format, position=0,
+                    file=self.renderer.line(row), ncols=self.renderer.columns - 1)
+
+    # 主循环处理的事件类型, 由子线程放入 event_queue
+    EVENT_TASK_READY = 'task_ready'    # producer 放入了新的任务 / producer 结束
+    EVENT_OUTPUT = 'output'            # ffmpeg 进程 stderr 输出了一行   (type, slot_index, line)
+    EVENT_PROGRESS = 'progress'        # ffmpeg 进程输出了一组进度       (type, slot_index, progress_dict)
+    EVENT_EXIT = 'exit'                # ffmpeg 进程退出         (type, slot_index, retcode)
+    EVENT_HASHED = 'hashed'            # 后台计算完 全文件sha256 (type, video_file_id, digest)
+    EVENT_FILES_ADDED = 'files_added'  # 监控的目录中 有新文件写完 (type, 文件列表)
+    EVENT_FILES_FOUND = 'files_found'  # 遍历目录 找到了一批文件 (type, 文件列表)
+    EVENT_DISCOVERY_DONE = 'discovery_done'    # 遍历目录结束
+    EVENT_JOBS_LEASED = 'jobs_leased'  # worker 模式下 从任务表领取到了任务 (type, 文件列表)
+    EVENT_LEASE_LOST = 'lease_lost'    # 租约已经被其他 worker 领取 (type, 文件列表)
+    EVENT_JOBS_DRAINED = 'jobs_drained'    # 任务表中的任务 都已经完成
+    EVENT_VERIFIED = 'verified'        # 输出文件校验完成 (type, 运行信息, Future)
+    discovery_batch_size = 500          # 遍历目录时 每多少个文件 交给主循环一次
+    discovery_batch_seconds = 0.5       # 或者距离上一次 超过多少秒
+
+    def read_progress(self, process, slot_index):
+        # 解析 ffmpeg -progress pipe:1 输出的 key=value, 每收到一组完整的进度 通知主循环
+        parser = FFmpegProgressParser()
+        try:
+            for line in process.stdout:
+                progress = parser.feed(line)
+                if progress is not None:
+                    self.event_queue.put((self.EVENT_PROGRESS, slot_index, progress))
+        except Exception as e:
+            self.print_to_area(f'处理子进程进度输出发生错误:{e}', color='red')
+        process.stdout.close()
 
     # @staticmethod
-    def enqueue_output(self, out, q, print_to_area, thread_name, output_file_path):
+    def enqueue_output(self, process, slot_index, q, print_to_area, thread_name, output_file_path):
+        # stderr 中只剩下 ffmpeg 的诊断信息, 全部写入运行输出文件, 并交给主循环检查错误
         mypid = os.getpid()
         t_name = threading.current_thread().name
         print_to_area(f'✅ start thread {t_name},{thread_name}, pid:{mypid}')
-        buffer = b""    # 不使用python自带的对stream的decode 有些bytes不能用utf8解码
+        progress_thread = threading.Thread(target=self.read_progress, args=(process, slot_index), daemon=True)
+        progress_thread.start()
+        out = process.stderr
         with open(output_file_path, 'wb') as f:
             try:
-
-                while True:
-                    chunk = out.read(10)
-                    if not chunk:
-                        break
-
-                    buffer += chunk
-                    while b"\n" in buffer or b"\r" in buffer:
-                        if b"\n" in buffer:
-                            line, buffer = buffer.split(b"\n", 1)    # 按照\n分割
-                        elif b"\r" in buffer:
-                            line, buffer = buffer.split(b"\r", 1)
-
-                        decoded_line = line.decode("utf-8", errors="replace")  # 用?顶替错误的
-                        q.append(decoded_line)
-                        result = FFmpegUtil.match_ffmpeg_running_output(decoded_line)
-                        # print_to_area(f'{decoded_line}')
-                        if result is not None:
-                            # [frame, fps, size, ttime, bitrate, speed] = result
-                            f.write(bytes(".", "utf-8"))
-                        else:
-                            f.write(bytes(decoded_line, "utf-8"))
+                # 不使用python自带的对stream的decode 有些bytes不能用utf8解码
+                for line in FFmpegUtil.iter_stream_lines(out):
+                    f.write(line + b"\n")
+                    decoded_line = line.decode("utf-8", errors="replace")  # 用?顶替错误的
+                    q.append(decoded_line)
+                    self.event_queue.put((self.EVENT_OUTPUT, slot_index, decoded_line))
             except Exception as e:
                 print_to_area(f'处理子进程输出线程发生错误:{thread_name}', color='red')
-                TerminalOutput.move_cursor(self.print_buff_size + self.print_start_line + 3, 0)
-                traceback.print_exc()
-                TerminalOutput.move_cursor(self.bar_start_line, 0)
+                self.print_exc_to_area()
 
         out.close()
+        # 输出结束后 等待进程退出 通知主循环, 主循环不需要 poll() 每一个进程
+        # 先等进度线程结束, 保证 EXIT 事件排在所有进度事件之后
+        progress_thread.join()
+        retcode = process.wait()
+        self.event_queue.put((self.EVENT_EXIT, slot_index, retcode))
         print_to_area(f'⛔ end thread {t_name},{thread_name}, pid:{mypid}')
 
-    def run(self, db, file_path_list, output_dir, running_output_dir, global_quality=24, ):
+    def notify_task_ready(self):
+        self.event_queue.put((self.EVENT_TASK_READY,))
+
+    def notify_files_added(self, file_path_list):
+        # 由 FolderWatcher 的线程调用, 交给主循环 预过滤后 放入 producer
+        self.event_queue.put((self.EVENT_FILES_ADDED, file_path_list))
+
+    def discover(self, file_iter):
+        # 在单独的线程中 遍历目录(或者任意的文件列表), 分批交给主循环, 第一批找到后 probe 就可以开始
+        batch = []
+        last_time = time.time()
         try:
-            conn = db.get_conn()
-            ready_task_queue = FFmpegUtil.ffmpeg_video_to_av1_task_queue_init(
-                file_path_list, output_dir, global_quality, running_output_dir,
-                self.print_to_area
-            )
-            process_count_pbar = None
-            done_skip_task_count = 0
-            running_process_list = [None] * self.max_processes
-            done_process_list = []
-
-            with self.print_lock:
-                for i in range(self.max_processes):  # 初始化进度条 和 进程信息
-                    running_process_list[i] = {
-                        "process": None,
-                        "output": None,
-                        "pbar": tqdm(total=100, bar_format=self.custom_bar_format, position=i),
-                        "task": None,
-                        "output_has_error": False, # 每次从消息队列中 取出ffmpeg进程的输出时 判断下文本是否包含错误的关键字
-                        "run_record_id": None,      # 在任务开始运行后 数据库记录下开始运行的时间点 返回 记录的id 后续运行结束的结果 也存回这个id
-                    }
-                process_count_pbar = tqdm(total=ready_task_queue.qsize(),
-                                          bar_format=self.custom_bar_format,
-                                          position=self.max_processes)
+            for item in file_iter:
+                batch.append(item)
+                if len(batch) >= self.discovery_batch_size or time.time() - last_time >= self.discovery_batch_seconds:
+                    self.event_queue.put((self.EVENT_FILES_FOUND, batch))
+                    batch = []
+                    last_time = time.time()
+        except Exception as e:
+            self.print_to_area(f"😱 遍历目录出错:{e}", color='red')
+        if batch:
+            self.event_queue.put((self.EVENT_FILES_FOUND, batch))
+        self.event_queue.put((self.EVENT_DISCOVERY_DONE,))
 
-            while True:
-                # 1. 检查running里面有没有 None, 安排ready task 进入
-                for i, process_info in enumerate(running_process_list):
-                    if process_info["process"] is None:
-                        try:
-                            task = ready_task_queue.get(block=False)
-                            # 每个像素占用了多少比特流
-                            bit_per_pixel = int(task["v_info"]["video_bit_rate"]) / \
-                                             (int(task["v_info"]["video_width"]) * int(task["v_info"]["video_height"]))
-                            # 检查 sha256 在数据库中 是否出现 运行成功。
-                            [vfile_id, vfile_name, record_id ] = db.check_success_sha256(conn, task['sha256'])
-                            if vfile_id is not None:
-                                pass_reason = f"文件sha256在库中已出现,且执行成功: {task['file_path']}->video_file_id:{vfile_id}: {vfile_name}, run taskid: {record_id}"
-                                self.print_to_area(pass_reason,color="red")
-                                db.insert_ByPass_File_Log(conn, task, vfile_id, pass_reason)
-                                done_skip_task_count += 1
-                                continue
-                            elif bit_per_pixel < 1: # 说明原文件就很糊了
-                                pass_reason = f"原文件已经很糊了 bit_per_pixel为:{bit_per_pixel} 文件:{task['file_path']}, path:{task['file_path']}"
-                                self.print_to_area(f"👀👀👀{pass_reason}",color="red")
-                                vfile_id = db.insert_video_file_state(conn, task)
-                                db.insert_ByPass_File_Log(conn, task, vfile_id, pass_reason)
-                                done_skip_task_count += 1
-                                continue
-                            else:
-                                self.print_to_area(f"开始处理文件:{task['file_path']}", color='green')
-
-                            process = subprocess.Popen(
-                                task['command'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                text=False,
-                                # universal_newlines=True, encoding='utf8',
-                                shell=True
-                            )  # shell = True 时运行 process是shell进程 ffmpeg是shell的子进程 kill时 会让ffmpeg继续运行
-                            output_queue = deque(maxlen=500)  # 创建输出队列和线程
-                            t = threading.Thread(
-                                target=self.enqueue_output,
-                                args=(process.stderr, output_queue,
-                                      self.print_to_area, os.path.basename(task["file_path"]),
-                                      task['running_output_path'] )
-                            )
-                            t.daemon = True  # 设置为守护线程，使其在主线程结束时自动退出
-                            t.start()
-                            with self.print_lock:
-                                running_process_list[i]["pbar"].total = int(float(task['duration']))  # 设置进度条最大长度
-                                running_process_list[i]["pbar"].n = 0
-                            running_process_list[i]["process"] = process
-                            running_process_list[i]["output"] = output_queue
-                            running_process_list[i]["task"] = task
-                            # 向数据库中 添加 文件记录 和 运行记录, 【会造成 多个hash一样文件被放入 video库中】
-                            vfile_id = db.insert_video_file_state(conn, task)
-                            run_record_id = db.record_start_run(conn, vfile_id, " ".join(task['command']), task['running_output_path'])
-                            running_process_list[i]['run_record_id'] = run_record_id
-                        except queue.Empty:
-                            running_process_list[i]['process'] = None
-
-                # 2. 从进度队列中取出进度 显示到进度条上
-                for i, process_info in enumerate(running_process_list):
-                    pbar = process_info['pbar']
-                    if process_info["process"] is None:
+    def on_discovery_done(self):
+        self.discovery_done = True
+        self.print_to_area(f"🔍 遍历目录结束, 共 {self.discovered_count} 个文件")
+        if self.lease_client is not None:
+            # worker 模式: 不遍历目录, 任务从任务表领取
+            self.lease_client.start(lambda paths: self.event_queue.put((self.EVENT_JOBS_LEASED, paths)),
+                                    self.slot_limit, self.print_to_area,
+                                    on_lost=lambda paths: self.event_queue.put((self.EVENT_LEASE_LOST, paths)),
+                                    on_drained=lambda: self.event_queue.put((self.EVENT_JOBS_DRAINED,)))
+            self.print_to_area(f"🛰️ worker {self.lease_client.owner} 开始领取任务", color='green')
+        elif self.watcher is not None:
+            # 遍历结束后 才开始监控, 已经找到的文件不会重复加入
+            self.watcher.start(self.notify_files_added, self.discovered_paths)
+            self.discovered_paths = []
+            self.print_to_area(f"👁️ 开始监控目录:{self.watcher.dir_path}", color='green')
+        else:
+            self.producer.close()
+
+    def add_files(self, file_path_list, front=False):
+        # 文件可以是路径 或 os.DirEntry
+        # front: 上一次运行中断 已经恢复的文件, 排在队列最前面; 之后遍历目录再次找到时 不重复加入
+        if front:
+            self.recovered_paths.update(os.fspath(p) for p in file_path_list)
+        else:
+            file_path_list = [p for p in file_path_list if os.fspath(p) not in self.recovered_paths]
+            self.discovered_count += len(file_path_list)
+        if self.watcher is not None and not self.discovery_done:
+            self.discovered_paths.extend(os.fspath(p) for p in file_path_list)
+        if self.prefilter_args is not None:
+            file_path_list = self.prefilter_files(file_path_list, *self.prefilter_args)
+        if self.lease_client is not None and file_path_list:
+            # 之前领取这些任务的 worker 崩溃了: 共享的输出目录中 可能留有它没有写完的输出文件 和 分段
+            # 必须在预过滤之后: 已经转码成功 只是没来得及结束租约的任务 输出文件是完整的
+            for file_path in self.lease_client.store.retried_paths(
+                    self.lease_client.owner, [os.fspath(p) for p in file_path_list]):
+                self.remove_stale_outputs(file_path)
+        if file_path_list:
+            self.db.submit(self.db.journal_tasks,
+                           [(os.fspath(p), TaskState.QUEUED, None, None, None) for p in file_path_list])
+            self.producer.add_files(file_path_list, front)
+
+    def remove_stale_outputs(self, file_path):
+        # 任意一种编码方式的输出文件 probe 之前还不知道会选择哪一种
+        for dstfile_path in self.profiles.output_paths(file_path, self.output_dir):
+            self.remove_partial_output(dstfile_path)
+            SegmentSplitter.remove_segments({'segment_dir': dstfile_path + ".segments"})
+
+    def recover_interrupted(self):
+        """
+        上一次运行被中断(崩溃 断电 kill) 时 Task_Journal 中还是 running / verifying 的任务:
+        verifying 的任务 ffmpeg 已经正常退出, 先校验输出文件, 校验通过的 直接记录为成功;
+        其他的 删除没有写完的输出文件 和 分段目录, 运行记录标记为出错, 返回需要重新排在最前面的输入文件
+        """
+        rows = self.db.find_interrupted_tasks(self.conn)
+        if self.lease_client is not None:
+            # worker 模式: 其他节点 和 本机上还在运行的 worker 的任务 不能动;
+            # 租约已经被其他 worker 领取的 输出文件可能正在写入, 也不能动
+            rows = [row for row in rows if self.is_dead_local_owner(row[4])
+                    and self.lease_client.store.lease_owner(row[0]) in (None, row[4])]
+        if not rows:
+            return []
+        verifying = {row[1]: self.probe_service.verify(row[1]) for row in rows
+                     if row[5] == TaskState.VERIFYING and row[1]}
+        file_paths, run_record_ids = [], []
+        for file_path, dstfile_path, segment_dir, run_record_id, _owner, _state in rows:
+            if dstfile_path in verifying and self.recover_verified(
+                    file_path, dstfile_path, segment_dir, run_record_id, verifying[dstfile_path]):
+                continue
+            if dstfile_path and ProcessControl.remove_partial_output(dstfile_path):
+                self.print_to_area(f"🧹 删除中断的输出文件:{dstfile_path}")
+            if segment_dir and os.path.isdir(segment_dir):
+                SegmentSplitter.remove_segments({'segment_dir': segment_dir})
+            if run_record_id is not None:
+                run_record_ids.append(run_record_id)
+            file_paths.append(file_path)
+        if not file_paths:
+            return []
+        self.db.submit(self.db.close_interrupted_runs, file_paths, run_record_ids)
+        self.emit("recovered", files=file_paths)
+        if self.lease_client is not None:
+            # 这些任务的租约过期后 由任意一个 worker 重新领取
+            self.print_to_area(f"♻️ 上一次运行中断的任务 {len(file_paths)} 个, 已清理, 租约过期后重新领取", color='green')
+            return []
+        self.print_to_area(f"♻️ 上一次运行中断的任务 {len(file_paths)} 个, 重新排在最前面", color='green')
+        return [p for p in file_paths if os.path.exists(p)]
+
+    def recover_verified(self, file_path, dstfile_path, segment_dir, run_record_id, future):
+        """
+        上一次 ffmpeg 已经正常退出, 校验输出文件时 被中断: 输出文件校验通过时 按 finish_exit 记录为成功, 不再重新转码
+        :return: 是否已经记录为成功, 校验失败时 由调用者按中断的任务处理
+        """
+        try:
+            verified = future.result()
+        except Exception as e:
+            self.print_to_area(f"😱 校验中断任务的输出文件出错:{dstfile_path}, {e}", color='red')
+            return False
+        db = self.db
+        out_vfile_id = db.submit(db.insert_video_file_state, verified)
+        db.submit(db.record_end_run, run_record_id, False, out_vfile_id)
+        db.submit(db.journal_task, file_path, TaskState.SUCCEEDED)
+        if segment_dir and os.path.isdir(segment_dir):
+            SegmentSplitter.remove_segments({'segment_dir': segment_dir})
+        run_input = db.find_run_input(self.conn, run_record_id)
+        if run_input is not None:
+            sha256_str, fingerprint, vfile_id, file_name = run_input
+            self.success_index.add(sha256_str, fingerprint, vfile_id, file_name, run_record_id)
+        self.print_to_area(f"♻️ 中断的任务 输出文件校验通过, 记录为成功:{dstfile_path}", color='green')
+        self.emit("recovered_verified", file=file_path, dst=dstfile_path)
+        return True
+
+    @staticmethod
+    def is_dead_local_owner(owner):
+        # owner 为 主机名:进程id, 是本机上 已经退出的进程
+        host, _, pid = (owner or '').rpartition(':')
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def finish_task_state(self, file_path, state):
+        # 任务的最终状态 写入 Task_Journal, worker 模式下 同时写回任务表 结束租约
+        # 写线程按顺序 commit, 等这次写入 commit 之后 运行记录也一定已经写入, 这时才结束租约
+        future = self.db.submit(self.db.journal_task, file_path, state)
+        if self.lease_client is not None:
+            future.add_done_callback(lambda _f: self.lease_client.finish(file_path, state))
+
+    def on_load_failed(self, file_path):
+        # producer 线程中调用: probe 失败的文件 不会进入任务队列
+        if self.lease_client is not None:
+            self.lease_client.finish(file_path, TaskState.FAILED)
+
+    def check_bypass(self, task):
+        """
+        检查任务是否需要略过, 需要略过时 记录略过原因 并返回 True
+        """
+        db = self.db
+        # 检查 sha256 在数据库中 是否出现 运行成功。 (查内存中的索引, 不再每个文件查一次库)
+        [vfile_id, vfile_name, record_id ] = self.success_index.lookup(task['sha256'], task.get('fingerprint'))
+        if vfile_id is not None:
+            pass_reason = f"文件sha256在库中已出现,且执行成功: {task['file_path']}->video_file_id:{vfile_id}: {vfile_name}, run taskid: {record_id}"
+            self.print_to_area(pass_reason,color="red")
+            db.submit(db.insert_ByPass_File_Log, task, vfile_id, pass_reason)
+            self.finish_task_state(task['file_path'], TaskState.SKIPPED)
+            self.emit("task_skipped", file=task['file_path'], reason="already_done")
+            return True
+        elif task.get('skip_reason'): # 编码规则决定不转码 (例如 原文件就很糊了), 见 ProfileEngine
+            pass_reason = task['skip_reason']
+            self.print_to_area(f"👀👀👀{pass_reason}",color="red")
+            vfile_id = db.submit(db.insert_video_file_state, task)
+            db.submit(db.insert_ByPass_File_Log, task, vfile_id, pass_reason)
+            self.finish_task_state(task['file_path'], TaskState.SKIPPED)
+            self.emit("task_skipped", file=task['file_path'], reason=task.get('skip_kind', "profile_rule"),
+                      detail=pass_reason)
+            return True
+        return False
+
+    def start_task(self, slot_index, task):
+        db = self.db
+        process_info = self.running_process_list[slot_index]
+        self.print_to_area(f"开始处理文件:{task['file_path']}", color='green')
+        if task.get('kind') == 'segment':
+            os.makedirs(task['segment_group']['segment_dir'], exist_ok=True)
+        # 不经过 shell 直接启动 ffmpeg, 并放在单独的进程组中, 停止时不会留下孤儿 ffmpeg
+        process = ProcessControl.popen(
+            task['command'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=False,
+        )
+        output_queue = deque(maxlen=500)  # 保存最近的输出 供结束后查看
+        t = threading.Thread(
+            target=self.enqueue_output,
+            args=(process, slot_index, output_queue,
+                  self.print_to_area, os.path.basename(task["file_path"]),
+                  task['running_output_path'] )
+        )
+        t.daemon = True  # 设置为守护线程，使其在主线程结束时自动退出
+        description = os.path.basename(task['file_path'])
+        group = task.get('segment_group')
+        if task.get('kind') == 'segment':
+            description = f"[{task['segment_index'] + 1}/{group['segment_count']}] {description}"
+        elif task.get('kind') == 'concat':
+            description = f"[concat] {description}"
+        process_info["pbar"].total = int(float(task['duration']))  # 设置进度条最大长度
+        process_info["pbar"].n = 0
+        process_info["pbar"].set_description_str(description, refresh=False)
+        process_info["process"] = process
+        process_info["output"] = output_queue
+        process_info["task"] = task
+        process_info["start_time"] = time.time()
+        process_info["output_has_error"] = False
+        process_info["cancelled"] = False
+        process_info["remove_output"] = False
+        process_info["progress"] = {}
+        process_info["telemetry"] = None
+        if self.telemetry is not None:
+            process_info["telemetry"] = self.telemetry.start(process.pid, process_info["start_time"])
+        self.emit("task_start", slot=slot_index, file=task['file_path'], dst=task['dstfile_path'],
+                  kind=task.get('kind', 'file'), segment_index=task.get('segment_index'),
+                  duration=float(task['duration']), pid=process.pid)
+        if group is None:
+            # 向数据库中 添加 文件记录 和 运行记录, 【会造成 多个hash一样文件被放入 video库中】
+            # 写操作交给写线程, 得到的 id 都是 Future, 可以直接作为后续写操作的参数
+            vfile_id = db.submit(db.insert_video_file_state, task)
+            self.submit_full_hash(task['file_path'], vfile_id)
+            run_record_id = db.submit(db.record_start_run, vfile_id, " ".join(task['command']), task['running_output_path'])
+            db.submit(db.journal_task, task['file_path'], TaskState.RUNNING, task['dstfile_path'], None, run_record_id)
+        else:
+            # 分段转码: 整个文件只记录一次 文件记录 和 运行记录, 每一段单独记录运行时间
+            if group['run_record_id'] is None:
+                logical_task = group['task']
+                group['video_file_id'] = db.submit(db.insert_video_file_state, logical_task)
+                self.submit_full_hash(logical_task['file_path'], group['video_file_id'])
+                group['run_record_id'] = db.submit(
+                    db.record_start_run, group['video_file_id'], f"{' '.join(logical_task['command'])} # split into {group['segment_count']} segments",
+                    logical_task['running_output_path'])
+                db.submit(db.journal_task, logical_task['file_path'], TaskState.RUNNING, logical_task['dstfile_path'],
+                          group['segment_dir'], group['run_record_id'])
+            run_record_id = group['run_record_id']
+            vfile_id = group['video_file_id']
+            if task['kind'] == 'segment':
+                process_info['segment_record_id'] = db.submit(db.record_start_segment, run_record_id, task)
+        process_info['run_record_id'] = run_record_id
+        process_info['video_file_id'] = vfile_id
+        process_info['dirty'] = True
+        t.start()
+
+    def slot_limit(self):
+        # 当前允许同时运行的 ffmpeg 个数
+        if self.concurrency is not None:
+            return min(self.concurrency.limit, self.max_processes)
+        return self.max_processes
+
+    def running_count(self):
+        return len(list(filter(lambda x: x['process'] is not None, self.running_process_list)))
+
+    def dispatch_ready(self):
+        # 非 fifo 的排序 需要知道全部任务才有意义, 等 producer 把已经加入的文件都 probe 完再开始分配
+        # disk_policy 为 refuse 时 也要等全部任务 probe 完, 估算输出大小后 才决定是否开始
+        batch_known = self.discovery_done and self.producer.is_idle()
+        if batch_known and not self.makespan_reported:
+            self.makespan_reported = True
+            self.report_makespan()
+        if not batch_known and (self.ready_task_queue.policy != 'fifo' or self.disk_policy == 'refuse'):
+            return False
+        return not self.refused
+
+    def running_tasks(self):
+        return [p for p in self.running_process_list if p is not None and p['process'] is not None]
+
+    def remaining_bytes(self, process_info):
+        # 正在运行的任务 还要写入多少字节: 估算的输出大小 - 已经写入的大小
+        _, output_bytes = self.estimator.predict(process_info['task'])
+        try:
+            written = os.path.getsize(process_info['task']['dstfile_path'])
+        except OSError:
+            written = 0
+        return max(0, output_bytes - written)
+
+    def report_makespan(self):
+        """
+        全部任务 probe 完成后 根据历史记录估算 总时长 和 输出大小, 输出目录剩余空间不够时:
+        refuse: 不开始转码 (已经在运行的任务 运行完后结束), throttle: 由 has_space_for 逐个任务检查
+        """
+        now = time.time()
+        times, output_bytes, count = [], 0, 0
+        for process_info in self.running_tasks():
+            seconds, _ = self.estimator.predict(process_info['task'])
+            times.append(max(0.0, seconds - (now - process_info['start_time'])))
+            output_bytes += self.remaining_bytes(process_info)
+        for task in self.ready_task_queue.tasks_in_order():
+            if task.get('skip_reason') or self.success_index.lookup(task['sha256'], task.get('fingerprint'))[0]:
+                continue    # 开始时会被 check_bypass 略过
+            seconds, task_bytes = self.estimator.predict(task)
+            times.append(seconds)
+            output_bytes += task_bytes
+            count += task.get('kind') not in ('segment', 'concat') or task.get('segment_index') == 0
+        if not times:
+            return
+        slots = self.slot_limit()
+        projected = projected_makespan(times, slots)
+        lower_bound = max(sum(times) / slots, max(times))
+        free_bytes = RunEstimator.free_bytes(self.output_dir)
+        self.print_to_area(
+            f"📐 任务排序:{self.ready_task_queue.policy}, {count} 个文件, 并发数:{slots}, "
+            f"预计总时长:{format_seconds(projected)} (下限 {format_seconds(lower_bound)}), "
+            f"预计输出:{output_bytes / 1024 ** 3:.2f}GB, 剩余空间:{free_bytes / 1024 ** 3:.2f}GB, "
+            f"历史记录:{self.estimator.sample_count}条", color='green')
+        self.emit("estimate", files=count, seconds=round(projected, 1), output_bytes=output_bytes,
+                  free_bytes=free_bytes, history=self.estimator.sample_count)
+        if self.disk_policy != 'off' and output_bytes + self.disk_reserve > free_bytes:
+            if self.disk_policy == 'refuse':
+                self.refused = True
+                self.print_to_area(f"💾 输出目录剩余空间不足 (还需要 {output_bytes + self.disk_reserve - free_bytes} 字节), "
+                                   f"不开始转码", color='red')
+                self.emit("disk_insufficient", needed=output_bytes + self.disk_reserve, free_bytes=free_bytes,
+                          action="refuse")
+            else:
+                self.print_to_area("💾 输出目录剩余空间可能不足, 空间不够时 暂停启动新任务", color='red')
+                self.emit("disk_insufficient", needed=output_bytes + self.disk_reserve, free_bytes=free_bytes,
+                          action="throttle")
+
+    def has_space_for(self, task):
+        # 剩余空间 - 运行中任务还要写入的 - 预留空间 >= 这个任务的输出大小
+        if self.disk_policy == 'off':
+            return True
+        _, needed = self.estimator.predict(task)
+        reserved = sum(self.remaining_bytes(p) for p in self.running_tasks())
+        free_bytes = RunEstimator.free_bytes(self.output_dir)
+        if free_bytes - reserved - self.disk_reserve >= needed:
+            if self.waiting_for_space:
+                self.waiting_for_space = False
+                self.print_to_area("💾 剩余空间足够, 继续启动任务", color='green')
+            return True
+        if not self.waiting_for_space:
+            self.waiting_for_space = True
+            self.print_to_area(f"💾 剩余空间不足, 暂停启动新任务: {task['file_path']} 预计输出 {needed} 字节, "
+                               f"剩余 {free_bytes} 字节, 运行中的任务还要写入 {reserved} 字节", color='red')
+            self.emit("disk_wait", file=task['file_path'], needed=needed, free_bytes=free_bytes, reserved=reserved)
+        return False
+
+    def skip_no_space(self, task):
+        # 剩余空间 即使没有其他任务在运行 也放不下这个任务的输出: 记录略过 (分段 / 拼接任务 记录整个文件失败)
+        _, needed = self.estimator.predict(task)
+        free_bytes = RunEstimator.free_bytes(self.output_dir)
+        self.waiting_for_space = False
+        group = task.get('segment_group')
+        file_path = (group['task'] if group is not None else task)['file_path']
+        pass_reason = f"输出目录剩余空间不足: 预计输出 {needed} 字节, 剩余 {free_bytes} 字节, 预留 {self.disk_reserve} 字节"
+        self.print_to_area(f"💾 {pass_reason}, 不转码: {file_path}", color='red')
+        self.emit("task_skipped", file=file_path, reason="no_space", detail=pass_reason)
+        if group is None:
+            db = self.db
+            vfile_id = db.submit(db.insert_video_file_state, task)
+            db.submit(db.insert_ByPass_File_Log, task, vfile_id, pass_reason)
+            self.finish_task_state(file_path, TaskState.SKIPPED)
+            self.done_skip_task_count += 1
+        elif task['kind'] == 'segment':
+            self.finish_segment(group, True)
+        else:
+            self.fail_segment_group(group)
+
+    def fill_slots(self):
+        # 检查running里面有没有空位, 安排ready task 进入
+        if not self.dispatch_ready():
+            return
+        running_c = self.running_count()
+        for i, process_info in enumerate(self.running_process_list):
+            if running_c >= self.slot_limit():
+                return
+            while process_info["process"] is None:
+                try:
+                    task = self.ready_task_queue.get(block=False)
+                except queue.Empty:
+                    return
+                if self.lost_paths:
+                    group = task.get('segment_group')
+                    if (group['task'] if group is not None else task)['file_path'] in self.lost_paths:
+                        continue    # 租约已经失效, 由其他 worker 转码
+                if task.get('kind') == 'segment':
+                    # 分段任务: 整个文件只检查一次是否略过, 略过 或 已经有分段失败时 剩下的分段不再运行
+                    group = task['segment_group']
+                    if group['bypass'] is None:
+                        group['bypass'] = self.check_bypass(group['task'])
+                        if group['bypass']:
+                            self.done_skip_task_count += 1
+                    if group['bypass'] or group['failed']:
+                        self.finish_segment(group, False)
                         continue
-                    output_queue = process_info['output']
-                    pbar.set_description_str(os.path.basename(process_info['task']['file_path']))
-                    try:
-                        last_line = output_queue.popleft()
-                        result = FFmpegUtil.match_ffmpeg_running_output(last_line)
-                        if result is not None:
-                            [frame, fps, size, ttime, bitrate, speed] = result
-                            tt = FFmpegUtil.ttime2second(ttime)
-                            pbar.n = tt
-                            pbar.set_postfix_str(f"bitrate:{bitrate},speed:{speed}")
-                            process_info['output_has_error'] = False # 能匹配上 说明程序正常运行
-                        elif "error" in last_line.lower() or 'missing' in last_line.lower():
-                            self.print_to_area(f'😡 error in output:[{last_line}]', color='red')
-                            process_info['output_has_error'] = True # 说明程序出错了
-                        else:
-                            # self.print_to_area(f'cant process last_line:[{last_line}]', color='red')
-                            pass
-                    except IndexError:
-                        pass  # 没有从队列中获取到消息
-
-                # 3. 刷新进度条
-                with self.print_lock:
-                    for i, process_info in enumerate(running_process_list):
-                        pbar = process_info['pbar']
-                        pbar.refresh()
-                    process_count_pbar.set_description_str("已经完成的任务个数")
-                    process_count_pbar.n = done_skip_task_count
-                    process_count_pbar.refresh()
-
-                # 4. 检查进程状态, 运行完毕的 放入done中 把running置 None
-                for i, process_info in enumerate(running_process_list):
-                    if process_info['process'] is None:
+                elif task.get('kind') != 'concat' and not task.get('bypass_checked'):
+                    # 因为空间不足 放回队列的任务 不再重复检查
+                    if self.check_bypass(task):
+                        self.done_skip_task_count += 1
                         continue
-                    retcode = process_info['process'].poll()
-                    if retcode is not None:
-                        done_skip_task_count += 1
-
-                        out_vfile_id = None
-                        if process_info["output_has_error"] == False: # 运行中 没有发生错误: 获取并记录 输出视频的 基本信息
-                            output_video_path = process_info['task']['dstfile_path']
-                            out_vinfo = FFmpegUtil.ffmpeg_video_info(output_video_path)
-                            out_vfile_id = db.insert_video_file_state(conn, {
-                                "v_info": out_vinfo,
-                                "sha256": FFmpegUtil.cal_sample_sha256(output_video_path)
-                            })
-
-                        # 记录运行是否成功
-                        db.record_end_run(conn, process_info['run_record_id'], process_info["output_has_error"], out_vfile_id)
-
-                        self.print_to_area(f"{process_info['task']['file_path']} is exited, ret code:{retcode}, has_error:{process_info['output_has_error']}")
-                        done_process_list.append({
-                            "process": process_info["process"],
-                            "output": process_info["output"],
-                            "task": process_info["task"]
-                        })
-                        running_process_list[i]['process'] = None
-
-                # 5. readytask为空 且 running为空 就退出循环
-                running_c = len(list(filter(lambda x: x['process'] is not None,
-                                            running_process_list)))  # print_to_area(f"running_c:{running_c}")
-                if ready_task_queue.empty() and running_c == 0:
+                    task['bypass_checked'] = True
+                if not self.has_space_for(task):
+                    if running_c == 0 and self.disk_policy == 'throttle':
+                        # 没有运行中的任务 空间不会再变多, 一直等待也放不下这个任务, 不转码它 继续下一个
+                        self.skip_no_space(task)
+                        continue
+                    self.ready_task_queue.put_front(task)
+                    if self.disk_policy == 'refuse' and running_c == 0:
+                        self.refused = True     # 没有运行中的任务 空间不会再变多
+                    return
+                self.start_task(i, task)
+                running_c += 1
+
+    def adjust_concurrency(self, running_c):
+        if self.concurrency is None:
+            return
+        self.concurrency.observe_running(running_c)
+        result = self.concurrency.maybe_adjust()
+        if result is not None:
+            old_limit, new_limit, throughput = result
+            self.print_to_area(f"⚙️ 吞吐量:{throughput:.2f}x, 并发数 {old_limit} -> {new_limit}", color='green')
+            self.emit("concurrency", old=old_limit, new=new_limit, throughput=round(throughput, 3))
+
+    def handle_progress(self, slot_index, progress):
+        # 把进程的进度 显示到进度条上
+        process_info = self.running_process_list[slot_index]
+        if process_info["process"] is None:
+            return
+        pbar = process_info['pbar']
+        encoded_seconds = FFmpegUtil.progress_seconds(progress)
+        if self.concurrency is not None:
+            self.concurrency.add_encoded_seconds(encoded_seconds - pbar.n)
+        pbar.n = encoded_seconds
+        pbar.set_postfix_str(f"bitrate:{progress.get('bitrate', '')},speed:{progress.get('speed', '')}", refresh=False)
+        process_info['progress'] = progress
+        process_info['dirty'] = True
+
+    def sample_telemetry(self):
+        # 每隔 interval 秒 采样一次所有正在运行的 ffmpeg 进程
+        now = time.time()
+        if self.telemetry is None or not self.telemetry.due(now):
+            return
+        for process_info in self.running_process_list:
+            if process_info["process"] is not None and process_info.get("telemetry") is not None:
+                process_info["telemetry"].sample(now, process_info["progress"])
+
+    def record_telemetry(self, process_info):
+        # 进程结束后 汇总值和时间序列 写入 Run_Task_Telemetry
+        recorder = process_info.get("telemetry")
+        if recorder is None:
+            return
+        process_info["telemetry"] = None
+        summary, series = recorder.finish(time.time(), process_info["progress"])
+        task = process_info['task']
+        self.db.submit(self.db.record_task_telemetry, process_info['run_record_id'],
+                       process_info.get('segment_record_id') if task.get('kind') == 'segment' else None,
+                       task.get('kind', 'file'), summary, series)
+
+    def handle_output(self, slot_index, last_line):
+        # 检查进程的诊断输出中 是否有错误
+        process_info = self.running_process_list[slot_index]
+        if process_info["process"] is None:
+            return
+        lower_line = last_line.lower()
+        if "error" in lower_line or 'missing' in lower_line:
+            self.print_to_area(f'😡 error in output:[{last_line}]', color='red')
+            process_info['output_has_error'] = True # 说明程序出错了
+        else:
+            # self.print_to_area(f'cant process last_line:[{last_line}]', color='red')
+            pass
+
+    def finish_segment(self, group, has_error):
+        # 一个分段结束(完成/失败/略过), 所有分段都结束后 生成拼接任务 或者 记录整个文件失败
+        group['finished_count'] += 1
+        group['failed'] = group['failed'] or has_error
+        if group['finished_count'] < group['segment_count'] or group['bypass']:
+            return
+        if group['failed']:
+            self.fail_segment_group(group)
+            self.print_to_area(f"{group['task']['file_path']} 有分段转码失败", color='red')
+        else:
+            # 拼接任务排在队列最前面, 尽快释放分段占用的磁盘空间
+            self.ready_task_queue.put_front(SegmentSplitter.build_concat_task(group))
+
+    def fail_segment_group(self, group):
+        # 整个文件记录为失败, 删除分段
+        group['failed'] = True
+        self.db.submit(self.db.record_end_run, group['run_record_id'], True, None)
+        self.finish_task_state(group['task']['file_path'], TaskState.FAILED)
+        SegmentSplitter.remove_segments(group)
+        self.done_skip_task_count += 1
+
+    def handle_segment_exit(self, process_info, retcode):
+        has_error = process_info["cancelled"] or process_info["output_has_error"] or retcode != 0
+        self.db.submit(self.db.record_end_segment, process_info['segment_record_id'], has_error)
+        task = process_info['task']
+        self.print_to_area(f"{task['file_path']} 分段 {task['segment_index'] + 1} is exited, "
+                           f"ret code:{retcode}, has_error:{has_error}")
+        self.emit("task_end", file=task['file_path'], kind='segment', segment_index=task['segment_index'],
+                  returncode=retcode, has_error=has_error, cancelled=process_info["cancelled"])
+        self.finish_segment(task['segment_group'], has_error)
+
+    def handle_exit(self, slot_index, retcode):
+        # 运行完毕的 把running置 None, 槽位马上可以开始新的任务
+        # 没有出错的任务 在 ProbeService 的线程池中校验输出文件, 校验完成后 (EVENT_VERIFIED) 由 finish_exit 记录结果
+        process_info = self.running_process_list[slot_index]
+        self.record_telemetry(process_info)
+        if process_info["cancelled"] and process_info["remove_output"]:     # 进程已经退出, 可以删除没有写完的输出文件
+            self.remove_partial_output(process_info['task']['dstfile_path'])
+            process_info["remove_output"] = False
+        if process_info['task'].get('kind') == 'segment':
+            self.handle_segment_exit(process_info, retcode)
+            process_info['process'] = None
+            return
+        if process_info["cancelled"] or retcode != 0:   # 被取消 或 异常退出的任务 记录为出错
+            process_info["output_has_error"] = True
+        # process_info 会被下一个任务重用, 结果需要的信息 复制一份
+        finished = {key: process_info[key] for key in ('process', 'output', 'task', 'run_record_id', 'video_file_id',
+                                                       'output_has_error', 'cancelled', 'start_time')}
+        finished.update(slot=slot_index, retcode=retcode, end_time=time.time())
+        process_info['process'] = None
+        if finished["output_has_error"]:
+            self.finish_exit(finished, None)
+            return
+        # 校验完成之前中断时 下一次启动 先校验输出文件, 不直接删除重新转码
+        task = finished['task']
+        self.db.submit(self.db.journal_task, task['file_path'], TaskState.VERIFYING, task['dstfile_path'],
+                       task['segment_group']['segment_dir'] if task.get('kind') == 'concat' else None,
+                       finished['run_record_id'])
+        self.pending_verify_count += 1
+        self.probe_service.verify(task['dstfile_path']).add_done_callback(
+            lambda future: self.event_queue.put((self.EVENT_VERIFIED, finished, future)))
+
+    def on_verified(self, finished, future):
+        self.pending_verify_count -= 1
+        try:
+            verified = future.result()
+        except Exception as e:  # ffprobe 超时 / 输出文件无法解析, 记录为出错
+            self.print_to_area(f"😱 校验输出文件出错:{finished['task']['dstfile_path']}, {e}", color='red')
+            finished['output_has_error'] = True
+            verified = None
+        self.finish_exit(finished, verified)
+
+    def finish_exit(self, finished, verified):
+        """
+        记录一个 (非分段) 任务的结果
+        :param finished: handle_exit 复制的运行信息
+        :param verified: ProbeService.verify 的结果 (输出视频的 基本信息), 出错的任务为 None
+        """
+        db = self.db
+        task = finished['task']
+        self.done_skip_task_count += 1
+        out_vfile_id = None
+        if verified is not None:
+            out_vfile_id = db.submit(db.insert_video_file_state, verified)
+
+        # 记录运行是否成功
+        db.submit(db.record_end_run, finished['run_record_id'], finished["output_has_error"], out_vfile_id)
+        if finished["cancelled"]:   # 被取消的任务 下一次运行时重新转码
+            state = TaskState.QUEUED
+        else:
+            state = TaskState.FAILED if finished["output_has_error"] else TaskState.SUCCEEDED
+        self.finish_task_state(task['file_path'], state)
+        if not finished["output_has_error"]:
+            if task.get('kind') != 'concat':
+                self.estimator.add(RunEstimator.task_encoder(task), task['v_info'],
+                                   finished['end_time'] - finished['start_time'], verified['v_info'].get('size'))
+            self.success_index.add(task['sha256'], task.get('fingerprint'), finished['video_file_id'],
+                                   os.path.basename(task['file_path']), finished['run_record_id'])
+        if task.get('kind') == 'concat':
+            SegmentSplitter.remove_segments(task['segment_group'])
+
+        self.print_to_area(f"{task['file_path']} is exited, ret code:{finished['retcode']}, has_error:{finished['output_has_error']}")
+        self.emit("task_end", slot=finished['slot'], file=task['file_path'],
+                  kind=task.get('kind', 'file'), returncode=finished['retcode'],
+                  has_error=finished['output_has_error'], cancelled=finished["cancelled"])
+        self.done_process_list.append({
+            "process": finished["process"],
+            "output": finished["output"],
+            "task": task
+        })
+
+    def cancel_task(self, slot_index, graceful_timeout=5):
+        """
+        取消一个正在运行的任务: 停止 ffmpeg 进程组 并删除没有写完的输出文件。
+        进程退出后 输出线程会发出 EXIT 事件, 由 handle_exit 删除输出文件 并记录为出错
+        """
+        self.cancel_tasks([slot_index], graceful_timeout)
+
+    def cancel_tasks(self, slot_index_list, graceful_timeout=5, remove_output=True, wait=False):
+        """
+        :param wait: False: 只发送 q, 之后的 SIGTERM / kill 在后台线程中进行, 不阻塞主循环,
+                     输出文件在 handle_exit 中删除; True: 等待进程全部退出 并删除输出文件 (退出程序时)
+        """
+        process_info_list = [self.running_process_list[i] for i in slot_index_list
+                             if self.running_process_list[i] is not None
+                             and self.running_process_list[i]['process'] is not None]
+        for process_info in process_info_list:
+            process_info['cancelled'] = True
+            process_info['remove_output'] = remove_output
+        if not wait:
+            ProcessControl.stop_all_async([x['process'] for x in process_info_list], graceful_timeout)
+            return
+        ProcessControl.stop_all([x['process'] for x in process_info_list], graceful_timeout)
+        if not remove_output:
+            return
+        for process_info in process_info_list:
+            self.remove_partial_output(process_info['task']['dstfile_path'])
+            process_info['remove_output'] = False
+
+    def remove_partial_output(self, dstfile_path):
+        try:
+            if ProcessControl.remove_partial_output(dstfile_path):
+                self.print_to_area(f"🧹 删除未完成的输出文件:{dstfile_path}")
+        except OSError as e:
+            self.print_to_area(f"删除未完成的输出文件失败:{dstfile_path}, {e}", color='red')
+
+    def refresh_bars(self):
+        # 只刷新有变化的进度条, refresh 只是把文本写入 renderer 的行, 由 renderer 按帧率输出
+        for slot_index, process_info in enumerate(self.running_process_list):
+            if process_info.get('dirty'):
+                if self.lease_client is not None and process_info['task'].get('kind') is None:
+                    self.lease_client.report_progress(process_info['task']['file_path'], process_info['pbar'].n,
+                                                      process_info['pbar'].total)
+                if self.sink is not None:
+                    progress = process_info.get('progress', {})
+                    self.sink.progress(slot_index, file=process_info['task']['file_path'],
+                                       seconds=process_info['pbar'].n, duration=process_info['pbar'].total,
+                                       speed=progress.get('speed'), bitrate=progress.get('bitrate'))
+                else:
+                    process_info['pbar'].refresh()
+                process_info['dirty'] = False
+        total = self.prefiltered_count + self.producer.total_count - self.producer.failed_count
+        if self.process_count_pbar.n != self.done_skip_task_count or self.process_count_pbar.total != total:
+            self.process_count_pbar.total = total
+            self.process_count_pbar.n = self.done_skip_task_count
+            self.process_count_pbar.refresh()
+
+    def submit_full_hash(self, file_path, video_file_id):
+        # 在后台计算全文件sha256, 计算完成后 由主循环写入数据库
+        if self.full_hash_service is not None:
+            self.full_hash_service.submit(file_path, video_file_id)
+
+    def on_full_hash_done(self, file_path, digest, video_file_id):
+        if digest is not None:
+            self.event_queue.put((self.EVENT_HASHED, video_file_id, digest))
+
+    def on_lease_lost(self, file_path_list):
+        """
+        租约已经被其他 worker 领取: 停止正在运行的这些任务, 队列中的 不再开始。
+        输出文件 / 分段目录 可能正在被另一个 worker 写入, 不删除
+        """
+        self.lost_paths.update(file_path_list)
+        slots = []
+        for i, process_info in enumerate(self.running_process_list):
+            if process_info is None or process_info['process'] is None:
+                continue
+            group = process_info['task'].get('segment_group')
+            file_path = group['task']['file_path'] if group is not None else process_info['task']['file_path']
+            if file_path in self.lost_paths:
+                if group is not None:
+                    group['bypass'] = True  # 剩下的分段不再运行, 也不拼接 不删除分段
+                slots.append(i)
+        if slots:
+            self.print_to_area(f"⚠️ 停止 {len(slots)} 个 租约已经失效的任务", color='red')
+            self.cancel_tasks(slots, remove_output=False)
+
+    def handle_event(self, event):
+        if event[0] == self.EVENT_HASHED:
+            self.db.submit(self.db.update_full_sha256, event[1], event[2])
+        elif event[0] == self.EVENT_VERIFIED:
+            self.on_verified(event[1], event[2])
+        elif event[0] == self.EVENT_FILES_FOUND:
+            self.add_files(event[1])
+        elif event[0] == self.EVENT_FILES_ADDED:
+            self.print_to_area(f"📥 监控目录中 新增 {len(event[1])} 个文件", color='green')
+            self.add_files(event[1])
+        elif event[0] == self.EVENT_DISCOVERY_DONE:
+            self.on_discovery_done()
+        elif event[0] == self.EVENT_JOBS_LEASED:
+            self.print_to_area(f"📥 领取了 {len(event[1])} 个任务", color='green')
+            self.add_files(event[1])
+        elif event[0] == self.EVENT_LEASE_LOST:
+            self.on_lease_lost(event[1])
+        elif event[0] == self.EVENT_JOBS_DRAINED:
+            self.producer.close()
+        elif event[0] == self.EVENT_PROGRESS:
+            self.handle_progress(event[1], event[2])
+        elif event[0] == self.EVENT_OUTPUT:
+            self.handle_output(event[1], event[2])
+        elif event[0] == self.EVENT_EXIT:
+            self.handle_exit(event[1], event[2])
+        # EVENT_TASK_READY 只需要唤醒主循环 由 fill_slots 处理
+
+    def prefilter_files(self, file_path_list, output_dir, profiles, skip_existing_output=False):
+        """
+        在 probe 之前 用一次批量查询 去掉已经处理过的文件, 不启动任何子进程:
+        1. (路径, 大小, 修改时间) 没变 且 缓存的指纹 在库中已经转码成功
+        2. skip_existing_output 时 任意一种编码方式的输出文件已经存在, probe 之前还不知道会选择哪一种;
+           输出文件必须是 成功的运行记录 指向的文件 且大小没变, 失败 / 中断的运行 留下的输出文件 不会被略过;
+           worker 模式下 不检查输出文件: 输出目录是共享的, 可能是崩溃的 worker 写了一半的文件
+        略过的文件 用一次 executemany 写入 ByPass_File_Log
+        :return: 还需要 probe 的文件列表
+        """
+        stat_rows = []
+        for item in file_path_list:
+            file_path = os.fspath(item)
+            try:
+                # FileDiscovery 得到的 DirEntry 已经缓存了 stat 结果
+                st = item.stat() if isinstance(item, os.DirEntry) else os.stat(file_path)
+            except OSError:
+                continue    # 文件不存在等错误 留给 producer 报告
+            stat_rows.append((file_path, st.st_size, st.st_mtime_ns))
+        done = self.db.find_done_files(self.conn, stat_rows)
+        skip_existing_output = skip_existing_output and self.lease_client is None
+        succeeded_outputs = {}
+        if skip_existing_output:
+            succeeded_outputs = self.db.find_succeeded_outputs(
+                self.conn, [dst for file_path, _, _ in stat_rows if file_path not in done
+                            for dst in profiles.output_paths(file_path, output_dir)])
+
+        bypass_rows = []
+        for file_path, file_size, _mtime_ns in stat_rows:
+            if file_path in done:
+                sha256, vfile_id, vfile_name, record_id = done[file_path]
+                bypass_rows.append((file_path, file_size, sha256, vfile_id, "prefilter: 文件未变化, 且已经转码成功"))
+                self.emit("task_skipped", file=file_path, reason="already_done")
+                self.print_to_area(f"文件在库中已经转码成功, 略过: {file_path}->video_file_id:{vfile_id}: "
+                                   f"{vfile_name}, run taskid: {record_id}")
+            elif skip_existing_output:
+                for dstfile_path in profiles.output_paths(file_path, output_dir):
+                    if dstfile_path not in succeeded_outputs:
+                        continue
+                    try:
+                        if os.path.getsize(dstfile_path) == succeeded_outputs[dstfile_path]:
+                            bypass_rows.append((file_path, file_size, None, None, "prefilter: 输出文件已存在"))
+                            self.emit("task_skipped", file=file_path, reason="output_exists")
+                            self.print_to_area(f"输出文件已存在, 略过: {file_path}->{dstfile_path}")
+                            break
+                    except OSError:
+                        pass
+        if bypass_rows:
+            self.db.submit(self.db.insert_ByPass_File_Log_many, bypass_rows)
+            future = self.db.submit(self.db.journal_tasks,
+                                    [(row[0], TaskState.SKIPPED, None, None, None) for row in bypass_rows])
+            if self.lease_client is not None:
+                def finish_leases(_future, paths=[row[0] for row in bypass_rows]):
+                    for file_path in paths:
+                        self.lease_client.finish(file_path, TaskState.SKIPPED)
+                future.add_done_callback(finish_leases)
+        skipped = {row[0] for row in bypass_rows}
+        self.prefiltered_count += len(skipped)
+        self.done_skip_task_count += len(skipped)
+        return [p for p in file_path_list if os.fspath(p) not in skipped]
+
+    def run(self, db, file_path_list, output_dir, running_output_dir, global_quality=24, probe_workers=4,
+            probe_cache=None, task_order='fifo', nominal_speed=1.0, splitter=None, full_hash_workers=0,
+            prefilter=True, skip_existing_output=False, watcher=None, profiles=None, estimator=None,
+            disk_policy='throttle', disk_reserve=0, preflight=None, lease_client=None, probe_service=None, telemetry=None):
+        """
+        :param telemetry: TaskTelemetry, 传入时 定时采样每个 ffmpeg 的 CPU 内存 读写字节数 和 进度, 结束时写入 Run_Task_Telemetry
+        :param probe_service: ProbeService, 输入文件的 probe 和 输出文件的校验 在其中运行; 为空时 使用 probe_workers 个线程
+        :param lease_client: LeaseClient, 传入时为 worker 模式: 不使用 file_path_list, 任务从共享的任务表领取
+        :param preflight: SamplePreflight, probe 之后 抽样编码 推算输出大小, 不值得转码的文件 略过
+        :param estimator: RunEstimator, 为空时 只使用 nominal_speed; 在这里从库中读取历史记录
+        :param disk_policy: 输出目录剩余空间不够时 throttle 暂停启动新任务 / refuse 不开始转码 / off 不检查
+        :param disk_reserve: 输出目录至少保留多少字节
+        :param profiles: ProfileEngine, 为每个文件选择编码方式和质量, 为空时 使用内置规则 和 global_quality
+        :param file_path_list: 文件路径 或 os.DirEntry 的列表 / 生成器 (例如 FileDiscovery.walk), 在后台线程中遍历
+        :param watcher: FolderWatcher, 传入时 一直运行: 遍历结束后 监控目录中新写完的文件 加入任务队列, Ctrl+C / SIGTERM 结束
+        :param prefilter: probe 之前 批量去掉已经处理过的文件, 见 prefilter_files
+        :param full_hash_workers: 大于 0 时 在后台线程池中计算输入文件的全文件sha256
+        :param splitter: SegmentSplitter, 传入时 长视频切分成多段 并行转码
+        :param task_order: 任务的出队顺序 fifo / ljf / sjf, 见 TaskOrderQueue
+        :param nominal_speed: 一个 ffmpeg 每秒能转码多少秒 1080p 视频, 用于估算总时长
+        """
+        self.db = db
+        self.nominal_speed = nominal_speed
+        own_probe_service = probe_service is None
+        self.probe_service = probe_service if probe_service is not None else ProbeService(probe_workers)
+        self.pending_verify_count = 0   # 已经结束 还在校验输出文件的任务个数
+        self.telemetry = telemetry
+        if telemetry is not None and not ProcessStats.available():
+            self.print_to_area("没有 /proc 也没有安装 psutil, 只记录转码进度, 不记录 CPU 内存 读写字节数", color='red')
+        self.full_hash_service = None
+        if full_hash_workers > 0:
+            self.full_hash_service = FullHashService(self.on_full_hash_done, full_hash_workers)
+        self.makespan_reported = False
+        self.output_dir = output_dir
+        self.estimator = estimator if estimator is not None else RunEstimator(default_speed=nominal_speed)
+        if disk_policy not in ('throttle', 'refuse', 'off'):
+            raise ValueError(f"unknown disk policy: {disk_policy}, must be one of throttle / refuse / off")
+        self.disk_policy = disk_policy
+        self.disk_reserve = disk_reserve
+        self.refused = False
+        self.waiting_for_space = False
+        self.producer = None
+        self.watcher = watcher
+        self.lease_client = lease_client
+        self.lost_paths = set()     # worker 模式下 租约已经失效的任务
+        self.discovery_done = False
+        self.discovered_count = 0
+        self.discovered_paths = []  # 监控目录模式下 遍历找到的文件, 开始监控时 作为已知文件
+        self.recovered_paths = set()
+        if profiles is None:
+            profiles = ProfileEngine(global_quality)
+        self.profiles = profiles
+        self.prefilter_args = (output_dir, profiles, skip_existing_output) if prefilter else None
+        self.event_queue = queue.Queue()
+        self.running_process_list = [None] * self.max_processes
+        self.done_process_list = []
+        self.done_skip_task_count = 0
+        self.prefiltered_count = 0
+        # 所有写操作 由写线程批量 commit, 主循环只用 self.conn 读
+        own_writer = db.writer is None
+        if own_writer:
+            db.start_writer()
+        try:
+            self.conn = db.get_conn()
+            # 已经转码成功的文件 一次性读入内存, 去重检查不再查库
+            self.success_index = SuccessIndex().load(self.conn)
+            self.estimator.load(self.conn)
+            # 必须在预过滤之前: 中断的任务可能留下了 没有写完的输出文件, 会被当作 "输出文件已存在" 略过
+            recovered = self.recover_interrupted()
+            self.emit("run_start", slots=self.slot_limit(), task_order=task_order)
+            # probe 在后台线程池中进行, 每 probe 完一个文件就放入 ready_task_queue, 转码和 probe 同时进行
+            # 遍历目录 也在后台线程中进行, 找到的文件 由主循环分批 预过滤后 加入 producer, 遍历结束后 producer 才会结束
+            self.producer = TaskProducer(
+                [], output_dir, global_quality, running_output_dir,
+                self.print_to_area, max_workers=probe_workers, probe_cache=probe_cache,
+                notify=self.notify_task_ready, task_queue=TaskOrderQueue(task_order), splitter=splitter,
+                keep_open=True, profiles=profiles, preflight=preflight, on_load_failed=self.on_load_failed,
+                probe_service=self.probe_service
+            ).start()
+            self.ready_task_queue = self.producer.task_queue
+            if recovered:
+                self.add_files(recovered, front=True)
+            threading.Thread(target=self.discover, args=(file_path_list,), name="discovery", daemon=True).start()
+
+            for i in range(self.max_processes):  # 初始化进度条 和 进程信息
+                self.running_process_list[i] = {
+                    "process": None,
+                    "output": None,
+                    "pbar": self.new_bar(self.bar_start_line + i, 100),
+                    "task": None,
+                    "output_has_error": False, # 每次从消息队列中 取出ffmpeg进程的输出时 判断下文本是否包含错误的关键字
+                    "run_record_id": None,      # 在任务开始运行后 数据库记录下开始运行的时间点 返回 记录的id 后续运行结束的结果 也存回这个id
+                    "dirty": False,             # 进度条有变化 需要刷新
+                }
+            self.process_count_pbar = self.new_bar(self.bar_start_line + self.max_processes,
+                                                   self.prefiltered_count + self.producer.total_count)
+            self.process_count_pbar.set_description_str("已经完成的任务个数")
+
+            # 主循环由事件驱动: 没有事件时阻塞等待, 进程输出/退出 或 producer 放入任务时立刻处理
+            while True:
+                self.fill_slots()
+                self.refresh_bars()
+
+                # producer 结束 且 readytask为空 且 running为空 且 输出文件都校验完了 就退出循环
+                # 先判断 producer 是否结束 再判断队列是否为空, 避免两次判断之间 producer 又放入了任务
+                running_c = self.running_count()
+                if (self.producer.is_done() and self.ready_task_queue.empty() and running_c == 0
+                        and self.pending_verify_count == 0):
+                    break
+                if self.refused and running_c == 0 and self.pending_verify_count == 0:
                     break
-                time.sleep(0.05)
+                self.adjust_concurrency(running_c)
+                self.sample_telemetry()
+
+                try:
+                    # timeout 是为了让 windows 下阻塞的 get 能响应 Ctrl+C, 以及按时检查是否需要调整并发数
+                    event = self.event_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self.handle_event(event)
+                # 把已经积攒的事件一次处理完 再刷新进度条
+                while True:
+                    try:
+                        event = self.event_queue.get(block=False)
+                    except queue.Empty:
+                        break
+                    self.handle_event(event)
         except KeyboardInterrupt as ke:
             self.print_to_area("用户键盘退出")
-            # 还需要杀掉一些进程
-            for p in running_process_list:
-                if p['process'] is not None:
-                    p['process'].kill()
+            # 停止所有正在运行的 ffmpeg, 删除没有写完的输出文件, 运行记录标记为出错
+            running_slots = [i for i, p in enumerate(self.running_process_list)
+                             if p is not None and p['process'] is not None]
+            self.cancel_tasks(running_slots, wait=True)
+            # Task_Journal 中保持 running, 下一次启动时 作为中断的任务 排在最前面重新转码
+            # worker 模式下 输出文件已经删除, 任务放回任务表 由任意一个 worker 重新领取
+            # 同一个文件的多个分段 可能同时在运行, 每个文件只记录一次 只删除一次分段目录
+            groups = {}
+            for i in running_slots:
+                process_info = self.running_process_list[i]
+                self.record_telemetry(process_info)
+                process_info['process'] = None
+                group = process_info['task'].get('segment_group')
+                if group is not None:
+                    if id(group) in groups:
+                        continue
+                    groups[id(group)] = group
+                self.db.submit(self.db.record_end_run, process_info['run_record_id'], True, None)
+                if self.lease_client is not None:
+                    self.finish_task_state((group['task'] if group is not None else process_info['task'])['file_path'],
+                                           TaskState.QUEUED)
+            for group in groups.values():
+                SegmentSplitter.remove_segments(group)
         except Exception as e:
             self.print_to_area("其他类型的报错。。")
             self.print_to_area(f"Error type: {type(e).__name__}")
             self.print_to_area(f"Error message: {e}")
             self.print_to_area("Stack trace:")
-            TerminalOutput.move_cursor(self.print_buff_size + self.print_start_line + 3, 0)
-            traceback.print_exc()
-            TerminalOutput.move_cursor(self.bar_start_line, 0)
+            self.print_exc_to_area()
 
+        if watcher is not None:
+            watcher.stop()
+        if self.producer is not None:
+            self.producer.close()
+        # 等待 输出文件的校验 和 后台的全文件sha256 计算完成 并写入数据库
+        if own_probe_service:
+            self.probe_service.shutdown(wait=True)
+        if self.full_hash_service is not None:
+            self.full_hash_service.shutdown(wait=True)
+        while self.pending_verify_count > 0 or not self.event_queue.empty():
+            event = self.event_queue.get()
+            if event[0] in (self.EVENT_HASHED, self.EVENT_VERIFIED):
+                self.handle_event(event)
+        # 等待所有写操作 commit
+        if own_writer:
+            db.close_writer()
+        if lease_client is not None:
+            lease_client.stop()     # 写回已经结束的任务, 没有完成的任务 放回任务表
+
+        self.emit("run_end", done=self.done_skip_task_count,
+                  failed_to_load=self.producer.failed_count if self.producer is not None else 0)
         # 进度条关闭
-        for p in running_process_list:
-            p['pbar'].close()
+        for p in self.running_process_list:
+            if p is not None:
+                p['pbar'].close()
+
+
+def raise_keyboard_interrupt(signum, frame):
+    # headless 模式下 SIGTERM (systemd / docker stop) 按 Ctrl+C 处理: 停止所有 ffmpeg 并记录
+    raise KeyboardInterrupt
 
 
 def read_config(config_path):
@@ -293,9 +1108,12 @@ def read_config(config_path):
     return config
 
 
-# TODO 运行任务前 计算所需空间大小 检测是否足够空间
 if __name__ == "__main__":
     config = read_config(os.path.join(".", "config.ini"))
+    # standalone: 单机运行 / coordinator: 只加入任务 不转码 / worker: 从任务表领取任务 转码, 命令行参数优先
+    role = sys.argv[1] if len(sys.argv) > 1 else config.get("Distributed", "role", fallback="standalone")
+    if role not in ("standalone", "coordinator", "worker"):
+        raise ValueError(f"unknown role: {role}, must be one of standalone / coordinator / worker")
     max_processes = config.getint("Input", "max_processes")
     print_buff_size = config.getint("Input", "print_buff_size")
     video_dir_path = config.get("Input", "video_dir_path")
@@ -303,6 +1121,64 @@ if __name__ == "__main__":
     quality = config.getint("Output", "global_quality")
     database_path = config.get("Input", "database_path")
     running_output_dir = config.get("Output", "running_output_dir")
+    probe_workers = config.getint("Input", "probe_workers", fallback=4)
+    probe_service = ProbeService(
+        max_workers=config.getint("Probe", "max_workers", fallback=probe_workers),
+        timeout=config.getfloat("Probe", "timeout", fallback=300),
+        fast_headers=config.getboolean("Probe", "fast_headers", fallback=False),
+    )
+    telemetry = None
+    if config.getboolean("Telemetry", "enabled", fallback=True):
+        telemetry = TaskTelemetry(
+            interval=config.getfloat("Telemetry", "interval", fallback=5),
+            max_points=config.getint("Telemetry", "max_points", fallback=240),
+        )
+    max_fps = config.getint("Input", "max_fps", fallback=10)
+    headless = config.getboolean("Headless", "enabled", fallback=False)
+    event_sink_target = config.get("Headless", "event_sink", fallback="-")
+    progress_interval = config.getfloat("Headless", "progress_interval", fallback=1.0)
+    discovery = FileDiscovery(
+        include=FileDiscovery.split_patterns(config.get("Discovery", "include", fallback="")),
+        exclude=FileDiscovery.split_patterns(config.get("Discovery", "exclude", fallback="")),
+        min_size=int(config.getfloat("Discovery", "min_size_mb", fallback=0) * 1024 * 1024),
+        recursive=config.getboolean("Discovery", "recursive", fallback=False),
+        sort_names=config.getboolean("Discovery", "sort_names", fallback=False),
+        exclude_dirs=[video_out_path, running_output_dir],  # 输出目录可能在输入目录中
+    )
+    watcher = None
+    if config.getboolean("Watch", "enabled", fallback=False):
+        watcher = FolderWatcher(
+            video_dir_path,
+            stable_seconds=config.getfloat("Watch", "stable_seconds", fallback=10),
+            poll_interval=config.getfloat("Watch", "poll_interval", fallback=2),
+            use_watchdog=config.getboolean("Watch", "use_watchdog", fallback=True),
+            discovery=discovery,
+        )
+    scheduler_mode = config.get("Scheduler", "mode", fallback="fixed")
+    task_order = config.get("Scheduler", "task_order", fallback="fifo")
+    nominal_speed = config.getfloat("Scheduler", "nominal_speed", fallback=1.0)
+    full_hash_workers = config.getint("Hash", "full_hash_workers", fallback=0)
+    prefilter = config.getboolean("Prefilter", "enabled", fallback=True)
+    skip_existing_output = config.getboolean("Prefilter", "skip_existing_output", fallback=False)
+    splitter = None
+    if config.getboolean("Split", "enabled", fallback=False):
+        splitter = SegmentSplitter(
+            min_duration=config.getint("Split", "min_duration", fallback=3600),
+            segment_count=config.getint("Split", "segment_count", fallback=max_processes),
+            keyframe_search_seconds=config.getint("Split", "keyframe_search_seconds", fallback=30),
+        )
+    profiles = ProfileEngine.from_config(config, quality)
+    estimator = RunEstimator(
+        default_speed=nominal_speed,
+        default_ratio=config.getfloat("Estimate", "default_ratio", fallback=0.5),
+        min_samples=config.getint("Estimate", "min_samples", fallback=3),
+    )
+    disk_policy = config.get("Estimate", "disk_policy", fallback="throttle")
+    disk_reserve = int(config.getfloat("Estimate", "reserve_mb", fallback=1024) * 1024 * 1024)
+    preflight_enabled = config.getboolean("Preflight", "enabled", fallback=False)
+    cache_enabled = config.getboolean("Cache", "enabled", fallback=True)
+    cache_max_entries = config.getint("Cache", "max_entries", fallback=100000)
+    cache_max_age_days = config.getint("Cache", "max_age_days", fallback=90)
 
     database_path = os.path.abspath(database_path)
     running_output_dir = os.path.abspath(running_output_dir)
@@ -311,15 +1187,78 @@ if __name__ == "__main__":
         if not os.path.exists(pp):
             os.makedirs(pp, exist_ok=False)  # 父目录不存在会报错
 
-    video_file_list = FFmpegUtil.load_video_from_dir(video_dir_path)
-    manager = FFmpegManager(max_processes=max_processes, print_buff_size=print_buff_size)
+    # 生成器: 边遍历边交给 manager
+    video_file_list = discovery.walk(video_dir_path)
+    concurrency = None
+    if scheduler_mode == "adaptive":
+        # max_processes 作为初始并发数, 在 [min_processes, max_processes_limit] 之间调整
+        concurrency = AdaptiveConcurrency(
+            config.getint("Scheduler", "min_processes", fallback=1),
+            config.getint("Scheduler", "max_processes_limit", fallback=max_processes),
+            initial_slots=max_processes,
+            adjust_interval=config.getint("Scheduler", "adjust_interval", fallback=30),
+        )
+        max_processes = concurrency.max_slots
+    sink = None
+    if headless:
+        sink = JsonLineSink.open(event_sink_target, progress_interval)
+        signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    job_store = None
+    lease_client = None
+    # 多台机器共用的库 在网络文件系统上, 不能使用 WAL
+    journal_mode = "WAL" if role == "standalone" else "DELETE"
+    if role != "standalone":
+        job_store = JobStore(
+            database_path,
+            lease_seconds=config.getfloat("Distributed", "lease_seconds", fallback=60),
+            max_attempts=config.getint("Distributed", "max_attempts", fallback=3),
+        )
+    if role == "coordinator":
+        def print_line(text, color='black'):
+            print(text)
+        coordinator_print = sink.log if sink is not None else print_line
+        MyDB(database_path, coordinator_print, journal_mode).init_db()
+        JobCoordinator(job_store, coordinator_print,
+                       status_interval=config.getfloat("Distributed", "status_interval", fallback=10),
+                       emit=sink.emit if sink is not None else None).run(video_file_list, watcher)
+        if sink is not None:
+            sink.close()
+        sys.exit(0)
+    if role == "worker":
+        lease_client = LeaseClient(
+            job_store,
+            heartbeat_interval=config.getfloat("Distributed", "heartbeat_interval", fallback=15),
+            poll_interval=config.getfloat("Distributed", "poll_interval", fallback=2),
+            prefetch=config.getint("Distributed", "prefetch", fallback=1),
+            exit_when_done=config.getboolean("Distributed", "exit_when_done", fallback=False),
+        )
+        video_file_list = []    # 任务由协调节点加入
+        watcher = None
+    manager = FFmpegManager(max_processes=max_processes, print_buff_size=print_buff_size, concurrency=concurrency,
+                            max_fps=max_fps, sink=sink)
 
-    db = MyDB(database_path, manager.print_to_area)
+    db = MyDB(database_path, manager.print_to_area, journal_mode)
     db.init_db()
+    probe_cache = None
+    if cache_enabled:
+        probe_cache = ProbeCache(database_path, cache_max_entries, cache_max_age_days).load()
+    preflight = None
+    if preflight_enabled:
+        preflight = SamplePreflight(
+            database_path,
+            sample_count=config.getint("Preflight", "sample_count", fallback=3),
+            sample_seconds=config.getfloat("Preflight", "sample_seconds", fallback=5),
+            max_ratio=config.getfloat("Preflight", "max_ratio", fallback=0.95),
+            min_duration=config.getfloat("Preflight", "min_duration", fallback=120),
+            timeout=config.getfloat("Preflight", "timeout", fallback=120),
+            max_parallel=config.getint("Preflight", "max_parallel", fallback=1),
+        ).load()
 
-    manager.run(db, video_file_list, video_out_path, running_output_dir, quality )
-    TerminalOutput.move_cursor(
-        manager.max_processes + manager.print_buff_size + 6,
-        1
-    )
-    a = input("")
+    manager.run(db, video_file_list, video_out_path, running_output_dir, quality, probe_workers, probe_cache,
+                task_order, nominal_speed, splitter, full_hash_workers, prefilter, skip_existing_output, watcher,
+                profiles, estimator, disk_policy, disk_reserve, preflight, lease_client, probe_service,
+                telemetry)
+    probe_service.shutdown(wait=True)
+    manager.close_output_area()
+    if not headless:
+        a = input("")
@@ -3,6 +3,7 @@ import streamlit as st
 
 pg = st.navigation([
     st.Page("success_task_page.py", title="运行情况", icon="🔥"),
+    st.Page("telemetry_page.py", title="运行数据", icon="📈"),
     # st.Page("compass_rate_view.py", title="压缩率查看")
 ])
 pg.run()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import streamlit as st
+from sqlalchemy.sql import text
+import pandas as pd
+import json
+import datetime
+import altair as alt
+
+st.set_page_config(layout="wide")
+conn = st.connection('video_log', type='sql')
+timestamp_to_str = lambda x: datetime.datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M:%S")
+toMB = lambda x: None if pd.isna(x) else round(int(x) / 1024 / 1024, 1)
+
+with (conn.session as s):
+
+    def get_telemetry_list():
+        '''
+        每个 ffmpeg 进程的 资源使用 和 转码速度, 分段转码时 每一段一行
+        '''
+        rst = s.execute(text('''
+            select
+                tm.id, input_video.file_name, tm.task_kind, tm.create_time,
+                input_video.video_codec as "input_codec", input_video.video_width, input_video.video_height,
+                tm.wall_seconds, tm.encoded_seconds, tm.avg_speed, tm.min_speed, tm.avg_fps, tm.bitrate_kbps,
+                tm.cpu_seconds, tm.cpu_percent, tm.peak_rss, tm.read_bytes, tm.write_bytes,
+                record.output_has_error, record.id as "record_id"
+            from Run_Task_Telemetry tm
+            left join Run_Task_Record record on tm.run_record_id=record.id
+            left join Video_File_State input_video on record.video_file_id=input_video.id
+            order by tm.create_time desc
+        '''))
+        df = pd.DataFrame(rst)
+        if df.empty:
+            return df
+        df["create_time"] = df["create_time"].apply(timestamp_to_str)
+        df["peak_rss_mb"] = df["peak_rss"].apply(toMB)
+        df["read_mb"] = df["read_bytes"].apply(toMB)
+        df["write_mb"] = df["write_bytes"].apply(toMB)
+        return df.drop(columns=["peak_rss", "read_bytes", "write_bytes"])
+
+    def get_series(telemetry_id):
+        rst = s.execute(text('select series from Run_Task_Telemetry where id=:id'), {'id': telemetry_id}).fetchone()
+        series = json.loads(rst[0]) if rst is not None and rst[0] else {"columns": [], "rows": []}
+        return pd.DataFrame(series["rows"], columns=series["columns"])
+
+
+    df = get_telemetry_list()
+    if df.empty:
+        st.markdown("还没有运行数据, 配置文件中 [Telemetry] enabled = true 后运行")
+        st.stop()
+
+    st.markdown(f"## 主机 \n最近 {df.shape[0]} 个进程, "
+                f"内存峰值最大: {df['peak_rss_mb'].max()}MB, 平均 CPU 使用率: {round(df['cpu_percent'].mean(), 1)}%")
+
+    st.markdown("## 最慢的任务 (avg_speed 升序)")
+    slow_count = st.slider("显示个数", 5, 100, 20)
+    slow_df = df[df["avg_speed"].notna()].sort_values(by="avg_speed").head(slow_count)
+    st.dataframe(slow_df, use_container_width=True)
+
+    st.markdown("## 速度 与 分辨率")
+    scatter_chart = alt.Chart(df[df["avg_speed"].notna()]).mark_circle().encode(
+        x=alt.X('video_height:Q', title="高度"),
+        y=alt.Y('avg_speed:Q', title="平均速度", scale=alt.Scale(type='symlog')),
+        color='input_codec:N',
+        tooltip=['file_name', 'task_kind', 'avg_speed', 'cpu_percent', 'peak_rss_mb'],
+    )
+    st.altair_chart(scatter_chart, use_container_width=True)
+
+    st.markdown("## 时间序列")
+    telemetry_id = st.selectbox(
+        "选择一个进程",
+        df["id"],
+        format_func=lambda x: f"{x} {df[df['id'] == x]['file_name'].iloc[0]} ({df[df['id'] == x]['task_kind'].iloc[0]})"
+    )
+    series_df = get_series(telemetry_id)
+    if not series_df.empty:
+        series_df["rss_mb"] = series_df["rss"].apply(toMB)
+        for column, title in (("speed", "speed"), ("cpu_percent", "CPU %"), ("rss_mb", "内存 MB"), ("fps", "fps")):
+            st.altair_chart(alt.Chart(series_df).mark_line().encode(
+                x=alt.X('t:Q', title="秒"),
+                y=alt.Y(f'{column}:Q', title=title),
+            ).properties(height=160), use_container_width=True)